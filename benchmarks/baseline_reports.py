@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""Report pipelines as the helpers ran them before pharma.reports.
+
+They are the "before" side of benchmarks.reports: each starts from the
+collection the aggregate.py or aggregations.py helper aggregated and
+joins whole documents. Frozen; do not use them outside the benchmarks.
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Tuple
+
+from pharma.reports import Report
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+Pipeline = List[Dict[str, Any]]
+
+
+def _lookup(collection: str, local: str, foreign: str, as_field: str):
+    return [
+        {
+            "$lookup": {
+                "from": collection,
+                "localField": local,
+                "foreignField": foreign,
+                "as": as_field,
+            }
+        },
+        {"$unwind": f"${as_field}"},
+    ]
+
+
+def products_with_stock() -> Pipeline:
+    return [
+        *_lookup("stocks", "id", "product_id", "stock_info"),
+        {
+            "$project": {
+                "_id": 0,
+                "id": 1,
+                "name": 1,
+                "category": 1,
+                "expiration_date": 1,
+                "unit_price": 1,
+                "quantity": "$stock_info.quantity",
+                "last_update": "$stock_info.last_update",
+                "location": "$stock_info.location",
+            }
+        },
+    ]
+
+
+def products_near_expiry(months: int = 3) -> Pipeline:
+    now = datetime.utcnow()
+    return [
+        {
+            "$match": {
+                "expiration_date": {"$lte": now + timedelta(days=30 * months)}
+            }
+        },
+        {
+            "$project": {
+                "id": 1,
+                "name": 1,
+                "expiration_date": 1,
+                "jours_restants": {
+                    "$divide": [
+                        {"$subtract": ["$expiration_date", now]},
+                        DAY_MS,
+                    ]
+                },
+            }
+        },
+    ]
+
+
+def products_below_critical_threshold() -> Pipeline:
+    return [
+        *_lookup("stocks", "id", "product_id", "stock"),
+        *_lookup("stock_thresholds", "id", "product_id", "threshold"),
+        {
+            "$match": {
+                "$expr": {
+                    "$lt": ["$stock.quantity", "$threshold.critical_stock"]
+                }
+            }
+        },
+        {
+            "$project": {
+                "id": 1,
+                "name": 1,
+                "quantity": "$stock.quantity",
+                "critical_stock": "$threshold.critical_stock",
+            }
+        },
+    ]
+
+
+def total_stock_value() -> Pipeline:
+    return [
+        *_lookup("stocks", "id", "product_id", "stock"),
+        {
+            "$project": {
+                "total_value": {
+                    "$multiply": ["$unit_price", "$stock.quantity"]
+                }
+            }
+        },
+        {
+            "$group": {
+                "_id": None,
+                "valeur_totale_stock": {"$sum": "$total_value"},
+            }
+        },
+    ]
+
+
+def stock_statistics_by_category() -> Pipeline:
+    return [
+        *_lookup("stocks", "id", "product_id", "stock"),
+        {
+            "$group": {
+                "_id": "$category",
+                "nombre_de_produits": {"$sum": 1},
+                "quantite_totale": {"$sum": "$stock.quantity"},
+            }
+        },
+        {"$sort": {"quantite_totale": -1}},
+    ]
+
+
+def pre_order_forecast(months: int = 3) -> Pipeline:
+    return [
+        {
+            "$match": {
+                "movement_type": "SORTIE",
+                "date": {
+                    "$gte": datetime.utcnow() - timedelta(days=30 * months)
+                },
+            }
+        },
+        {
+            "$group": {
+                "_id": "$product_id",
+                "total_consumption": {"$sum": "$quantity"},
+                "movement_count": {"$sum": 1},
+            }
+        },
+        *_lookup("products", "_id", "id", "product_info"),
+        {
+            "$project": {
+                "product_id": "$_id",
+                "average_consumption": {
+                    "$divide": ["$total_consumption", "$movement_count"]
+                },
+                "category": "$product_info.category",
+            }
+        },
+    ]
+
+
+def critical_threshold_alerts() -> Pipeline:
+    return [
+        *_lookup("stock_thresholds", "product_id", "product_id", "threshold"),
+        {
+            "$match": {
+                "$expr": {"$lt": ["$quantity", "$threshold.critical_stock"]}
+            }
+        },
+        {
+            "$project": {
+                "product_id": 1,
+                "current_stock": "$quantity",
+                "critical_threshold": "$threshold.critical_stock",
+            }
+        },
+    ]
+
+
+def deliveries() -> Pipeline:
+    return [
+        {"$match": {"movement_type": "ENTREE"}},
+        {
+            "$group": {
+                "_id": "$product_id",
+                "total_received": {"$sum": "$quantity"},
+                "delivery_count": {"$sum": 1},
+            }
+        },
+        *_lookup("products", "_id", "id", "product_info"),
+        {
+            "$project": {
+                "product_id": "$_id",
+                "total_received": 1,
+                "batch_number": "$product_info.batch_number",
+                "expiration_date": "$product_info.expiration_date",
+            }
+        },
+    ]
+
+
+def expiring_products(days_limit: int = 30) -> Pipeline:
+    now = datetime.utcnow()
+    return [
+        {
+            "$match": {
+                "expiration_date": {"$lte": now + timedelta(days=days_limit)}
+            }
+        },
+        *_lookup("stocks", "id", "product_id", "stock_info"),
+        {
+            "$project": {
+                "product_id": "$id",
+                "name": 1,
+                "expiration_date": 1,
+                "current_stock": "$stock_info.quantity",
+                "days_until_expiry": {
+                    "$divide": [
+                        {"$subtract": ["$expiration_date", now]},
+                        DAY_MS,
+                    ]
+                },
+            }
+        },
+    ]
+
+
+def inventory_report() -> Pipeline:
+    return [
+        *_lookup("stocks", "id", "product_id", "stock_info"),
+        {
+            "$group": {
+                "_id": "$category",
+                "total_products": {"$sum": 1},
+                "total_quantity": {"$sum": "$stock_info.quantity"},
+                "products": {
+                    "$push": {
+                        "product_id": "$id",
+                        "name": "$name",
+                        "quantity": "$stock_info.quantity",
+                    }
+                },
+            }
+        },
+    ]
+
+
+def replenishment_suggestions() -> Pipeline:
+    return [
+        *_lookup("stocks", "id", "product_id", "stock_info"),
+        *_lookup("stock_thresholds", "id", "product_id", "threshold"),
+        {
+            "$match": {
+                "$expr": {
+                    "$lt": [
+                        "$stock_info.quantity",
+                        "$threshold.minimum_stock",
+                    ]
+                }
+            }
+        },
+        {
+            "$project": {
+                "product_id": "$id",
+                "current_stock": "$stock_info.quantity",
+                "minimum_stock": "$threshold.minimum_stock",
+                "suggested_quantity": {
+                    "$subtract": [
+                        "$threshold.minimum_stock",
+                        "$stock_info.quantity",
+                    ]
+                },
+            }
+        },
+    ]
+
+
+def performance_report() -> Pipeline:
+    return [
+        {"$match": {"movement_type": {"$in": ["SORTIE", "RUPTURE"]}}},
+        {
+            "$group": {
+                "_id": "$product_id",
+                "total_exits": {
+                    "$sum": {
+                        "$cond": [
+                            {"$eq": ["$movement_type", "SORTIE"]},
+                            "$quantity",
+                            0,
+                        ]
+                    }
+                },
+                "total_ruptures": {
+                    "$sum": {
+                        "$cond": [
+                            {"$eq": ["$movement_type", "RUPTURE"]},
+                            1,
+                            0,
+                        ]
+                    }
+                },
+            }
+        },
+        *_lookup("products", "_id", "id", "product_info"),
+        {
+            "$project": {
+                "product_id": "$_id",
+                "name": "$product_info.name",
+                "category": "$product_info.category",
+                "total_exits": 1,
+                "total_ruptures": 1,
+            }
+        },
+        {"$sort": {"total_exits": -1}},
+        {"$limit": 5},
+    ]
+
+
+# Collection each baseline pipeline ran on, and its builder.
+BASELINE: Dict[Report, Tuple[str, Callable[[], Pipeline]]] = {
+    Report.products_with_stock: ("products", products_with_stock),
+    Report.products_near_expiry: ("products", products_near_expiry),
+    Report.products_below_critical_threshold: (
+        "products",
+        products_below_critical_threshold,
+    ),
+    Report.total_stock_value: ("products", total_stock_value),
+    Report.stock_statistics_by_category: (
+        "products",
+        stock_statistics_by_category,
+    ),
+    Report.pre_order_forecast: ("movements", pre_order_forecast),
+    Report.critical_threshold_alerts: ("stocks", critical_threshold_alerts),
+    Report.deliveries: ("movements", deliveries),
+    Report.expiring_products: ("products", expiring_products),
+    Report.inventory_report: ("products", inventory_report),
+    Report.replenishment_suggestions: ("products", replenishment_suggestions),
+    Report.performance_report: ("movements", performance_report),
+}
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+import statistics
+import time
+from typing import Callable, Dict, List
+
+from pymongo import MongoClient
+from pymongo.database import Database
+
+from pharma.settings import SETTINGS
+
+BENCH_DB = f"{SETTINGS.mongodb_name}_bench"
+
+
+def bench_db() -> Database:
+    """Return the scratch database used by the benchmarks."""
+    return MongoClient(SETTINGS.mongodb_url)[BENCH_DB]
+
+
+def timeit(func: Callable, repeat: int = 5) -> Dict[str, float]:
+    """Run func repeat times and return latency percentiles in ms."""
+    samples: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "p50": statistics.median(samples),
+        "p99": (
+            statistics.quantiles(samples, n=100, method="inclusive")[98]
+            if len(samples) > 1
+            else samples[0]
+        ),
+        "max": samples[-1],
+    }
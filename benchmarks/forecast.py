@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Forecast latency per catalogue size: N+1 lookups vs one pipeline.
+
+Usage: python -m benchmarks.forecast --sizes 100 --sizes 1000
+Needs a MongoDB reachable at MONGODB_URL; data goes to a scratch database.
+"""
+
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import List
+
+import typer
+from pymongo.database import Database
+
+from benchmarks.common import bench_db, timeit
+from pharma.pipelines import forecast_consumption_pipeline
+
+
+def seed(db: Database, products: int, movements_per_product: int = 20):
+    """Fill the scratch database with stocks and SORTIE movements."""
+    db.stocks.drop()
+    db.movements.drop()
+    now = datetime.utcnow()
+    db.stocks.insert_many(
+        {"product_id": f"P{i}", "quantity": random.randint(0, 50)}
+        for i in range(products)
+    )
+    db.movements.insert_many(
+        {
+            "movement_type": "SORTIE",
+            "product_id": f"P{i}",
+            "quantity": random.randint(1, 10),
+            "date": now - timedelta(days=random.randint(0, 89)),
+        }
+        for i in range(products)
+        for _ in range(movements_per_product)
+    )
+    db.stocks.create_index("product_id")
+    db.movements.create_index([("movement_type", 1), ("date", 1)])
+
+
+def legacy_forecast(db: Database, months: int = 3) -> List[dict]:
+    """The pre-pipeline implementation: one find_one per product."""
+    cutoff_date = datetime.utcnow() - timedelta(days=30 * months)
+    consumption = defaultdict(int)
+    for m in db.movements.find(
+        {"movement_type": "SORTIE", "date": {"$gte": cutoff_date}}
+    ):
+        consumption[m["product_id"]] += m["quantity"]
+    forecasts = []
+    for product_id, total in consumption.items():
+        average = total / months
+        stock = db.stocks.find_one({"product_id": product_id}) or {
+            "quantity": 0
+        }
+        forecasts.append(
+            {
+                "product_id": product_id,
+                "average_consumption": average,
+                "suggested_quantity": max(
+                    0, int(average * 2 - stock["quantity"])
+                ),
+            }
+        )
+    return forecasts
+
+
+def pipeline_forecast(db: Database, months: int = 3) -> List[dict]:
+    return list(db.movements.aggregate(forecast_consumption_pipeline(months)))
+
+
+def main(
+    sizes: List[int] = typer.Option([100, 1000, 10000]),
+    repeat: int = 5,
+):
+    db = bench_db()
+    typer.echo(f"{'products':>10} {'legacy p50':>12} {'pipeline p50':>14}")
+    for size in sizes:
+        seed(db, size)
+        legacy = timeit(lambda: legacy_forecast(db), repeat)
+        pipeline = timeit(lambda: pipeline_forecast(db), repeat)
+        typer.echo(
+            f"{size:>10} {legacy['p50']:>10.1f}ms {pipeline['p50']:>12.1f}ms"
+        )
+    db.client.drop_database(db.name)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Forecasting engine time per catalogue size, without MongoDB.
+
+Usage: python -m benchmarks.forecasting --products 50000
+Demand is synthetic: a weekly pattern for fast movers and sparse Poisson
+exits for the intermittent long tail.
+"""
+
+import time
+
+import numpy as np
+import typer
+
+from pharma.services.forecasting import MODELS, select_models
+
+
+def synthetic_demand(products: int, days: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    rate = rng.gamma(0.5, 2.0, size=(products, 1))
+    weekly = 1 + 0.3 * np.sin(2 * np.pi * np.arange(days) / 7)
+    return rng.poisson(rate * weekly).astype(float)
+
+
+def main(
+    products: int = typer.Option(50_000, help="Number of products."),
+    days: int = typer.Option(180, help="Days of history."),
+    horizon: int = typer.Option(30, help="Days to forecast."),
+):
+    demand = synthetic_demand(products, days)
+    start = time.perf_counter()
+    best, _ = select_models(demand, horizon)
+    elapsed = time.perf_counter() - start
+    typer.echo(f"{products} products x {days} days: {elapsed:.2f}s")
+    for index, name in enumerate(MODELS):
+        typer.echo(f"{name:>13}: {int((best == index).sum())} products")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Completion throughput of the configured LLM backend.
+
+Usage: python -m benchmarks.llm --requests 16 --concurrency 4
+Sends the same kind of prompt as /llm/kpi, bypassing the response cache,
+and reports tokens per second, per core for the llama_cpp backend. The
+prompts all differ, so llama_cpp deduplicates none of them.
+"""
+
+import asyncio
+import time
+
+import typer
+
+from pharma.services.llm import COMPLETION_PARAMS, SYSTEM_PROMPT
+from pharma.services.llm_backends import LlamaCppBackend, create_backend
+
+PROMPT = (
+    "Voici les KPI du mois :\n- Total de ruptures : {i}\n"
+    "- Total des sorties : {total}\n- Produits les plus sortis : P1, P2\n"
+    "Analyse ces KPI et donne trois recommandations."
+)
+
+
+async def measure(requests: int, concurrency: int) -> dict:
+    backend = create_backend()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> int:
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            # Distinct prompts, so the backend cannot merge requests.
+            {"role": "user", "content": PROMPT.format(i=i, total=i * 37)},
+        ]
+        async with semaphore:
+            completion = await backend.complete(messages, COMPLETION_PARAMS)
+        return completion.completion_tokens
+
+    start = time.perf_counter()
+    try:
+        tokens = sum(await asyncio.gather(*map(one, range(requests))))
+    finally:
+        await backend.close()
+    elapsed = time.perf_counter() - start
+
+    report = {
+        "backend": type(backend).__name__,
+        "model": backend.model,
+        "requests": requests,
+        "tokens": tokens,
+        "seconds": round(elapsed, 2),
+        "tokens_per_second": round(tokens / elapsed, 2),
+    }
+    if isinstance(backend, LlamaCppBackend):
+        cores = backend.workers * backend.threads
+        report["cores"] = cores
+        report["tokens_per_second_per_core"] = round(
+            tokens / elapsed / cores, 2
+        )
+    return report
+
+
+def main(
+    requests: int = typer.Option(16, help="Completions to request."),
+    concurrency: int = typer.Option(4, help="Requests in flight."),
+):
+    for key, value in asyncio.run(measure(requests, concurrency)).items():
+        typer.echo(f"{key:>27}: {value}")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Report latency per catalogue size: baseline pipelines vs pharma.reports.
+
+Usage: python -m benchmarks.reports --sizes 1000 --sizes 10000
+Needs a MongoDB reachable at MONGODB_URL; data goes to a scratch database.
+"""
+
+import random
+from datetime import datetime, timedelta
+from typing import List
+
+import typer
+from pymongo.database import Database
+
+from benchmarks.baseline_reports import BASELINE
+from benchmarks.common import bench_db, timeit
+from pharma.indexes import INDEXES
+from pharma.reports import REPORTS, Report
+
+
+def seed(db: Database, products: int, movements_per_product: int = 10):
+    """Fill the scratch database with a catalogue and its movements."""
+    for collection in ("products", "stocks", "stock_thresholds", "movements"):
+        db[collection].drop()
+    now = datetime.utcnow()
+    ids = [f"P{i}" for i in range(products)]
+    db.products.insert_many(
+        {
+            "id": product_id,
+            "name": f"Produit {product_id}",
+            "category": random.choice(["A", "B", "C", "D"]),
+            "batch_number": f"L{random.randint(1000, 9999)}",
+            "expiration_date": now + timedelta(days=random.randint(-30, 720)),
+            "unit_price": round(random.uniform(1, 100), 2),
+            "description": "x" * 200,
+        }
+        for product_id in ids
+    )
+    db.stocks.insert_many(
+        {
+            "product_id": product_id,
+            "quantity": random.randint(0, 100),
+            "last_update": now,
+            "location": "Pharmacie principale",
+        }
+        for product_id in ids
+    )
+    db.stock_thresholds.insert_many(
+        {"product_id": product_id, "minimum_stock": 20, "critical_stock": 10}
+        for product_id in ids
+    )
+    db.movements.insert_many(
+        {
+            "movement_type": random.choice(
+                ["ENTREE", "SORTIE", "SORTIE", "RUPTURE"]
+            ),
+            "product_id": product_id,
+            "quantity": random.randint(1, 10),
+            "date": now - timedelta(days=random.randint(0, 180)),
+        }
+        for product_id in ids
+        for _ in range(movements_per_product)
+    )
+    for collection, models in INDEXES.items():
+        db[collection].create_indexes(models)
+
+
+def run(db: Database, collection: str, pipeline: List[dict], repeat: int):
+    """Rows of the pipeline, and its latency percentiles."""
+    rows = len(list(db[collection].aggregate(pipeline)))
+    latency = timeit(lambda: list(db[collection].aggregate(pipeline)), repeat)
+    return rows, latency
+
+
+def main(
+    sizes: List[int] = typer.Option([1000, 10000, 100000]),
+    repeat: int = 5,
+):
+    db = bench_db()
+    typer.echo(
+        f"{'products':>9} {'report':<34} {'before p50':>11} {'after p50':>10} "
+        f"{'before p99':>11} {'after p99':>10} {'speedup':>8} {'rows':>15}"
+    )
+    mismatches = 0
+    for size in sizes:
+        seed(db, size)
+        for report in Report:
+            old_collection, old_build = BASELINE[report]
+            new_collection, new_build = REPORTS[report]
+            old_rows, before = run(db, old_collection, old_build(), repeat)
+            new_rows, after = run(db, new_collection, new_build(), repeat)
+            parity = "ok" if old_rows == new_rows else "DIFF"
+            mismatches += old_rows != new_rows
+            typer.echo(
+                f"{size:>9} {report.value:<34} {before['p50']:>9.1f}ms "
+                f"{after['p50']:>8.1f}ms {before['p99']:>9.1f}ms "
+                f"{after['p99']:>8.1f}ms {before['p50'] / after['p50']:>7.1f}x "
+                f"{old_rows:>6}/{new_rows:<6} {parity}"
+            )
+    db.client.drop_database(db.name)
+    if mismatches:
+        typer.echo(f"{mismatches} reports returned a different row count")
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""Per-row cost of building and serializing an /agent page of alerts.
+
+Before: one validated Alert and one datetime.utcnow() per row, then
+FastAPI's jsonable_encoder and the standard json encoder. After: what the
+agent and pharma.pagination.page do now, one list_adapter validation with
+a single timestamp, then one list_adapter dump rendered by orjson.
+
+Usage: python -m benchmarks.serialization --rows 1000 --rows 50000
+Needs no database.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List
+
+import typer
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from benchmarks.common import timeit
+from pharma.models import Alert, list_adapter
+from pharma.pagination import PageParams, page
+
+
+def rows(count: int) -> List[Dict[str, Any]]:
+    """Stock documents as detect_critical_stocks reads them."""
+    return [
+        {"product_id": f"P{i:06d}", "quantity": i % 10} for i in range(count)
+    ]
+
+
+def build_before(stocks: List[Dict[str, Any]]) -> List[Alert]:
+    return [
+        Alert(
+            product_id=s["product_id"],
+            alert_type="SEUIL_CRITIQUE",
+            message=f"Stock critique pour {s['product_id']} ({s['quantity']} unités)",
+            date=datetime.utcnow(),
+        )
+        for s in stocks
+    ]
+
+
+def build_after(stocks: List[Dict[str, Any]]) -> List[Alert]:
+    now = datetime.utcnow()
+    return list_adapter(Alert).validate_python(
+        [
+            {
+                "product_id": s["product_id"],
+                "alert_type": "SEUIL_CRITIQUE",
+                "message": f"Stock critique pour {s['product_id']} ({s['quantity']} unités)",
+                "date": now,
+            }
+            for s in stocks
+        ]
+    )
+
+
+def serialize_before(alerts: List[Alert]) -> bytes:
+    content = {
+        "items": [alert.model_dump() for alert in alerts],
+        "next_cursor": None,
+    }
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def serialize_after(alerts: List[Alert]) -> bytes:
+    return page(alerts, PageParams(None, len(alerts), None), tuple).body
+
+
+def main(
+    rows_: List[int] = typer.Option([1000, 10000, 50000], "--rows"),
+    repeat: int = 5,
+):
+    typer.echo(
+        f"{'rows':>7} {'step':<10} {'before µs/row':>14} "
+        f"{'after µs/row':>13} {'speedup':>8}"
+    )
+    for count in rows_:
+        stocks = rows(count)
+        alerts = build_after(stocks)
+        steps = {
+            "build": (
+                lambda: build_before(stocks),
+                lambda: build_after(stocks),
+            ),
+            "serialize": (
+                lambda: serialize_before(alerts),
+                lambda: serialize_after(alerts),
+            ),
+            "total": (
+                lambda: serialize_before(build_before(stocks)),
+                lambda: serialize_after(build_after(stocks)),
+            ),
+        }
+        for step, (before, after) in steps.items():
+            old = timeit(before, repeat)["p50"] * 1000 / count
+            new = timeit(after, repeat)["p50"] * 1000 / count
+            typer.echo(
+                f"{count:>7} {step:<10} {old:>14.2f} {new:>13.2f} "
+                f"{old / new:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""Benchmark suite: every agent method and report pipeline, per scale.
+
+Each scale is seeded with InventorySimulator.run_bulk into the scratch
+database, with a fixed seed, then every case is run repeat times and its
+p50 and p99 latencies recorded, along with the documents the database
+examined for one run (from the profiler). Results are written to a JSON
+report; given a baseline report, the suite exits non-zero when a case
+got slower or examines more documents than the threshold allows.
+
+Usage:
+    python -m benchmarks.suite --scales 1k --scales 10k --output report.json
+    python -m benchmarks.suite --baseline benchmarks/baseline.json
+
+Needs a MongoDB reachable at MONGODB_URL that allows the profiler.
+"""
+
+import asyncio
+import json
+import sys
+from datetime import datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+import typer
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+from pymongo.database import Database
+
+from benchmarks.common import BENCH_DB, timeit
+from pharma.reports import REPORTS
+from pharma.services.agent import AsyncSmartInventoryAgent
+from pharma.services.inventory import InventorySimulator
+from pharma.settings import SETTINGS
+
+SEED = 42
+MONTHS = 6
+
+
+class Scale(NamedTuple):
+    products: int
+    movements_per_month: int
+
+
+# About 30, 60 and 96 movements per product: up to ~10M movements.
+SCALES: Dict[str, Scale] = {
+    "1k": Scale(1_000, 5),
+    "10k": Scale(10_000, 10),
+    "100k": Scale(100_000, 16),
+}
+
+
+def seed(db: Database, scale: Scale):
+    """Fill the scratch database, unless it already holds this scale."""
+    wanted = {
+        **scale._asdict(),
+        "months": MONTHS,
+        "seed": SEED,
+        # Stocks carry their thresholds and alert level.
+        "layout": 2,
+    }
+    current = db.bench_meta.find_one({"_id": "scale"}, {"_id": 0})
+    if current == wanted:
+        return
+    InventorySimulator(SEED, database=db.name).run_bulk(
+        scale.products, MONTHS, scale.movements_per_month
+    )
+    db.bench_meta.replace_one({"_id": "scale"}, wanted, upsert=True)
+
+
+def cases(
+    db: Database, loop: asyncio.AbstractEventLoop
+) -> Dict[str, Callable[[], Any]]:
+    """Everything the suite times, by name."""
+    agent = AsyncSmartInventoryAgent(
+        AsyncIOMotorClient(SETTINGS.mongodb_url, io_loop=loop)[db.name]
+    )
+
+    def run(method: str) -> Callable[[], Any]:
+        return lambda: loop.run_until_complete(getattr(agent, method)())
+
+    def aggregate(collection: str, pipeline: List[dict]) -> Callable:
+        return lambda: list(db[collection].aggregate(pipeline))
+
+    named = {
+        f"agent.{method}": run(method)
+        for method in (
+            "forecast_consumption",
+            "detect_critical_stocks",
+            "detect_expiring_products",
+            "last_audit_checkpoint",
+            "simulate_inventory_audit",
+            "generate_kpi_report",
+            "suggest_purchase_orders",
+            "verify_deliveries",
+        )
+    }
+    for report, (collection, build) in REPORTS.items():
+        named[f"reports.{report.value}"] = aggregate(collection, build())
+    return named
+
+
+def docs_examined(db: Database, func: Callable[[], Any]) -> int:
+    """Documents examined by the operations of one call of func."""
+    db.command("profile", 0)
+    db.system.profile.drop()
+    db.command("profile", 2)
+    try:
+        func()
+    finally:
+        db.command("profile", 0)
+    return sum(
+        entry.get("docsExamined", 0)
+        for entry in db.system.profile.find({}, {"docsExamined": 1})
+    )
+
+
+def measure(
+    db: Database, named: Dict[str, Callable[[], Any]], repeat: int
+) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name, func in named.items():
+        # The first call warms the cache and is profiled.
+        examined = docs_examined(db, func)
+        latency = timeit(func, repeat)
+        results[name] = {
+            "p50": round(latency["p50"], 3),
+            "p99": round(latency["p99"], 3),
+            "docs_examined": examined,
+        }
+        typer.echo(
+            f"  {name:<58} {latency['p50']:>9.1f}ms {latency['p99']:>9.1f}ms"
+            f" {examined:>11}"
+        )
+    return results
+
+
+def regressions(
+    report: Dict[str, Any],
+    baseline: Dict[str, Any],
+    threshold: float,
+    min_delta_ms: float,
+) -> List[str]:
+    """
+    Cases of report worse than in baseline.
+
+    A case regresses when its p50 or p99 grows by more than threshold
+    (a fraction) and min_delta_ms, or its documents examined by more
+    than threshold. Cases missing from either report are skipped.
+
+    Args:
+        report (Dict[str, Any]): The new report.
+        baseline (Dict[str, Any]): The stored report.
+        threshold (float): Largest accepted relative increase.
+        min_delta_ms (float): Latency increases below this are noise.
+
+    Returns:
+        List[str]: One line per regression.
+    """
+    found = []
+    for scale, results in report["results"].items():
+        for name, new in results.items():
+            old = baseline["results"].get(scale, {}).get(name)
+            if old is None:
+                continue
+            for metric in ("p50", "p99", "docs_examined"):
+                limit = old[metric] * (1 + threshold)
+                if metric != "docs_examined":
+                    limit = max(limit, old[metric] + min_delta_ms)
+                if new[metric] > limit:
+                    found.append(
+                        f"{scale} {name} {metric}: "
+                        f"{old[metric]} -> {new[metric]}"
+                    )
+    return found
+
+
+def main(
+    scales: List[str] = typer.Option(["1k", "10k", "100k"]),
+    repeat: int = 20,
+    output: str = "benchmark-report.json",
+    baseline: Optional[str] = None,
+    threshold: float = 0.2,
+    min_delta_ms: float = 2.0,
+):
+    unknown = set(scales) - set(SCALES)
+    if unknown:
+        raise typer.BadParameter(f"Unknown scales: {', '.join(unknown)}")
+    db = MongoClient(SETTINGS.mongodb_url)[BENCH_DB]
+    loop = asyncio.new_event_loop()
+    report: Dict[str, Any] = {
+        "date": datetime.utcnow().isoformat(),
+        "mongodb": db.client.server_info()["version"],
+        "repeat": repeat,
+        "scales": {name: SCALES[name]._asdict() for name in scales},
+        "results": {},
+    }
+    for name in scales:
+        typer.echo(f"{name}: seeding")
+        seed(db, SCALES[name])
+        typer.echo(
+            f"{name}: {db.movements.estimated_document_count()} movements"
+        )
+        report["results"][name] = measure(db, cases(db, loop), repeat)
+
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    typer.echo(f"Report written to {output}")
+
+    if baseline is not None:
+        with open(baseline) as f:
+            found = regressions(report, json.load(f), threshold, min_delta_ms)
+        for line in found:
+            typer.echo(f"REGRESSION {line}")
+        sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -1,9 +1,11 @@
-from datetime import datetime, timedelta
 from pymongo.collection import Collection
 from typing import List, Dict
 
+from pharma import reports
 
 # --- Utility Functions for Pharmacy Stock Management ---
+#
+# They run the pipelines of pharma.reports on the given collections.
 
 
 def get_products_with_stock(
@@ -19,31 +21,9 @@ def get_products_with_stock(
     Returns:
         List[Dict]: List of product documents enriched with stock data.
     """
-    pipeline = [
-        {
-            "$lookup": {
-                "from": stocks_col.name,
-                "localField": "id",
-                "foreignField": "product_id",
-                "as": "stock_info",
-            }
-        },
-        {"$unwind": "$stock_info"},
-        {
-            "$project": {
-                "_id": 0,
-                "id": 1,
-                "name": 1,
-                "category": 1,
-                "expiration_date": 1,
-                "unit_price": 1,
-                "quantity": "$stock_info.quantity",
-                "last_update": "$stock_info.last_update",
-                "location": "$stock_info.location",
-            }
-        },
-    ]
-    return list(products_col.aggregate(pipeline))
+    return list(
+        products_col.aggregate(reports.products_with_stock(stocks_col.name))
+    )
 
 
 def get_products_near_expiry(
@@ -59,25 +39,7 @@ def get_products_near_expiry(
     Returns:
         List[Dict]: List of products expiring soon with remaining days to expiry.
     """
-    now = datetime.utcnow()
-    limit_date = now + timedelta(days=30 * months)
-    pipeline = [
-        {"$match": {"expiration_date": {"$lte": limit_date}}},
-        {
-            "$project": {
-                "id": 1,
-                "name": 1,
-                "expiration_date": 1,
-                "jours_restants": {
-                    "$divide": [
-                        {"$subtract": ["$expiration_date", now]},
-                        1000 * 60 * 60 * 24,
-                    ]
-                },
-            }
-        },
-    ]
-    return list(products_col.aggregate(pipeline))
+    return list(products_col.aggregate(reports.products_near_expiry(months)))
 
 
 def get_products_below_critical_threshold(
@@ -96,42 +58,13 @@ def get_products_below_critical_threshold(
     Returns:
         List[Dict]: List of products below critical stock threshold.
     """
-    pipeline = [
-        {
-            "$lookup": {
-                "from": stocks_col.name,
-                "localField": "id",
-                "foreignField": "product_id",
-                "as": "stock",
-            }
-        },
-        {"$unwind": "$stock"},
-        {
-            "$lookup": {
-                "from": thresholds_col.name,
-                "localField": "id",
-                "foreignField": "product_id",
-                "as": "threshold",
-            }
-        },
-        {"$unwind": "$threshold"},
-        {
-            "$match": {
-                "$expr": {
-                    "$lt": ["$stock.quantity", "$threshold.critical_stock"]
-                }
-            }
-        },
-        {
-            "$project": {
-                "id": 1,
-                "name": 1,
-                "quantity": "$stock.quantity",
-                "critical_stock": "$threshold.critical_stock",
-            }
-        },
-    ]
-    return list(products_col.aggregate(pipeline))
+    return list(
+        stocks_col.aggregate(
+            reports.products_below_critical_threshold(
+                products_col.name, thresholds_col.name
+            )
+        )
+    )
 
 
 def get_total_stock_value(
@@ -147,31 +80,9 @@ def get_total_stock_value(
     Returns:
         float: Total stock value.
     """
-    pipeline = [
-        {
-            "$lookup": {
-                "from": stocks_col.name,
-                "localField": "id",
-                "foreignField": "product_id",
-                "as": "stock",
-            }
-        },
-        {"$unwind": "$stock"},
-        {
-            "$project": {
-                "total_value": {
-                    "$multiply": ["$unit_price", "$stock.quantity"]
-                }
-            }
-        },
-        {
-            "$group": {
-                "_id": None,
-                "valeur_totale_stock": {"$sum": "$total_value"},
-            }
-        },
-    ]
-    result = list(products_col.aggregate(pipeline))
+    result = list(
+        stocks_col.aggregate(reports.total_stock_value(products_col.name))
+    )
     return result[0]["valeur_totale_stock"] if result else 0.0
 
 
@@ -188,23 +99,8 @@ def get_stock_statistics_by_category(
     Returns:
         List[Dict]: List of category statistics including product count and total quantity.
     """
-    pipeline = [
-        {
-            "$lookup": {
-                "from": stocks_col.name,
-                "localField": "id",
-                "foreignField": "product_id",
-                "as": "stock",
-            }
-        },
-        {"$unwind": "$stock"},
-        {
-            "$group": {
-                "_id": "$category",
-                "nombre_de_produits": {"$sum": 1},
-                "quantite_totale": {"$sum": "$stock.quantity"},
-            }
-        },
-        {"$sort": {"quantite_totale": -1}},
-    ]
-    return list(products_col.aggregate(pipeline))
+    return list(
+        products_col.aggregate(
+            reports.stock_statistics_by_category(stocks_col.name)
+        )
+    )
@@ -7,14 +7,36 @@ from contextlib import asynccontextmanager
 import daiquiri
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from motor.motor_asyncio import AsyncIOMotorClient
 from starlette_exporter import PrometheusMiddleware, handle_metrics
 
-from pharma.middleware.logging import LoggingMiddleware
+from pharma.indexes import ensure_indexes
+from pharma.middleware.logging import (
+    LoggingMiddleware,
+    start_access_log,
+    stop_access_log,
+)
+from pharma.monitoring import LISTENERS
 from pharma.routers import health as health_router
 from pharma.routers import agent as agent_router
+from pharma.routers import alerts as alerts_router
+from pharma.routers import exports as exports_router
 from pharma.routers import llm as llm_agent
+from pharma.routers import movements as movements_router
+from pharma.routers import reports as reports_router
+from pharma.services.agent import AsyncSmartInventoryAgent
+from pharma.services.alerts import AlertEngine, sync_stock_levels
+from pharma.services.cache import CachedInventoryAgent, bump_versions
+from pharma.services.llm import close_llm, setup_llm_cache
+from pharma.services.snapshots import SnapshotScheduler
 from pharma.settings import SETTINGS
+from pharma.tracing import (
+    CommandSpans,
+    TracingMiddleware,
+    setup_tracing,
+    shutdown_tracing,
+)
 
 LOGGER = daiquiri.getLogger(__name__)
 
@@ -24,11 +46,19 @@ async def lifespan(application: FastAPI):
     """Defines the startup and shutdown events."""
     # Startup event
     await startup_db_client(application)
+    setup_llm_cache(application.mongodb)
+    start_alert_engine(application)
+    start_snapshot_scheduler(application)
 
     yield
 
     # Shutdown event
+    await stop_snapshot_scheduler(application)
+    await stop_alert_engine(application)
+    await close_llm()
     await shutdown_db_client(application)
+    shutdown_tracing()
+    stop_access_log()
 
 
 app = FastAPI(
@@ -36,12 +66,17 @@ app = FastAPI(
     docs_url=SETTINGS.docs_url,
     openapi_url=SETTINGS.openapi_url,
     version=SETTINGS.version,
+    default_response_class=ORJSONResponse,
     lifespan=lifespan,  # type: ignore
 )
 
 app.include_router(health_router.router)
 app.include_router(agent_router.router)
+app.include_router(alerts_router.router)
+app.include_router(exports_router.router)
 app.include_router(llm_agent.router)
+app.include_router(movements_router.router)
+app.include_router(reports_router.router)
 app.add_route(SETTINGS.metrics_url, handle_metrics)
 
 app.add_middleware(
@@ -71,17 +106,66 @@ app.add_middleware(
 )
 app.add_middleware(LoggingMiddleware)
 daiquiri.setup(level=SETTINGS.log_level)  # type: ignore
+TRACING = setup_tracing()
+if TRACING:
+    # Added last, so the request span covers the other middlewares.
+    app.add_middleware(TracingMiddleware)
 logging.getLogger("httpx").setLevel("WARNING")
 logging.getLogger("httpcore").setLevel("WARNING")
 logging.getLogger("multipart").setLevel("WARNING")
+start_access_log()
 
 
 async def startup_db_client(application: FastAPI):
     """Connect to MongoDB and create indexes."""
-    mongodb_client = AsyncIOMotorClient(SETTINGS.mongodb_url)
+    mongodb_client = AsyncIOMotorClient(
+        SETTINGS.mongodb_url,
+        event_listeners=[*LISTENERS, CommandSpans()] if TRACING else LISTENERS,
+    )
     mongodb = mongodb_client[SETTINGS.mongodb_name]
     application.mongodb_client = mongodb_client
     application.mongodb = mongodb
+    await ensure_indexes(mongodb)
+    # Stocks written before the thresholds were denormalized, or by
+    # other tools, get their alert level.
+    await sync_stock_levels(mongodb)
+    await bump_versions(mongodb, "stocks")
+    application.agent = CachedInventoryAgent(
+        AsyncSmartInventoryAgent(mongodb),
+        maxsize=SETTINGS.agent_cache_maxsize,
+        ttl=SETTINGS.agent_cache_ttl,
+        versions_ttl=SETTINGS.agent_cache_versions_ttl,
+    )
+
+
+def start_alert_engine(application: FastAPI):
+    """Start following the change streams when live alerts are enabled."""
+    application.alert_engine = None
+    if SETTINGS.live_alerts:
+        application.alert_engine = AlertEngine(application.mongodb)
+        application.alert_engine.start()
+
+
+async def stop_alert_engine(application: FastAPI):
+    """Stop the change stream task."""
+    if application.alert_engine is not None:  # type: ignore
+        await application.alert_engine.stop()  # type: ignore
+
+
+def start_snapshot_scheduler(application: FastAPI):
+    """Rebuild the forecast snapshot every SNAPSHOT_INTERVAL seconds."""
+    application.snapshot_scheduler = None
+    if SETTINGS.snapshot_interval > 0:
+        application.snapshot_scheduler = SnapshotScheduler(
+            application.mongodb, SETTINGS.snapshot_interval
+        )
+        application.snapshot_scheduler.start()
+
+
+async def stop_snapshot_scheduler(application: FastAPI):
+    """Stop the snapshot task; a build in progress is abandoned."""
+    if application.snapshot_scheduler is not None:  # type: ignore
+        await application.snapshot_scheduler.stop()  # type: ignore
 
 
 async def shutdown_db_client(application: FastAPI):
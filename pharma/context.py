@@ -0,0 +1,167 @@
+"""Token-budgeted context for the LLM prompts.
+
+The prompt templates list forecasts and alerts for the whole catalogue,
+which past a few hundred products costs latency and money and overflows
+the context window. compact() keeps the most severe and urgent line per
+product within a token budget and folds the rest into one summary line
+per category (the alert type, or whether a forecast calls for an order).
+
+Tokens are estimated from the text length, as no tokenizer matches every
+backend.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+CHARS_PER_TOKEN = 4
+
+# Alert types by decreasing severity; unknown types rank last.
+ALERT_SEVERITY = {
+    "RUPTURE": 5,
+    "SEUIL_CRITIQUE": 4,
+    "PEREMPTION": 3,
+    "NON_CONFORMITE_LIVRAISON": 2,
+    "INVENTAIRE_ECART": 1,
+}
+# Alert severities, decreasing; alerts without one rank after INFO.
+SEVERITY_RANK = {"CRITICAL": 3, "WARNING": 2, "INFO": 1}
+
+
+def count_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+class ContextItem(NamedTuple):
+    product_id: str
+    # Category the item is summarized under when it does not fit.
+    group: str
+    # Items with the highest rank are kept first.
+    rank: Tuple
+    line: str
+    quantity: int = 0
+
+
+class Section(NamedTuple):
+    text: str
+    tokens: int
+    # Tokens the section takes with every item listed.
+    full_tokens: int
+
+    @property
+    def saved(self) -> int:
+        return max(0, self.full_tokens - self.tokens)
+
+
+def alert_rank(
+    alert_type: str, date: datetime, severity: Optional[str] = None
+) -> Tuple:
+    """Highest severity first, then the most severe type, then the oldest."""
+    return (
+        SEVERITY_RANK.get(severity or "", 0),
+        ALERT_SEVERITY.get(alert_type, 0),
+        -date.timestamp(),
+    )
+
+
+def forecast_rank(
+    average_consumption: float, suggested_quantity: int
+) -> Tuple:
+    """Products with the least stock left per unit of consumption first.
+
+    The suggested quantity is twice the average consumption minus the
+    stock, so its ratio to the average grows as the stock runs out.
+    """
+    return (
+        suggested_quantity / max(average_consumption, 1e-9),
+        suggested_quantity,
+    )
+
+
+def _examples(items: List[ContextItem]) -> str:
+    ids = ", ".join(item.product_id for item in items[:3])
+    return ids + (", …" if len(items) > 3 else "")
+
+
+def summarize_alerts(group: str, items: List[ContextItem]) -> str:
+    return f"- … et {len(items)} autres alertes {group} ({_examples(items)})"
+
+
+def summarize_quantities(group: str, items: List[ContextItem]) -> str:
+    total = sum(item.quantity for item in items)
+    return (
+        f"- … et {len(items)} autres produits {group} "
+        f"({_examples(items)}) : {total} unités au total"
+    )
+
+
+def _dedupe(items: List[ContextItem]) -> List[ContextItem]:
+    """Keep the highest ranked item per product, naming the others."""
+    best: Dict[str, ContextItem] = {}
+    others: Dict[str, List[str]] = defaultdict(list)
+    for item in items:
+        kept = best.get(item.product_id)
+        if kept is None or item.rank > kept.rank:
+            if kept is not None:
+                others[item.product_id].append(kept.group)
+            best[item.product_id] = item
+        else:
+            others[item.product_id].append(item.group)
+    deduped = []
+    for pid, item in best.items():
+        groups = [g for g in dict.fromkeys(others[pid]) if g != item.group]
+        if groups:
+            item = item._replace(
+                line=f"{item.line} (aussi : {', '.join(groups)})"
+            )
+        deduped.append(item)
+    return deduped
+
+
+def compact(
+    items: List[ContextItem],
+    budget: int,
+    summarize: Callable[[str, List[ContextItem]], str],
+) -> Section:
+    """Render items within budget tokens.
+
+    Args:
+        items (List[ContextItem]): Lines to render, in any order.
+        budget (int): Token budget of the rendered text.
+        summarize (Callable): Summary line of a category, given the items
+            left out.
+
+    Returns:
+        Section: The text, its size and the size it replaces.
+    """
+    full_tokens = count_tokens("\n".join(item.line for item in items))
+    ranked = sorted(_dedupe(items), key=lambda item: item.rank, reverse=True)
+
+    groups: Dict[str, List[ContextItem]] = defaultdict(list)
+    for item in ranked:
+        groups[item.group].append(item)
+    # Room for the summaries, should every item of a category be left out.
+    used = sum(
+        count_tokens(summarize(group, members)) + 1
+        for group, members in groups.items()
+    )
+
+    lines = []
+    for item in ranked:
+        used += count_tokens(item.line) + 1
+        if used > budget:
+            break
+        lines.append(item.line)
+
+    tail: Dict[str, List[ContextItem]] = defaultdict(list)
+    for item in ranked[len(lines) :]:
+        tail[item.group].append(item)
+    lines += [summarize(group, members) for group, members in tail.items()]
+
+    text = "\n".join(lines)
+    return Section(text, count_tokens(text), full_tokens)
+
+
+def fields(obj: Any) -> Dict[str, Any]:
+    """Templates receive models or their dict() dumps."""
+    return obj if isinstance(obj, dict) else obj.dict()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+from typing import Annotated, Any, Dict, Optional, Set
+
+from fastapi import Depends, HTTPException, Query, Request
+
+from pharma.pagination import PageParams, decode_cursor
+from pharma.services.agent import AsyncSmartInventoryAgent
+from pharma.services.alerts import AlertEngine
+from pharma.services.snapshots import Snapshot, current_snapshot
+from pharma.settings import SETTINGS
+
+
+def get_agent(request: Request) -> AsyncSmartInventoryAgent:
+    """Return the agent bound to the application's Motor database."""
+    return request.app.agent
+
+
+Agent = Annotated[AsyncSmartInventoryAgent, Depends(get_agent)]
+
+
+def get_alert_engine(request: Request) -> AlertEngine:
+    """Return the live alert engine, or 503 when it is disabled."""
+    if request.app.alert_engine is None:
+        raise HTTPException(status_code=503, detail="Live alerts disabled")
+    return request.app.alert_engine
+
+
+Engine = Annotated[AlertEngine, Depends(get_alert_engine)]
+
+
+async def get_snapshot(request: Request) -> Optional[Snapshot]:
+    """Return the current forecast snapshot, None before the first build."""
+    return await current_snapshot(request.app.mongodb)
+
+
+CurrentSnapshot = Annotated[Optional[Snapshot], Depends(get_snapshot)]
+
+
+def get_fields(
+    fields: Optional[str] = Query(
+        None, description="Comma-separated fields to return."
+    )
+) -> Optional[Set[str]]:
+    if not fields:
+        return None
+    return {name.strip() for name in fields.split(",") if name.strip()}
+
+
+Fields = Annotated[Optional[Set[str]], Depends(get_fields)]
+
+
+def get_page_params(
+    fields: Fields,
+    cursor: Optional[str] = Query(
+        None, description="next_cursor of the previous page."
+    ),
+    limit: int = Query(
+        SETTINGS.api_default_limit, ge=1, le=SETTINGS.api_max_limit
+    ),
+) -> PageParams:
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return PageParams(after, limit, fields)
+
+
+Paging = Annotated[PageParams, Depends(get_page_params)]
+
+
+def get_report_params(
+    months: Optional[int] = Query(None, ge=1),
+    days_limit: Optional[int] = Query(None, ge=0),
+) -> Dict[str, Any]:
+    """Report parameters given by the client."""
+    return {
+        name: value
+        for name, value in {"months": months, "days_limit": days_limit}.items()
+        if value is not None
+    }
+
+
+ReportParams = Annotated[Dict[str, Any], Depends(get_report_params)]
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""Index registry, applied at startup, and the COLLSCAN index advisor.
+
+The advisor is a dev command (`index_advisor`, or `python -m
+pharma.indexes`): it explains every registered query against the
+configured database and exits non-zero when one falls back to a
+collection scan.
+"""
+
+import sys
+from datetime import date
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple
+
+import daiquiri
+import typer
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, IndexModel, MongoClient
+from pymongo.errors import OperationFailure
+
+from pharma import pipelines
+from pharma.reports import REPORTS, Report
+from pharma.services.alerts import alert_level_expression
+from pharma.settings import SETTINGS
+
+LOGGER = daiquiri.getLogger(__name__)
+
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "products": [
+        IndexModel([("id", ASCENDING)], name="id", unique=True),
+        # Expiry ranges, in detect_expiring_products order.
+        IndexModel(
+            [("expiration_date", ASCENDING), ("id", ASCENDING)],
+            name="expiration_date_id",
+        ),
+    ],
+    "stocks": [
+        IndexModel(
+            [("product_id", ASCENDING)], name="product_id", unique=True
+        ),
+    ],
+    "consumption_forecasts": [
+        IndexModel(
+            [("product_id", ASCENDING)], name="product_id", unique=True
+        ),
+    ],
+    "stock_thresholds": [
+        IndexModel(
+            [("product_id", ASCENDING)], name="product_id", unique=True
+        ),
+    ],
+    "movements": [
+        # Covers the forecast and KPI scans: type + window, then the only
+        # fields they read.
+        IndexModel(
+            [
+                ("movement_type", ASCENDING),
+                ("date", ASCENDING),
+                ("product_id", ASCENDING),
+                ("quantity", ASCENDING),
+            ],
+            name="movement_type_date_product_id_quantity",
+        ),
+        IndexModel(
+            [("product_id", ASCENDING), ("date", ASCENDING)],
+            name="product_id_date",
+        ),
+        IndexModel([("date", ASCENDING)], name="date"),
+        # Deliveries checked by verify_deliveries, in its order.
+        IndexModel(
+            [("product_id", ASCENDING), ("date", ASCENDING)],
+            name="checked_deliveries",
+            partialFilterExpression=pipelines.checked_deliveries_filter(),
+        ),
+        # Movements replayed by an audit from a checkpoint.
+        IndexModel(
+            [("ingest_seq", ASCENDING)],
+            name="ingest_seq",
+            partialFilterExpression={"ingest_seq": {"$exists": True}},
+        ),
+    ],
+    "movement_batches": [
+        # Idempotency keys of /movements/bulk are kept for a day.
+        IndexModel(
+            [("created_at", ASCENDING)],
+            name="created_at_ttl",
+            expireAfterSeconds=24 * 60 * 60,
+        ),
+    ],
+    "llm_responses": [
+        IndexModel(
+            [("created_at", ASCENDING)],
+            name="created_at_ttl",
+            expireAfterSeconds=int(SETTINGS.llm_cache_ttl),
+        ),
+    ],
+}
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase):
+    """Create the registered indexes; existing ones are left untouched."""
+    for collection, models in INDEXES.items():
+        try:
+            await db[collection].create_indexes(models)
+        except OperationFailure as e:
+            LOGGER.error("Cannot create indexes on %s: %s", collection, e)
+
+
+# --- Index advisor ---
+
+
+class RegisteredQuery(NamedTuple):
+    collection: str
+    pipeline: Callable[[], List[Dict[str, Any]]]
+    # The query reads the whole collection by design, so only its
+    # $lookup stages are checked.
+    full_scan: bool = False
+
+
+def _match(query: Dict[str, Any]) -> Callable:
+    return lambda: [{"$match": query}]
+
+
+# Reports that select their rows through an index; the others read a whole
+# collection.
+_INDEXED_REPORTS = {
+    Report.products_near_expiry,
+    Report.pre_order_forecast,
+    Report.deliveries,
+    Report.expiring_products,
+    Report.performance_report,
+}
+
+QUERIES: Dict[str, RegisteredQuery] = {
+    "agent.forecast_consumption": RegisteredQuery(
+        "movements", pipelines.forecast_consumption_pipeline
+    ),
+    "agent.detect_critical_stocks": RegisteredQuery(
+        "stocks",
+        lambda: [
+            {
+                "$match": {
+                    "$expr": {"$ne": [alert_level_expression(None), None]}
+                }
+            },
+            {"$sort": {"product_id": 1}},
+        ],
+        full_scan=True,
+    ),
+    "agent.detect_expiring_products": RegisteredQuery(
+        "products",
+        lambda: pipelines.expiring_products_pipeline(
+            SETTINGS.expiry_horizons, date.today()
+        ),
+    ),
+    "agent.simulate_inventory_audit": RegisteredQuery(
+        "movements", pipelines.inventory_audit_pipeline, full_scan=True
+    ),
+    "agent.generate_kpi_report.ruptures": RegisteredQuery(
+        "movements", _match({"movement_type": "RUPTURE"})
+    ),
+    "agent.generate_kpi_report.exits": RegisteredQuery(
+        "movements", _match({"movement_type": "SORTIE"})
+    ),
+    "agent.verify_deliveries": RegisteredQuery(
+        "movements", _match(pipelines.checked_deliveries_filter())
+    ),
+    **{
+        f"reports.{report.value}": RegisteredQuery(
+            collection,
+            build,
+            full_scan=report not in _INDEXED_REPORTS,
+        )
+        for report, (collection, build) in REPORTS.items()
+    },
+}
+
+
+def _plan_stages(explain: Any) -> Iterator[Dict[str, Any]]:
+    """Walk an explain document and yield every plan and pipeline stage."""
+    if isinstance(explain, list):
+        for item in explain:
+            yield from _plan_stages(item)
+    elif isinstance(explain, dict):
+        yield explain
+        for key, value in explain.items():
+            if key != "rejectedPlans":
+                yield from _plan_stages(value)
+
+
+def collection_scans(explain: Dict[str, Any], full_scan: bool) -> List[str]:
+    """Describe the collection scans found in an explain document."""
+    scans = []
+    for stage in _plan_stages(explain):
+        if stage.get("stage") == "COLLSCAN" and not full_scan:
+            scans.append("COLLSCAN")
+        if stage.get("strategy") == "NestedLoopJoin":
+            scans.append(f"$lookup from {stage.get('foreignCollection')}")
+        if "$lookup" in stage and stage.get("collectionScans"):
+            scans.append(f"$lookup from {stage['$lookup'].get('from')}")
+    return scans
+
+
+def advise(create: bool = typer.Option(True, help="Create indexes first.")):
+    """Explain every registered query and fail on collection scans."""
+    db = MongoClient(SETTINGS.mongodb_url)[SETTINGS.mongodb_name]
+    if create:
+        for collection, models in INDEXES.items():
+            db[collection].create_indexes(models)
+
+    failures = 0
+    for name, query in QUERIES.items():
+        explain = db.command(
+            "explain",
+            {
+                "aggregate": query.collection,
+                "pipeline": query.pipeline(),
+                "cursor": {},
+            },
+            verbosity="executionStats",
+        )
+        scans = collection_scans(explain, query.full_scan)
+        if scans:
+            failures += 1
+            typer.echo(f"FAIL {name}: {', '.join(sorted(set(scans)))}")
+        else:
+            typer.echo(f"ok   {name}")
+    sys.exit(1 if failures else 0)
+
+
+def main():
+    typer.run(advise)
+
+
+if __name__ == "__main__":
+    main()
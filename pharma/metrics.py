@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Application metrics, exported on SETTINGS.metrics_url.
+
+starlette_exporter serves the default prometheus_client registry, so
+every metric declared here is exposed next to the HTTP metrics. Agent
+cache hits are lookups minus misses.
+"""
+
+from prometheus_client import Counter, Gauge, Histogram
+
+MOVEMENTS_INGESTED = Counter(
+    "pharma_movements_ingested_total",
+    "Stock movements written through /movements/bulk.",
+)
+MOVEMENT_BATCH_SIZE = Histogram(
+    "pharma_movement_batch_size",
+    "Number of movements per /movements/bulk batch.",
+    buckets=(1, 10, 100, 1_000, 10_000, 100_000),
+)
+MOVEMENT_BATCH_SECONDS = Histogram(
+    "pharma_movement_batch_seconds",
+    "Time spent writing one /movements/bulk batch.",
+)
+AGENT_CACHE_LOOKUPS = Counter(
+    "pharma_agent_cache_lookups_total",
+    "Agent analyses requested through the result cache.",
+    ["method"],
+)
+AGENT_CACHE_MISSES = Counter(
+    "pharma_agent_cache_misses_total",
+    "Agent analyses computed because the cache had no fresh result.",
+    ["method"],
+)
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "pharma_llm_time_to_first_token_seconds",
+    "Delay between a streamed completion request and its first token.",
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+LLM_CACHE_HITS = Counter(
+    "pharma_llm_cache_hits_total",
+    "Completions served from the LLM response cache.",
+    ["tier"],
+)
+LLM_CACHE_MISSES = Counter(
+    "pharma_llm_cache_misses_total",
+    "Completions requested from the LLM after a cache miss.",
+)
+LLM_CACHE_SAVED_SECONDS = Counter(
+    "pharma_llm_cache_saved_seconds_total",
+    "Generation time of the completions served from cache.",
+)
+LLM_CACHE_SAVED_TOKENS = Counter(
+    "pharma_llm_cache_saved_tokens_total",
+    "Tokens billed for the completions served from cache.",
+)
+LLM_CONTEXT_TOKENS_SAVED = Histogram(
+    "pharma_llm_context_tokens_saved",
+    "Estimated prompt tokens saved per request by context compaction.",
+    ["prompt"],
+    buckets=(0, 100, 500, 1_000, 5_000, 10_000, 50_000),
+)
+MONGO_COMMAND_SECONDS = Histogram(
+    "pharma_mongo_command_seconds",
+    "Server round trip of each MongoDB command.",
+    ["command"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+MONGO_COMMAND_FAILURES = Counter(
+    "pharma_mongo_command_failures_total",
+    "MongoDB commands that failed, by operation.",
+    ["operation", "command"],
+)
+MONGO_OPERATION_SECONDS = Histogram(
+    "pharma_mongo_operation_seconds",
+    "Duration of a named MongoDB operation (agent analysis, report...).",
+    ["operation"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+MONGO_OPERATION_DOCUMENTS = Histogram(
+    "pharma_mongo_operation_documents",
+    "Documents returned by the server for one named operation.",
+    ["operation"],
+    buckets=(0, 1, 10, 100, 1_000, 10_000, 100_000, 1_000_000),
+)
+MONGO_OPERATION_ROUND_TRIPS = Histogram(
+    "pharma_mongo_operation_round_trips",
+    "Commands sent to the server for one named operation.",
+    ["operation"],
+    buckets=(0, 1, 2, 3, 5, 10, 25, 100, 1_000),
+)
+MONGO_POOL_CONNECTIONS = Gauge(
+    "pharma_mongo_pool_connections",
+    "MongoDB connections of the process: open, in use, or waited for.",
+    ["state"],
+)
+LLM_REQUEST_SECONDS = Histogram(
+    "pharma_llm_request_seconds",
+    "Duration of an LLM completion, to its last token when streamed.",
+    ["backend", "mode"],
+    buckets=(0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120),
+)
+LLM_TOKENS = Histogram(
+    "pharma_llm_tokens",
+    "Tokens per LLM completion, reported by the backend or estimated.",
+    ["backend", "kind"],
+    buckets=(16, 64, 128, 256, 512, 1_024, 2_048, 4_096, 8_192),
+)
+LLM_ERRORS = Counter(
+    "pharma_llm_errors_total",
+    "LLM completions that failed, by exception type.",
+    ["backend", "error"],
+)
+LLM_REQUESTS_IN_FLIGHT = Gauge(
+    "pharma_llm_requests_in_flight",
+    "LLM completions waiting for the backend or being generated.",
+    ["backend"],
+)
+LLAMA_QUEUE_DEPTH = Gauge(
+    "pharma_llama_queue_depth",
+    "Requests queued for the local llama.cpp workers.",
+)
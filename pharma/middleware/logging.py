@@ -1,25 +1,117 @@
 # -*- coding: utf-8 -*-
+"""Request logging.
+
+One record per request, written when its response is sent, with the
+status, duration and body size. Records go through a queue to a
+background thread (start_access_log), so the event loop never waits on
+the log output. Requests are sampled per route
+(ACCESS_LOG_SAMPLE_RATE, ACCESS_LOG_ROUTE_SAMPLE_RATES); slow requests
+and server errors are always logged, with their query string and user
+agent.
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
 
 import daiquiri
-from fastapi import Request
+from opentelemetry import trace
 from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from pharma.settings import SETTINGS
 
 LOGGER = daiquiri.getLogger(__name__)
 
+# Only these request headers are read, once per request.
+_HEADERS = {
+    b"remote_user": "user",
+    b"x-forwarded-for": "ip",
+    b"x-amzn-trace-id": "amzn_trace_id",
+    b"user-agent": "user_agent",
+}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def start_access_log():
+    """
+    Move the request log to a background thread.
+
+    Text records are written by the handlers installed by daiquiri.setup,
+    JSON records as bare lines on stderr.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    if SETTINGS.access_log_format == "json":
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        handlers = [handler]
+    else:
+        handlers = logging.getLogger().handlers
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    logger = logging.getLogger(__name__)
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.propagate = False
+    _listener = logging.handlers.QueueListener(
+        records, *handlers, respect_handler_level=True
+    )
+    _listener.start()
+
+
+def stop_access_log():
+    """Write the queued records and restore synchronous logging."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+    logger = logging.getLogger(__name__)
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            logger.removeHandler(handler)
+    logger.propagate = True
+
+
+def _sample_rate(route: Optional[str]) -> float:
+    if route is not None:
+        rate = SETTINGS.access_log_route_sample_rates.get(route)
+        if rate is not None:
+            return rate
+    return SETTINGS.access_log_sample_rate
+
+
+def _format(record: Dict[str, Any]) -> str:
+    if SETTINGS.access_log_format == "json":
+        return json.dumps(record, separators=(",", ":"))
+    line = (
+        "User: '%(user)s' IP: '%(ip)s' X-AMZN-TRACE-ID: '%(amzn_trace_id)s' "
+        "%(method)s %(path)s %(status)s %(duration_ms).1fms %(bytes)sB"
+    ) % record
+    if "query" in record:
+        line += " Query: '%(query)s' User-Agent: '%(user_agent)s'" % record
+    return line
+
 
 class LoggingMiddleware:
     def __init__(self, app: ASGIApp) -> None:
         self.app = app
-        self.skip_paths = [
-            "/",
-            "/favicon.ico",
-            "/health/",
-            SETTINGS.metrics_url,
-            SETTINGS.docs_url,
-            SETTINGS.openapi_url,
-        ]
+        self.skip_paths = frozenset(
+            [
+                "/",
+                "/favicon.ico",
+                "/health/",
+                SETTINGS.metrics_url,
+                SETTINGS.docs_url,
+                SETTINGS.openapi_url,
+            ]
+        )
 
     async def __call__(
         self, scope: Scope, receive: Receive, send: Send
@@ -30,20 +122,58 @@ class LoggingMiddleware:
         if scope["path"] in self.skip_paths:
             return await self.app(scope, receive, send)
 
+        start = time.perf_counter()
+        response = {"status": 500, "bytes": 0}
+
         async def intercept_and_send(message: Message) -> None:
-            """Intercept the response and log the relevant information."""
-            request = Request(scope, receive=receive)
+            """Note the status and body size of the response."""
             if message["type"] == "http.response.start":
-                LOGGER.info(
-                    "User: '%s' IP: '%s' X-AMZN-TRACE-ID: '%s' %s %s %s",
-                    request.headers.get("remote_user"),
-                    request.headers.get("x-forwarded-for"),
-                    request.headers.get("x-amzn-trace-id"),
-                    request.method,
-                    request.url.path,
-                    message.get("status"),
-                )
-
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["bytes"] += len(message.get("body", b""))
             await send(message)
 
-        await self.app(scope, receive, intercept_and_send)
+        try:
+            await self.app(scope, receive, intercept_and_send)
+        finally:
+            self.log(scope, response, time.perf_counter() - start)
+
+    @staticmethod
+    def log(scope: Scope, response: Dict[str, int], duration: float):
+        """Log the request, if sampled."""
+        duration_ms = duration * 1000
+        # Set by the router once the request is matched.
+        route = getattr(scope.get("route"), "path", None)
+        full = (
+            duration_ms >= SETTINGS.access_log_slow_ms
+            or response["status"] >= 500
+        )
+        if not full and random.random() >= _sample_rate(route):
+            return
+
+        record: Dict[str, Any] = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "method": scope["method"],
+            "path": scope["path"],
+            "route": route,
+            "status": response["status"],
+            "duration_ms": round(duration_ms, 3),
+            "bytes": response["bytes"],
+            "user": None,
+            "ip": None,
+            "amzn_trace_id": None,
+        }
+        for key, value in scope["headers"]:
+            field = _HEADERS.get(key)
+            if field is not None:
+                record[field] = value.decode("latin-1")
+        user_agent = record.pop("user_agent", None)
+        span = trace.get_current_span().get_span_context()
+        if span.is_valid:
+            record["trace_id"] = format(span.trace_id, "032x")
+        if full:
+            record["slow"] = duration_ms >= SETTINGS.access_log_slow_ms
+            record["query"] = scope["query_string"].decode("latin-1")
+            record["user_agent"] = user_agent
+
+        LOGGER.info(_format(record))
@@ -1,7 +1,8 @@
+import functools
 from datetime import date, datetime
-from typing import List, Literal, Optional
+from typing import List, Literal, Optional, Type
 
-from pydantic import BaseModel, conint
+from pydantic import BaseModel, TypeAdapter, conint
 
 # --- MODELES Pydantic ---
 
@@ -66,6 +67,8 @@ class StockMovement(BaseModel):
     date: datetime
     reason: Optional[str]
     destination: Optional[str] = None
+    # ENTREE: quantity ordered, when known, checked by verify_deliveries.
+    expected_quantity: Optional[int] = None
 
 
 class InventoryResult(BaseModel):
@@ -88,6 +91,9 @@ class Alert(BaseModel):
     alert_type: str
     message: str
     date: datetime
+    severity: Optional[Literal["INFO", "WARNING", "CRITICAL"]] = None
+    # Expiry alerts: smallest horizon, in days, the expiration falls in.
+    horizon_days: Optional[int] = None
 
 
 class KPIReport(BaseModel):
@@ -98,3 +104,9 @@ class KPIReport(BaseModel):
 
 class ChatRequest(BaseModel):
     message: str
+
+
+@functools.lru_cache(maxsize=None)
+def list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    """Validate or dump a whole list of model in one call."""
+    return TypeAdapter(List[model])  # type: ignore
@@ -0,0 +1,167 @@
+"""MongoDB command and connection pool monitoring.
+
+LISTENERS are passed to the application's Motor client. Every command
+is timed by name; commands sent inside a named operation (see
+mongo_operation) are also counted against it, with the documents they
+return, so /metrics tells which analysis a slow request spent its round
+trips on. Motor runs pymongo in threads that inherit the caller's
+context, which carries the current operation to the listeners.
+"""
+
+import functools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator, Mapping, Optional
+
+from opentelemetry import trace
+from pymongo import monitoring
+
+from pharma.metrics import (
+    MONGO_COMMAND_FAILURES,
+    MONGO_COMMAND_SECONDS,
+    MONGO_OPERATION_DOCUMENTS,
+    MONGO_OPERATION_ROUND_TRIPS,
+    MONGO_OPERATION_SECONDS,
+    MONGO_POOL_CONNECTIONS,
+)
+
+
+class Operation:
+    """Commands and documents of one named operation so far."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.round_trips = 0
+        self.documents = 0
+
+
+TRACER = trace.get_tracer("pharma")
+
+_OPERATION: ContextVar[Optional[Operation]] = ContextVar(
+    "mongo_operation", default=None
+)
+
+
+@contextmanager
+def mongo_operation(name: str) -> Iterator[Operation]:
+    """
+    Record the MongoDB commands sent in the block as operation name.
+
+    Names become label values: use a fixed set (method or report names),
+    never ids. Commands of a nested operation only count for it. The
+    block runs in a span of that name.
+
+    Args:
+        name (str): Name of the operation.
+
+    Yields:
+        Operation: The counts, updated as commands complete.
+    """
+    operation = Operation(name)
+    token = _OPERATION.set(operation)
+    start = time.perf_counter()
+    with TRACER.start_as_current_span(name) as span:
+        try:
+            yield operation
+        finally:
+            _OPERATION.reset(token)
+            span.set_attribute(
+                "db.response.returned_rows", operation.documents
+            )
+            span.set_attribute("db.round_trips", operation.round_trips)
+            MONGO_OPERATION_SECONDS.labels(name).observe(
+                time.perf_counter() - start
+            )
+            MONGO_OPERATION_DOCUMENTS.labels(name).observe(operation.documents)
+            MONGO_OPERATION_ROUND_TRIPS.labels(name).observe(
+                operation.round_trips
+            )
+
+
+def instrumented(name: str) -> Callable:
+    """Decorator running a coroutine function as mongo_operation(name)."""
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs) -> Any:
+            with mongo_operation(name):
+                return await function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def returned_documents(reply: Mapping[str, Any]) -> int:
+    """Documents in a command reply's cursor batch."""
+    cursor = reply.get("cursor")
+    if not isinstance(cursor, Mapping):
+        return 0
+    return len(cursor.get("firstBatch") or cursor.get("nextBatch") or ())
+
+
+class CommandMetrics(monitoring.CommandListener):
+    def started(self, event: monitoring.CommandStartedEvent):
+        operation = _OPERATION.get()
+        if operation is not None:
+            operation.round_trips += 1
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        MONGO_COMMAND_SECONDS.labels(event.command_name).observe(
+            event.duration_micros / 1e6
+        )
+        operation = _OPERATION.get()
+        if operation is not None:
+            operation.documents += returned_documents(event.reply)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        MONGO_COMMAND_SECONDS.labels(event.command_name).observe(
+            event.duration_micros / 1e6
+        )
+        operation = _OPERATION.get()
+        MONGO_COMMAND_FAILURES.labels(
+            operation.name if operation is not None else "other",
+            event.command_name,
+        ).inc()
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Open, checked out and awaited connections, over all pools."""
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        MONGO_POOL_CONNECTIONS.labels("open").inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.labels("open").dec()
+
+    def connection_check_out_started(self, event):
+        MONGO_POOL_CONNECTIONS.labels("waiting").inc()
+
+    def connection_check_out_failed(self, event):
+        MONGO_POOL_CONNECTIONS.labels("waiting").dec()
+
+    def connection_checked_out(self, event):
+        MONGO_POOL_CONNECTIONS.labels("waiting").dec()
+        MONGO_POOL_CONNECTIONS.labels("in_use").inc()
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CONNECTIONS.labels("in_use").dec()
+
+
+LISTENERS = [CommandMetrics(), PoolMetrics()]
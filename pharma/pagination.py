@@ -0,0 +1,88 @@
+"""Keyset pagination for the /agent endpoints.
+
+A page is fetched with the sort key of the last item of the previous
+page, so every query stays a bounded index range however deep the client
+pages. The key is handed to clients as an opaque cursor.
+"""
+
+import base64
+import binascii
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Type
+
+from bson import json_util
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+from pharma.models import list_adapter
+
+
+class PageParams(NamedTuple):
+    after: Optional[tuple]
+    limit: int
+    fields: Optional[Set[str]]
+
+
+def encode_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(
+        json_util.dumps(list(key)).encode()
+    ).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Sort key of a cursor; ValueError if it was not made by encode_cursor."""
+    try:
+        key = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(key, list) or not key:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return tuple(key)
+
+
+def keyset_filter(fields: List[str], after: Optional[tuple]) -> Dict[str, Any]:
+    """Query matching the documents sorted after key, on fields ascending."""
+    if after is None:
+        return {}
+    clauses = [
+        {
+            **{field: value for field, value in zip(fields[:i], after)},
+            fields[i]: {"$gt": after[i]},
+        }
+        for i in range(len(fields))
+    ]
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def check_fields(model: Type[BaseModel], fields: Optional[Set[str]]) -> None:
+    """Check that every requested field exists on model."""
+    if fields:
+        unknown = fields - set(model.model_fields)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+
+def page(
+    items: List[BaseModel],
+    params: PageParams,
+    key: Callable[[Any], tuple],
+) -> ORJSONResponse:
+    """Serialize one page; items holds up to params.limit + 1 results.
+
+    The extra result only tells whether a next page exists. The items are
+    dumped in one call and the response rendered by orjson, bypassing
+    FastAPI's per-value jsonable_encoder.
+    """
+    more = len(items) > params.limit
+    items = items[: params.limit]
+    dumped: List[Dict[str, Any]] = []
+    if items:
+        dumped = list_adapter(type(items[0])).dump_python(
+            items,
+            include={"__all__": params.fields} if params.fields else None,
+        )
+    return ORJSONResponse(
+        {
+            "items": dumped,
+            "next_cursor": encode_cursor(key(items[-1])) if more else None,
+        }
+    )
@@ -0,0 +1,290 @@
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+
+from pharma.pagination import keyset_filter
+
+# --- Aggregation pipelines used by the agent ---
+
+
+def forecast_consumption_pipeline(
+    months: int = 3, after: Optional[str] = None, limit: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Average monthly consumption per product joined with its current stock.
+
+    Runs on the movements collection and yields documents shaped like
+    ForecastResult, sorted by product_id, so the whole forecast is one
+    round trip. Movements of products before `after` are filtered out
+    before the grouping; the movements of every later product in the
+    window are still grouped before the page is cut. The stock lookup
+    then only runs for the products returned.
+
+    Args:
+        months (int): Size of the history window, in 30-day months.
+        after (Optional[str]): Start after this product_id.
+        limit (Optional[int]): Largest number of products to return.
+
+    Returns:
+        List[Dict[str, Any]]: The aggregation pipeline.
+    """
+    cutoff_date = datetime.utcnow() - timedelta(days=30 * months)
+    window: Dict[str, Any] = {
+        "movement_type": "SORTIE",
+        "date": {"$gte": cutoff_date},
+    }
+    if after is not None:
+        window["product_id"] = {"$gt": after}
+    pipeline: List[Dict[str, Any]] = [
+        {"$match": window},
+        {"$group": {"_id": "$product_id", "total": {"$sum": "$quantity"}}},
+        {"$sort": {"_id": 1}},
+    ]
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+    return pipeline + [
+        {
+            "$lookup": {
+                "from": "stocks",
+                "localField": "_id",
+                "foreignField": "product_id",
+                "as": "stock",
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "product_id": "$_id",
+                "average_consumption": {"$divide": ["$total", months]},
+                "stock_quantity": {
+                    "$ifNull": [{"$first": "$stock.quantity"}, 0]
+                },
+            }
+        },
+        {
+            "$project": {
+                "product_id": 1,
+                "average_consumption": 1,
+                "suggested_quantity": {
+                    "$toInt": {
+                        "$max": [
+                            0,
+                            {
+                                "$trunc": {
+                                    "$subtract": [
+                                        {
+                                            "$multiply": [
+                                                "$average_consumption",
+                                                2,
+                                            ]
+                                        },
+                                        "$stock_quantity",
+                                    ]
+                                }
+                            },
+                        ]
+                    }
+                },
+            }
+        },
+    ]
+
+
+def expiring_products_pipeline(
+    horizons: Sequence[int],
+    today: date,
+    after: Optional[tuple] = None,
+    limit: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Products expiring within the largest horizon, most urgent first.
+
+    Runs on the products collection as one range on the
+    (expiration_date, id) index, which also gives the order, so only the
+    products returned are read. Each is tagged with the smallest horizon
+    it falls in. Products already expired fall in the first one.
+
+    Args:
+        horizons (Sequence[int]): Horizons in calendar days, ascending.
+        today (date): Day the horizons start from.
+        after (Optional[tuple]): Start after this (expiration_date, id).
+        limit (Optional[int]): Largest number of products to return.
+
+    Returns:
+        List[Dict[str, Any]]: The aggregation pipeline.
+    """
+    # Expiring within h calendar days: before the start of day h + 1.
+    cutoffs = [
+        datetime.combine(today + timedelta(days=h + 1), time.min)
+        for h in horizons
+    ]
+    pipeline: List[Dict[str, Any]] = [
+        {
+            "$match": {
+                "expiration_date": {"$lt": cutoffs[-1]},
+                **keyset_filter(["expiration_date", "id"], after),
+            }
+        },
+        {"$sort": {"expiration_date": 1, "id": 1}},
+    ]
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+    return pipeline + [
+        {
+            "$project": {
+                "_id": 0,
+                "id": 1,
+                "expiration_date": 1,
+                "horizon_days": {
+                    "$switch": {
+                        "branches": [
+                            {
+                                "case": {"$lt": ["$expiration_date", cutoff]},
+                                "then": h,
+                            }
+                            for h, cutoff in zip(horizons, cutoffs)
+                        ],
+                        "default": horizons[-1],
+                    }
+                },
+            }
+        },
+    ]
+
+
+def inventory_audit_pipeline(
+    tolerance: int = 5,
+    since: Optional[int] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+    pending: Sequence[int] = (),
+) -> List[Dict[str, Any]]:
+    """
+    Products whose stock differs from the balance implied by movements.
+
+    Runs on the movements collection: movements are reduced to one signed
+    sum per product, unioned with the current stock quantities and
+    regrouped, so every collection is read once. When since is given,
+    only movements ingested after it are replayed on top of the
+    quantities saved in audit_checkpoints by the clean audit that ended
+    at that point of the ingestion sequence. With after, every
+    collection is filtered on product_id before the grouping, but all
+    later products are still grouped before the page is cut.
+
+    Args:
+        tolerance (int): Largest accepted absolute discrepancy.
+        since (Optional[int]): ingest_seq of the audit checkpoint to start
+            from, or None to replay the whole movement history.
+        after (Optional[str]): Only report products after this product_id.
+        limit (Optional[int]): Largest number of discrepancies to return.
+        pending (Sequence[int]): ingest_seq of the batches the checkpoint
+            saw numbered but not committed, replayed too.
+
+    Returns:
+        List[Dict[str, Any]]: The aggregation pipeline.
+    """
+    products: Dict[str, Any] = {}
+    if after is not None:
+        products = {"product_id": {"$gt": after}}
+    replayed: Dict[str, Any] = dict(products)
+    if since is not None:
+        replayed["ingest_seq"] = {"$gt": since}
+        if pending:
+            replayed = {
+                **products,
+                "$or": [
+                    {"ingest_seq": {"$gt": since}},
+                    {"ingest_seq": {"$in": list(pending)}},
+                ],
+            }
+    pipeline: List[Dict[str, Any]] = []
+    if replayed:
+        pipeline.append({"$match": replayed})
+    pipeline += [
+        {
+            "$group": {
+                "_id": "$product_id",
+                "expected": {
+                    "$sum": {
+                        "$cond": [
+                            {"$in": ["$movement_type", ["ENTREE", "RETOUR"]]},
+                            "$quantity",
+                            {"$multiply": ["$quantity", -1]},
+                        ]
+                    }
+                },
+                "stock": {"$sum": 0},
+            }
+        },
+        {
+            "$unionWith": {
+                "coll": "stocks",
+                "pipeline": [
+                    {"$match": products},
+                    {
+                        "$project": {
+                            "_id": "$product_id",
+                            "expected": {"$literal": 0},
+                            "stock": "$quantity",
+                        }
+                    },
+                ],
+            }
+        },
+    ]
+    if since is not None:
+        pipeline.append(
+            {
+                "$unionWith": {
+                    "coll": "audit_checkpoints",
+                    "pipeline": [
+                        {"$match": products},
+                        {
+                            "$project": {
+                                "_id": "$product_id",
+                                "expected": "$quantity",
+                                "stock": {"$literal": 0},
+                            }
+                        },
+                    ],
+                }
+            }
+        )
+    pipeline += [
+        {
+            "$group": {
+                "_id": "$_id",
+                "expected": {"$sum": "$expected"},
+                "stock": {"$sum": "$stock"},
+            }
+        },
+        {
+            "$match": {
+                "$expr": {
+                    "$gt": [
+                        {"$abs": {"$subtract": ["$stock", "$expected"]}},
+                        tolerance,
+                    ]
+                }
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "product_id": "$_id",
+                "stock": 1,
+                "expected": 1,
+            }
+        },
+        {"$sort": {"product_id": 1}},
+    ]
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+    return pipeline
+
+
+def checked_deliveries_filter() -> Dict[str, Any]:
+    """Deliveries with an ordered quantity to check the received one against.
+
+    Also the partial filter of the movements index verify_deliveries reads.
+    """
+    return {"movement_type": "ENTREE", "expected_quantity": {"$gt": 0}}
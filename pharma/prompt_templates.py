@@ -1,25 +1,92 @@
-from typing import List
-
+from typing import Any, Callable, List, Optional
+
+import daiquiri
+
+from pharma.context import (
+    ContextItem,
+    Section,
+    alert_rank,
+    compact,
+    fields,
+    forecast_rank,
+    summarize_alerts,
+    summarize_quantities,
+)
+from pharma.metrics import LLM_CONTEXT_TOKENS_SAVED
 from pharma.models import Alert, ForecastResult, KPIReport, PurchaseProposal
+from pharma.settings import SETTINGS
+
+LOGGER = daiquiri.getLogger(__name__)
+
+
+def _alerts_section(
+    alerts: List[Any], line: Callable[[dict], str], budget: int
+) -> Section:
+    items = []
+    for alert in map(fields, alerts):
+        items.append(
+            ContextItem(
+                alert["product_id"],
+                alert["alert_type"],
+                alert_rank(
+                    alert["alert_type"], alert["date"], alert.get("severity")
+                ),
+                line(alert),
+            )
+        )
+    return compact(items, budget, summarize_alerts)
+
+
+def _forecasts_section(
+    forecasts: List[Any], line: Callable[[dict], str], budget: int
+) -> Section:
+    items = []
+    for forecast in map(fields, forecasts):
+        quantity = forecast["suggested_quantity"]
+        items.append(
+            ContextItem(
+                forecast["product_id"],
+                "à commander" if quantity > 0 else "au stock suffisant",
+                forecast_rank(forecast["average_consumption"], quantity),
+                line(forecast),
+                quantity,
+            )
+        )
+    return compact(items, budget, summarize_quantities)
 
 
-def prompt_forecast(forecasts: List[ForecastResult]) -> str:
-    lines = [
-        f"- {f.product_id} : {f.suggested_quantity} unités à prévoir"
-        for f in forecasts
-    ]
+def _report(prompt: str, *sections: Section):
+    saved = sum(section.saved for section in sections)
+    LLM_CONTEXT_TOKENS_SAVED.labels(prompt).observe(saved)
+    LOGGER.debug("Context of %s prompt: %d tokens saved", prompt, saved)
+
+
+def prompt_forecast(
+    forecasts: List[ForecastResult], budget: Optional[int] = None
+) -> str:
+    section = _forecasts_section(
+        forecasts,
+        lambda f: f"- {f['product_id']} : {f['suggested_quantity']} unités à prévoir",
+        budget or SETTINGS.llm_context_tokens,
+    )
+    _report("forecast", section)
     return (
         "Voici les prévisions de consommation à analyser :\n"
-        + "\n".join(lines)
+        + section.text
         + "\nExplique quels produits sont à risque de rupture et pourquoi."
     )
 
 
-def prompt_alerts(alerts: List[Alert]) -> str:
-    lines = [f"{a.alert_type} – {a.product_id} : {a.message}" for a in alerts]
+def prompt_alerts(alerts: List[Alert], budget: Optional[int] = None) -> str:
+    section = _alerts_section(
+        alerts,
+        lambda a: f"{a['alert_type']} – {a['product_id']} : {a['message']}",
+        budget or SETTINGS.llm_context_tokens,
+    )
+    _report("alerts", section)
     return (
         "Voici les alertes détectées par le système :\n"
-        + "\n".join(lines)
+        + section.text
         + "\nReformule ces alertes en langage clair à destination du pharmacien."
     )
 
@@ -70,30 +137,29 @@ def prompt_delivery_verification(alerts: List[Alert]) -> str:
     )
 
 
-def prompt_conversational(message: str, context: dict) -> str:
+def prompt_conversational(
+    message: str, context: dict, budget: Optional[int] = None
+) -> str:
     forecast = context.get("forecast", [])
     alerts = context.get("alerts", [])
-    summary = (
-        "\n".join(
-            [
-                f"- {f['product_id']}: {f['suggested_quantity']} unités à commander"
-                for f in forecast
-            ]
-        )
-        if forecast
-        else "Aucune prévision critique."
-    )
+    budget = budget or SETTINGS.llm_context_tokens
 
-    alert_texts = (
-        "\n".join(
-            [
-                f"- {a['product_id']} ({a['alert_type']}) : {a['message']}"
-                for a in alerts
-            ]
-        )
-        if alerts
-        else "Aucune alerte active."
+    # Alerts get up to half the budget; forecasts what they leave.
+    alerts_section = _alerts_section(
+        alerts,
+        lambda a: f"- {a['product_id']} ({a['alert_type']}) : {a['message']}",
+        budget // 2,
+    )
+    forecast_section = _forecasts_section(
+        forecast,
+        lambda f: f"- {f['product_id']}: {f['suggested_quantity']} unités à commander",
+        budget - alerts_section.tokens,
+    )
+    _report("conversational", alerts_section, forecast_section)
+    summary = (
+        forecast_section.text if forecast else "Aucune prévision critique."
     )
+    alert_texts = alerts_section.text if alerts else "Aucune alerte active."
 
     return (
         f"Voici l’état du système :\n"
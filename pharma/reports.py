@@ -0,0 +1,453 @@
+"""Report pipelines, served by /reports and /exports.
+
+They are the only definition of these reports: the helpers of
+aggregate.py and aggregations.py run them too, passing the names of the
+collections to join (the application's by default). They are built from a few
+shared stages, shaped for a large catalogue:
+
+- each pipeline starts from the collection it filters or groups on, and
+  joins the other collections only for the rows left;
+- documents are projected down to the fields used before each $lookup,
+  and the joined side returns only the fields kept.
+
+Documents do not carry the ObjectId _id.
+"""
+
+from datetime import datetime, timedelta
+from enum import Enum
+from inspect import signature
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+Pipeline = List[Dict[str, Any]]
+
+
+# --- Stages ---
+
+
+def project(*fields: str, **computed: Any) -> Dict[str, Any]:
+    """$project keeping fields and adding computed ones, without _id."""
+    return {
+        "$project": {"_id": 0, **{field: 1 for field in fields}, **computed}
+    }
+
+
+def lookup_one(
+    collection: str,
+    local_field: str,
+    foreign_field: str,
+    as_field: str,
+    *fields: str,
+) -> Pipeline:
+    """
+    Join the document of collection matching local_field.
+
+    Only fields of the joined document are kept. As with $unwind,
+    documents without a match are dropped.
+
+    Args:
+        collection (str): Collection to join.
+        local_field (str): Field of the input documents.
+        foreign_field (str): Field of collection it must equal.
+        as_field (str): Field the joined document is stored under.
+        *fields (str): Fields of the joined document to keep.
+
+    Returns:
+        Pipeline: The $lookup and $unwind stages.
+    """
+    return [
+        {
+            "$lookup": {
+                "from": collection,
+                "localField": local_field,
+                "foreignField": foreign_field,
+                "pipeline": [project(*fields)],
+                "as": as_field,
+            }
+        },
+        {"$unwind": f"${as_field}"},
+    ]
+
+
+def stocks_below(
+    threshold: str, thresholds: str = "stock_thresholds"
+) -> Pipeline:
+    """Stocks under a field of their document in thresholds.
+
+    Runs on the stocks collection and yields product_id, quantity and
+    the threshold.
+    """
+    return [
+        project("product_id", "quantity"),
+        *lookup_one(
+            thresholds,
+            "product_id",
+            "product_id",
+            "threshold",
+            threshold,
+        ),
+        {
+            "$match": {
+                "$expr": {"$lt": ["$quantity", f"$threshold.{threshold}"]}
+            }
+        },
+    ]
+
+
+def days_until(field: str, now: datetime) -> Dict[str, Any]:
+    return {"$divide": [{"$subtract": [f"${field}", now]}, DAY_MS]}
+
+
+# --- Reports ---
+
+
+def products_with_stock(stocks: str = "stocks") -> Pipeline:
+    """Products with their stock quantity, update date and location."""
+    return [
+        project("id", "name", "category", "expiration_date", "unit_price"),
+        *lookup_one(
+            stocks,
+            "id",
+            "product_id",
+            "stock_info",
+            "quantity",
+            "last_update",
+            "location",
+        ),
+        project(
+            "id",
+            "name",
+            "category",
+            "expiration_date",
+            "unit_price",
+            quantity="$stock_info.quantity",
+            last_update="$stock_info.last_update",
+            location="$stock_info.location",
+        ),
+    ]
+
+
+def products_near_expiry(months: int = 3) -> Pipeline:
+    """Products expiring within months 30-day months."""
+    now = datetime.utcnow()
+    return [
+        {
+            "$match": {
+                "expiration_date": {"$lte": now + timedelta(days=30 * months)}
+            }
+        },
+        project(
+            "id",
+            "name",
+            "expiration_date",
+            jours_restants=days_until("expiration_date", now),
+        ),
+    ]
+
+
+def products_below_critical_threshold(
+    products: str = "products", thresholds: str = "stock_thresholds"
+) -> Pipeline:
+    """Products whose stock is under their critical threshold."""
+    return [
+        *stocks_below("critical_stock", thresholds),
+        *lookup_one(products, "product_id", "id", "product", "name"),
+        project(
+            id="$product_id",
+            name="$product.name",
+            quantity="$quantity",
+            critical_stock="$threshold.critical_stock",
+        ),
+    ]
+
+
+def total_stock_value(products: str = "products") -> Pipeline:
+    """Value of the stock at unit price, as valeur_totale_stock."""
+    return [
+        # Empty stocks add nothing to the total.
+        {"$match": {"quantity": {"$gt": 0}}},
+        project("product_id", "quantity"),
+        *lookup_one(products, "product_id", "id", "product", "unit_price"),
+        {
+            "$group": {
+                "_id": None,
+                "valeur_totale_stock": {
+                    "$sum": {"$multiply": ["$product.unit_price", "$quantity"]}
+                },
+            }
+        },
+        project("valeur_totale_stock"),
+    ]
+
+
+def stock_statistics_by_category(stocks: str = "stocks") -> Pipeline:
+    """Products and units in stock per category, most units first."""
+    return [
+        project("id", "category"),
+        *lookup_one(stocks, "id", "product_id", "stock", "quantity"),
+        {
+            "$group": {
+                "_id": "$category",
+                "nombre_de_produits": {"$sum": 1},
+                "quantite_totale": {"$sum": "$stock.quantity"},
+            }
+        },
+        {"$sort": {"quantite_totale": -1}},
+    ]
+
+
+def pre_order_forecast(
+    months: int = 3, products: str = "products"
+) -> Pipeline:
+    """Average quantity per SORTIE movement and category, per product."""
+    return [
+        {
+            "$match": {
+                "movement_type": "SORTIE",
+                "date": {
+                    "$gte": datetime.utcnow() - timedelta(days=30 * months)
+                },
+            }
+        },
+        {
+            "$group": {
+                "_id": "$product_id",
+                "average_consumption": {"$avg": "$quantity"},
+            }
+        },
+        *lookup_one(products, "_id", "id", "product_info", "category"),
+        project(
+            "average_consumption",
+            product_id="$_id",
+            category="$product_info.category",
+        ),
+    ]
+
+
+def critical_threshold_alerts(
+    thresholds: str = "stock_thresholds",
+) -> Pipeline:
+    """Stocks under their critical threshold."""
+    return [
+        *stocks_below("critical_stock", thresholds),
+        project(
+            "product_id",
+            current_stock="$quantity",
+            critical_threshold="$threshold.critical_stock",
+        ),
+    ]
+
+
+def deliveries(products: str = "products") -> Pipeline:
+    """Units received per product, with its batch and expiration date."""
+    return [
+        {"$match": {"movement_type": "ENTREE"}},
+        {
+            "$group": {
+                "_id": "$product_id",
+                "total_received": {"$sum": "$quantity"},
+            }
+        },
+        *lookup_one(
+            products,
+            "_id",
+            "id",
+            "product_info",
+            "batch_number",
+            "expiration_date",
+        ),
+        project(
+            "total_received",
+            product_id="$_id",
+            batch_number="$product_info.batch_number",
+            expiration_date="$product_info.expiration_date",
+        ),
+    ]
+
+
+def expiring_products(
+    days_limit: int = 30, stocks: str = "stocks"
+) -> Pipeline:
+    """Products expiring within days_limit days, with their stock."""
+    now = datetime.utcnow()
+    return [
+        {
+            "$match": {
+                "expiration_date": {"$lte": now + timedelta(days=days_limit)}
+            }
+        },
+        project("id", "name", "expiration_date"),
+        *lookup_one(stocks, "id", "product_id", "stock_info", "quantity"),
+        project(
+            "name",
+            "expiration_date",
+            product_id="$id",
+            current_stock="$stock_info.quantity",
+            days_until_expiry=days_until("expiration_date", now),
+        ),
+    ]
+
+
+def inventory_report(stocks: str = "stocks") -> Pipeline:
+    """Products and units in stock per category, with the products."""
+    return [
+        project("id", "name", "category"),
+        *lookup_one(stocks, "id", "product_id", "stock_info", "quantity"),
+        {
+            "$group": {
+                "_id": "$category",
+                "total_products": {"$sum": 1},
+                "total_quantity": {"$sum": "$stock_info.quantity"},
+                "products": {
+                    "$push": {
+                        "product_id": "$id",
+                        "name": "$name",
+                        "quantity": "$stock_info.quantity",
+                    }
+                },
+            }
+        },
+    ]
+
+
+def replenishment_suggestions(
+    products: str = "products", thresholds: str = "stock_thresholds"
+) -> Pipeline:
+    """Stocks of known products under their minimum, with the quantity
+    to get back to it."""
+    return [
+        *stocks_below("minimum_stock", thresholds),
+        *lookup_one(products, "product_id", "id", "product", "id"),
+        project(
+            "product_id",
+            current_stock="$quantity",
+            minimum_stock="$threshold.minimum_stock",
+            suggested_quantity={
+                "$subtract": ["$threshold.minimum_stock", "$quantity"]
+            },
+        ),
+    ]
+
+
+def performance_report(products: str = "products") -> Pipeline:
+    """The 5 known products with the most units out, and their stockouts.
+
+    Products are joined in descending order of units out and the top 5
+    cut after the join, so a product missing from products is skipped
+    instead of taking a place. Stages after the sort stream, so the join
+    stops once 5 products are found.
+    """
+    return [
+        {"$match": {"movement_type": {"$in": ["SORTIE", "RUPTURE"]}}},
+        {
+            "$group": {
+                "_id": "$product_id",
+                "total_exits": {
+                    "$sum": {
+                        "$cond": [
+                            {"$eq": ["$movement_type", "SORTIE"]},
+                            "$quantity",
+                            0,
+                        ]
+                    }
+                },
+                "total_ruptures": {
+                    "$sum": {
+                        "$cond": [
+                            {"$eq": ["$movement_type", "RUPTURE"]},
+                            1,
+                            0,
+                        ]
+                    }
+                },
+            }
+        },
+        {"$sort": {"total_exits": -1}},
+        *lookup_one(products, "_id", "id", "product_info", "name", "category"),
+        {"$limit": 5},
+        project(
+            "total_exits",
+            "total_ruptures",
+            product_id="$_id",
+            name="$product_info.name",
+            category="$product_info.category",
+        ),
+    ]
+
+
+# Builder parameters naming the collections to join, set by the helpers
+# only.
+COLLECTIONS = {"products", "stocks", "thresholds"}
+
+
+class Report(str, Enum):
+    products_with_stock = "products-with-stock"
+    products_near_expiry = "products-near-expiry"
+    products_below_critical_threshold = "products-below-critical-threshold"
+    total_stock_value = "total-stock-value"
+    stock_statistics_by_category = "stock-statistics-by-category"
+    pre_order_forecast = "pre-order-forecast"
+    critical_threshold_alerts = "critical-threshold-alerts"
+    deliveries = "deliveries"
+    expiring_products = "expiring-products"
+    inventory_report = "inventory-report"
+    replenishment_suggestions = "replenishment-suggestions"
+    performance_report = "performance-report"
+
+
+class ReportPipeline(NamedTuple):
+    # Collection the pipeline runs on.
+    collection: str
+    build: Callable[..., Pipeline]
+
+
+REPORTS: Dict[Report, ReportPipeline] = {
+    Report.products_with_stock: ReportPipeline(
+        "products", products_with_stock
+    ),
+    Report.products_near_expiry: ReportPipeline(
+        "products", products_near_expiry
+    ),
+    Report.products_below_critical_threshold: ReportPipeline(
+        "stocks", products_below_critical_threshold
+    ),
+    Report.total_stock_value: ReportPipeline("stocks", total_stock_value),
+    Report.stock_statistics_by_category: ReportPipeline(
+        "products", stock_statistics_by_category
+    ),
+    Report.pre_order_forecast: ReportPipeline("movements", pre_order_forecast),
+    Report.critical_threshold_alerts: ReportPipeline(
+        "stocks", critical_threshold_alerts
+    ),
+    Report.deliveries: ReportPipeline("movements", deliveries),
+    Report.expiring_products: ReportPipeline("products", expiring_products),
+    Report.inventory_report: ReportPipeline("products", inventory_report),
+    Report.replenishment_suggestions: ReportPipeline(
+        "stocks", replenishment_suggestions
+    ),
+    Report.performance_report: ReportPipeline("movements", performance_report),
+}
+
+
+def report_pipeline(report: Report, **kwargs: Any) -> Tuple[str, Pipeline]:
+    """
+    Collection and pipeline of a report.
+
+    Args:
+        report (Report): The report.
+        **kwargs (Any): Its parameters (months, days_limit).
+
+    Raises:
+        ValueError: If the report does not take one of the parameters.
+
+    Returns:
+        Tuple[str, Pipeline]: The collection to aggregate and the pipeline.
+    """
+    collection, build = REPORTS[report]
+    unknown = set(kwargs) - (set(signature(build).parameters) - COLLECTIONS)
+    if unknown:
+        raise ValueError(
+            f"{report.value} does not take {', '.join(sorted(unknown))}"
+        )
+    return collection, build(**kwargs)
@@ -1,41 +1,162 @@
-from fastapi import APIRouter
-from pharma.services.agent import SmartInventoryAgent
-
+from datetime import datetime
+from typing import List, Literal, Optional, Type
+
+from fastapi import APIRouter, HTTPException, Query, Response
+from pydantic import BaseModel
+
+from pharma.dependencies import Agent, CurrentSnapshot, Fields, Paging
+from pharma.models import Alert, ForecastResult, KPIReport, PurchaseProposal
+from pharma.pagination import PageParams, check_fields, page
+from pharma.services.movements import checkpoint_inventory_audit
+from pharma.services.snapshots import (
+    Snapshot,
+    snapshot_forecasts,
+    snapshot_proposals,
+)
 
 router = APIRouter(prefix="/agent", tags=["Agents"])
-ag = SmartInventoryAgent()
+
+
+def start(
+    paging: PageParams, model: Type[BaseModel], key_size: int = 1
+) -> Optional[tuple]:
+    """Validate a page request and return the sort key to start after."""
+    try:
+        check_fields(model, paging.fields)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if paging.after is not None and len(paging.after) != key_size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return paging.after
+
+
+def by_product(item) -> tuple:
+    return (item.product_id,)
+
+
+def snapshot_headers(response: Response, snapshot: Snapshot):
+    """Tell the client how old the served snapshot is."""
+    response.headers["Age"] = str(int(snapshot.age))
+    response.headers["X-Snapshot-Version"] = str(snapshot.version)
+
+
+# /forecast and /proposals read the latest snapshot when one has been
+# built (see pharma.services.snapshots), and compute live otherwise.
 
 
 @router.get("/forecast")
-def get_forecast():
-    return ag.forecast_consumption()
+async def get_forecast(ag: Agent, paging: Paging, snapshot: CurrentSnapshot):
+    after = start(paging, ForecastResult)
+    if snapshot is None:
+        forecasts = await ag.forecast_consumption(
+            after=after, limit=paging.limit + 1
+        )
+    else:
+        forecasts = await snapshot_forecasts(
+            ag.db,
+            snapshot,
+            after=after,
+            limit=paging.limit + 1,
+            fields=paging.fields,
+        )
+    response = page(forecasts, paging, by_product)
+    if snapshot is not None:
+        snapshot_headers(response, snapshot)
+    return response
 
 
 @router.get("/alerts/critical")
-def get_critical_alerts():
-    return ag.detect_critical_stocks()
+async def get_critical_alerts(
+    ag: Agent,
+    paging: Paging,
+    severity: Optional[Literal["WARNING", "CRITICAL"]] = None,
+):
+    after = start(paging, Alert)
+    alerts = await ag.detect_critical_stocks(
+        severity, after=after, limit=paging.limit + 1
+    )
+    return page(alerts, paging, by_product)
 
 
 @router.get("/alerts/expiry")
-def get_expiry_alerts():
-    return ag.detect_expiring_products()
+async def get_expiry_alerts(
+    ag: Agent,
+    paging: Paging,
+    horizon: List[int] = Query(
+        [], description="Horizons in days; SETTINGS.expiry_horizons if none."
+    ),
+):
+    after = start(paging, Alert, key_size=2)
+    if any(days < 0 for days in horizon):
+        raise HTTPException(status_code=422, detail="Negative horizon")
+    alerts = await ag.detect_expiring_products(
+        tuple(horizon) or None, after=after, limit=paging.limit + 1
+    )
+    return page(alerts, paging, lambda a: (a.date, a.product_id))
 
 
 @router.get("/audit")
-def get_inventory_audit():
-    return ag.simulate_inventory_audit()
+async def get_inventory_audit(
+    ag: Agent, paging: Paging, since: Optional[datetime] = None
+):
+    after = start(paging, Alert)
+    try:
+        alerts = await ag.simulate_inventory_audit(
+            since, after=after, limit=paging.limit + 1
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return page(alerts, paging, by_product)
+
+
+@router.get("/audit/checkpoint")
+async def get_inventory_audit_checkpoint(ag: Agent):
+    return {"since": await ag.last_audit_checkpoint()}
+
+
+@router.post("/audit/checkpoint")
+async def create_inventory_audit_checkpoint(ag: Agent):
+    """Audit the stocks and, if clean, save them as the new checkpoint."""
+    since = await checkpoint_inventory_audit(ag.db)
+    if since is None:
+        raise HTTPException(
+            status_code=409, detail="The audit found discrepancies"
+        )
+    return {"since": since}
 
 
 @router.get("/kpis")
-def get_kpi():
-    return ag.generate_kpi_report()
+async def get_kpi(ag: Agent, fields: Fields):
+    try:
+        check_fields(KPIReport, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return (await ag.generate_kpi_report()).model_dump(include=fields)
 
 
 @router.get("/proposals")
-def get_proposals():
-    return ag.suggest_purchase_orders()
+async def get_proposals(ag: Agent, paging: Paging, snapshot: CurrentSnapshot):
+    after = start(paging, PurchaseProposal)
+    if snapshot is None:
+        proposals = await ag.suggest_purchase_orders(
+            after=after, limit=paging.limit + 1
+        )
+    else:
+        proposals = await snapshot_proposals(
+            ag.db,
+            snapshot,
+            after=after,
+            limit=paging.limit + 1,
+            fields=paging.fields,
+        )
+    response = page(proposals, paging, by_product)
+    if snapshot is not None:
+        snapshot_headers(response, snapshot)
+    return response
 
 
 @router.get("/deliveries")
-def get_delivery_verification():
-    return ag.verify_deliveries()
+async def get_delivery_verification(ag: Agent, paging: Paging):
+    after = start(paging, Alert, key_size=2)
+    alerts = await ag.verify_deliveries(after=after, limit=paging.limit + 1)
+    return page(alerts, paging, lambda a: (a.product_id, a.date))
@@ -0,0 +1,95 @@
+import asyncio
+from typing import Awaitable, List, TypeVar
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+
+from pharma.dependencies import Engine
+from pharma.models import StockAlert
+from pharma.services.alerts import AlertEngine
+from pharma.utils import sse
+
+T = TypeVar("T")
+
+router = APIRouter(prefix="/agent/alerts", tags=["Alerts"])
+
+KEEPALIVE_SECONDS = 15
+
+
+async def alert_events(engine: AlertEngine, queue: asyncio.Queue):
+    """A snapshot of the active alerts, then one event per change."""
+    try:
+        await engine.ready.wait()
+        yield sse("snapshot", engine.snapshot())
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                return
+            yield sse("delta", event)
+    finally:
+        engine.unsubscribe(queue)
+
+
+async def wait_for_close(websocket: WebSocket):
+    """Return once the client closes; its messages are ignored."""
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
+
+
+async def until_closed(closed: asyncio.Task, work: Awaitable[T]) -> T:
+    """Await work, or raise WebSocketDisconnect if the client closes."""
+    task = asyncio.ensure_future(work)
+    done, _ = await asyncio.wait(
+        {task, closed}, return_when=asyncio.FIRST_COMPLETED
+    )
+    if task not in done:
+        task.cancel()
+        raise WebSocketDisconnect()
+    return task.result()
+
+
+@router.get("/active")
+async def get_active_alerts(engine: Engine) -> List[StockAlert]:
+    await engine.ready.wait()
+    return engine.snapshot()
+
+
+@router.get("/stream")
+async def stream_alerts(engine: Engine):
+    """Server-Sent Events: `snapshot` first, then `delta` events."""
+    return StreamingResponse(
+        alert_events(engine, engine.subscribe()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/ws")
+async def alerts_websocket(websocket: WebSocket):
+    """Same feed as /stream over a WebSocket."""
+    engine = websocket.app.alert_engine
+    if engine is None:
+        await websocket.close(code=1013, reason="Live alerts disabled")
+        return
+    await websocket.accept()
+    queue = engine.subscribe()
+    # Reading the socket is what notices the client leaving.
+    closed = asyncio.create_task(wait_for_close(websocket))
+    try:
+        await until_closed(closed, engine.ready.wait())
+        await websocket.send_json(
+            {"op": "snapshot", "alerts": jsonable_encoder(engine.snapshot())}
+        )
+        while (event := await until_closed(closed, queue.get())) is not None:
+            await websocket.send_json(event)
+        await websocket.close(code=1013, reason="Too far behind")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        closed.cancel()
+        engine.unsubscribe(queue)
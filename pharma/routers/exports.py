@@ -0,0 +1,31 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+
+from pharma.dependencies import ReportParams
+from pharma.reports import Report, report_pipeline
+from pharma.settings import SETTINGS
+from pharma.streaming import NDJSON, ndjson
+
+router = APIRouter(prefix="/exports", tags=["Exports"])
+
+
+@router.get(
+    "/{report}",
+    response_class=StreamingResponse,
+    responses={200: {"content": {NDJSON: {}}}},
+)
+async def export_report(
+    report: Report,
+    request: Request,
+    params: ReportParams,
+    batch_size: int = Query(SETTINGS.export_batch_size, ge=1, le=100_000),
+):
+    """Stream a report as NDJSON, one document per line."""
+    try:
+        collection, pipeline = report_pipeline(report, **params)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    documents = request.app.mongodb[collection].aggregate(
+        pipeline, batchSize=batch_size
+    )
+    return StreamingResponse(ndjson(documents, batch_size), media_type=NDJSON)
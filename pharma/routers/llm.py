@@ -1,108 +1,229 @@
-# app/api/router1.py
-from fastapi import APIRouter
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, List, Optional, TypeVar
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from pharma.dependencies import Agent, CurrentSnapshot
+from pharma.models import ChatRequest, ForecastResult, PurchaseProposal
 from pharma.prompt_templates import (
     prompt_alerts,
+    prompt_conversational,
     prompt_delivery_verification,
     prompt_forecast,
     prompt_inventory_audit,
     prompt_kpi_report,
     prompt_purchase_suggestions,
-    prompt_conversational
 )
+from pharma.services.llm import generate_response, stream_response
+from pharma.services.snapshots import (
+    Snapshot,
+    snapshot_forecasts,
+    snapshot_proposals,
+)
+from pharma.settings import SETTINGS
+from pharma.utils import sse
 
-from openai import OpenAI
-from pharma.models import ChatRequest
-from pharma.services.agent import SmartInventoryAgent
-import os
-
+T = TypeVar("T")
 
 router = APIRouter(prefix="/llm", tags=["Assistant LLM"])
 
+# Expiry horizons put in prompts: the CRITICAL and WARNING ones, not the
+# INFO horizons listed by /agent/alerts/expiry.
+PROMPT_EXPIRY_HORIZONS = (7, 30)
 
-ag = SmartInventoryAgent()
 
-# Set your OpenAI API key
-llm = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+async def wait_for_disconnect(request: Request):
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
 
 
-def generate_response(
-        prompt: str,
-        system_prompt: str = "Tu es un assistant pharmacien intelligent."
-) -> str:
-    # Format the prompt for a conversational AI system
-    formatted_prompt = [
-        {"role": "system", "content": system_prompt.strip()},
-        {"role": "user", "content": prompt.strip()},
-    ]
-    
+async def cancellable(request: Request, work: Awaitable[T]) -> T:
+    """Run work; cancel it on disconnect or after llm_request_timeout."""
+    task = asyncio.ensure_future(work)
+    disconnect = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        done, _ = await asyncio.wait(
+            {task, disconnect},
+            timeout=SETTINGS.llm_request_timeout,
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+    finally:
+        disconnect.cancel()
+    if task in done:
+        return task.result()
+    task.cancel()
+    if disconnect in done:
+        raise HTTPException(status_code=499, detail="Client closed request")
+    raise HTTPException(status_code=504, detail="LLM request timed out")
+
+
+async def answer(
+    prompt: str, question: Optional[str] = None
+) -> dict[str, Any]:
+    response = await generate_response(prompt, question=question)
+    return {"prompt": prompt, "response": response}
+
+
+async def stream_answer(
+    prompt: str, deadline: float, question: Optional[str] = None
+) -> AsyncIterator[str]:
+    """SSE: the prompt, one `token` event per chunk, then the whole answer.
+
+    Past deadline (event loop time) the completion is cancelled and an
+    `error` event ends the stream instead of `done`.
+    """
+    yield sse("prompt", {"prompt": prompt})
+    parts = []
+    tokens = stream_response(prompt, question=question)
     try:
-        # Make the API call using the chat model (e.g., gpt-3.5-turbo or gpt-4)
-        response = llm.chat.completions.create(
-            model="gpt-4",  # Use gpt-4 for more advanced responses
-            messages=formatted_prompt,
-            max_tokens=512,
-            temperature=0.7,
-            top_p=0.95,
-            stop=["</s>"]  # If you want to use a stop sequence (adjust as needed)
+        while True:
+            try:
+                async with asyncio.timeout_at(deadline):
+                    token = await anext(tokens)
+            except StopAsyncIteration:
+                break
+            except TimeoutError:
+                yield sse("error", {"detail": "LLM request timed out"})
+                return
+            parts.append(token)
+            yield sse("token", {"text": token})
+    finally:
+        await tokens.aclose()
+    yield sse("done", {"prompt": prompt, "response": "".join(parts).strip()})
+
+
+async def respond(
+    request: Request,
+    prompt: Awaitable[str],
+    stream: bool,
+    question: Optional[str] = None,
+):
+    """Answer the prompt as JSON, or as Server-Sent Events when streaming.
+
+    question, the user's own words within the prompt, lets the semantic
+    cache reuse the answer to a near-identical question.
+    """
+
+    # The deadline also bounds the token stream, after the response
+    # has started.
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SETTINGS.llm_request_timeout
+
+    async def work():
+        text = await prompt
+        return text if stream else await answer(text, question)
+
+    result = await cancellable(request, work())
+    if stream:
+        return StreamingResponse(
+            stream_answer(result, deadline, question),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
         )
-        
-        # Extract and return the assistant's response
-        assistant_response = response.choices[0].message.content
-        return assistant_response.strip()
+    return result
+
+
+async def forecasts(
+    ag: Agent, snapshot: Optional[Snapshot]
+) -> List[ForecastResult]:
+    """Forecasts of the current snapshot, or computed live."""
+    if snapshot is None:
+        return await ag.forecast_consumption()
+    return await snapshot_forecasts(ag.db, snapshot)
 
-    except Exception as e:
-        # Handle OpenAI API errors (e.g., rate limit, network issues)
-        print(f"An error occurred: {e}")
-        return "Sorry, I encountered an error. Please try again later."
+
+async def proposals(
+    ag: Agent, snapshot: Optional[Snapshot]
+) -> List[PurchaseProposal]:
+    """Purchase proposals of the current snapshot, or computed live."""
+    if snapshot is None:
+        return await ag.suggest_purchase_orders()
+    return await snapshot_proposals(ag.db, snapshot)
 
 
 @router.post("/chat")
-def chat(request: ChatRequest):
-    forecast = [f.dict() for f in ag.forecast_consumption()]
-    alerts = [a.dict() for a in ag.detect_critical_stocks() + ag.detect_expiring_products()]
-    
-    prompt = prompt_conversational(request.message, {"forecast": forecast, "alerts": alerts})
-    reply = generate_response(prompt)
-    return {"prompt": prompt, "response": reply}
+async def chat(
+    body: ChatRequest,
+    request: Request,
+    ag: Agent,
+    snapshot: CurrentSnapshot,
+    stream: bool = False,
+):
+    async def prompt():
+        forecast_results, critical, expiring = await asyncio.gather(
+            forecasts(ag, snapshot),
+            ag.detect_critical_stocks(),
+            ag.detect_expiring_products(PROMPT_EXPIRY_HORIZONS),
+        )
+        forecast = [f.dict() for f in forecast_results]
+        alerts = [a.dict() for a in critical + expiring]
+        return prompt_conversational(
+            body.message, {"forecast": forecast, "alerts": alerts}
+        )
+
+    return await respond(request, prompt(), stream, question=body.message)
 
 
 @router.get("/forecast")
-def explain_forecast():
-    forecasts = ag.forecast_consumption()
-    prompt = prompt_forecast(forecasts)
-    return {"prompt": prompt, "response": generate_response(prompt)}
+async def explain_forecast(
+    request: Request,
+    ag: Agent,
+    snapshot: CurrentSnapshot,
+    stream: bool = False,
+):
+    async def prompt():
+        return prompt_forecast(await forecasts(ag, snapshot))
+
+    return await respond(request, prompt(), stream)
 
 
 @router.get("/kpi")
-def explain_kpi():
-    kpis = ag.generate_kpi_report()
-    prompt = prompt_kpi_report(kpis)
-    return {"prompt": prompt, "response": generate_response(prompt)}
+async def explain_kpi(request: Request, ag: Agent, stream: bool = False):
+    async def prompt():
+        return prompt_kpi_report(await ag.generate_kpi_report())
+
+    return await respond(request, prompt(), stream)
 
 
 @router.get("/alerts")
-def humanize_alerts():
-    alerts = ag.detect_critical_stocks() + ag.detect_expiring_products()
-    prompt = prompt_alerts(alerts)
-    return {"prompt": prompt, "response": generate_response(prompt)}
+async def humanize_alerts(request: Request, ag: Agent, stream: bool = False):
+    async def prompt():
+        critical, expiring = await asyncio.gather(
+            ag.detect_critical_stocks(),
+            ag.detect_expiring_products(PROMPT_EXPIRY_HORIZONS),
+        )
+        return prompt_alerts(critical + expiring)
+
+    return await respond(request, prompt(), stream)
 
 
 @router.get("/inventory")
-def audit_explanation():
-    audit_alerts = ag.simulate_inventory_audit()
-    prompt = prompt_inventory_audit(audit_alerts)
-    return {"prompt": prompt, "response": generate_response(prompt)}
+async def audit_explanation(request: Request, ag: Agent, stream: bool = False):
+    async def prompt():
+        return prompt_inventory_audit(await ag.simulate_inventory_audit())
+
+    return await respond(request, prompt(), stream)
 
 
 @router.get("/purchase")
-def explain_proposals():
-    proposals = ag.suggest_purchase_orders()
-    prompt = prompt_purchase_suggestions(proposals)
-    return {"prompt": prompt, "response": generate_response(prompt)}
+async def explain_proposals(
+    request: Request,
+    ag: Agent,
+    snapshot: CurrentSnapshot,
+    stream: bool = False,
+):
+    async def prompt():
+        return prompt_purchase_suggestions(await proposals(ag, snapshot))
+
+    return await respond(request, prompt(), stream)
 
 
 @router.get("/delivery")
-def explain_deliveries():
-    alerts = ag.verify_deliveries()
-    prompt = prompt_delivery_verification(alerts)
-    return {"prompt": prompt, "response": generate_response(prompt)}
+async def explain_deliveries(
+    request: Request, ag: Agent, stream: bool = False
+):
+    async def prompt():
+        return prompt_delivery_verification(await ag.verify_deliveries())
+
+    return await respond(request, prompt(), stream)
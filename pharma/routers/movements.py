@@ -0,0 +1,70 @@
+from typing import List, Optional
+
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import TypeAdapter, ValidationError
+
+from pharma.models import StockMovement
+from pharma.schemas.movements import MovementBatchReport
+from pharma.services.movements import BatchInProgressError, ingest_movements
+
+router = APIRouter(prefix="/movements", tags=["Movements"])
+
+NDJSON = "application/x-ndjson"
+MOVEMENTS = TypeAdapter(List[StockMovement])
+
+
+def parse_movements(body: bytes, content_type: str) -> List[StockMovement]:
+    """Validate a JSON array, or one movement per line for NDJSON."""
+    try:
+        if content_type.startswith(NDJSON):
+            return [
+                StockMovement.model_validate_json(line)
+                for line in body.splitlines()
+                if line.strip()
+            ]
+        return MOVEMENTS.validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+
+
+@router.post(
+    "/bulk",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "array",
+                        "items": StockMovement.model_json_schema(),
+                    }
+                },
+                NDJSON: {"schema": StockMovement.model_json_schema()},
+            },
+        }
+    },
+)
+async def bulk_movements(
+    request: Request,
+    idempotency_key: Optional[str] = Header(None),
+) -> MovementBatchReport:
+    """Ingest a batch of stock movements and update the stocks.
+
+    Send a JSON array or NDJSON. Reusing an Idempotency-Key makes a retry
+    return the first outcome instead of applying the batch again.
+    """
+    movements = parse_movements(
+        await request.body(), request.headers.get("content-type", "")
+    )
+    try:
+        report = await ingest_movements(
+            request.app.mongodb, movements, idempotency_key
+        )
+    except BatchInProgressError as e:
+        raise HTTPException(
+            status_code=409, detail=f"Batch {e} is still being processed"
+        )
+    # This worker's cached analyses see the batch at once.
+    request.app.agent.invalidate()
+    return report
@@ -0,0 +1,23 @@
+from typing import Any, Dict, List
+
+from fastapi import APIRouter, HTTPException, Request
+
+from pharma.dependencies import ReportParams
+from pharma.monitoring import mongo_operation
+from pharma.reports import Report, report_pipeline
+
+router = APIRouter(prefix="/reports", tags=["Reports"])
+
+
+@router.get("/{report}")
+async def get_report(
+    report: Report, request: Request, params: ReportParams
+) -> List[Dict[str, Any]]:
+    """Run a report; see /exports/{report} to stream large ones."""
+    try:
+        collection, pipeline = report_pipeline(report, **params)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    with mongo_operation(f"reports.{report.value}"):
+        cursor = request.app.mongodb[collection].aggregate(pipeline)
+        return await cursor.to_list(None)
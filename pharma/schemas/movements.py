@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+
+
+import daiquiri
+from pydantic import BaseModel
+
+LOGGER = daiquiri.getLogger(__name__)
+
+
+class MovementBatchReport(BaseModel):
+    """Outcome of a /movements/bulk batch."""
+
+    received: int
+    inserted: int
+    products_updated: int
+    elapsed_ms: float
+    movements_per_second: float
+    replayed: bool = False
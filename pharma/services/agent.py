@@ -1,12 +1,38 @@
+import asyncio
+import functools
+import inspect
 from collections import defaultdict
-from datetime import datetime, timedelta
-from typing import List
+from datetime import datetime
+from typing import List, Optional, Tuple
 
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from pymongo import MongoClient
 
-from pharma.models import Alert, ForecastResult, KPIReport, PurchaseProposal
+from pharma.models import (
+    Alert,
+    ForecastResult,
+    KPIReport,
+    PurchaseProposal,
+    list_adapter,
+)
+from pharma.monitoring import instrumented
+from pharma.pagination import keyset_filter
+from pharma.pipelines import (
+    checked_deliveries_filter,
+    expiring_products_pipeline,
+    forecast_consumption_pipeline,
+    inventory_audit_pipeline,
+)
+from pharma.services.alerts import (
+    DEFAULT_THRESHOLDS,
+    alert_fields,
+    alert_level_expression,
+)
 from pharma.settings import SETTINGS
 
+# Severity of expiry alerts, by rank of their horizon.
+EXPIRY_SEVERITIES = ("CRITICAL", "WARNING")
+
 # --- AGENT IA ---
 
 
@@ -19,132 +45,296 @@ class InventoryAgent:
 # --- SMART AGENT ---
 
 
-class SmartInventoryAgent(InventoryAgent):
+class AsyncSmartInventoryAgent:
+    """Inventory analyses running on the application's Motor database."""
 
-    def forecast_consumption(self, months: int = 3) -> List[ForecastResult]:
-        cutoff_date = datetime.utcnow() - timedelta(days=30 * months)
-        movements = list(
-            self.db.movements.find(
-                {"movement_type": "SORTIE", "date": {"$gte": cutoff_date}}
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+
+    # Results are sorted by product_id (deliveries: product_id, date).
+    # after is the sort key of the last result of the previous page and
+    # limit bounds the page; both are pushed down into the queries.
+    # Each list is validated in one call (list_adapter), cheaper than one
+    # model at a time, and alerts of one call share a single timestamp.
+
+    @instrumented("agent.forecast_consumption")
+    async def forecast_consumption(
+        self,
+        months: int = 3,
+        after: Optional[tuple] = None,
+        limit: Optional[int] = None,
+    ) -> List[ForecastResult]:
+        cursor = self.db.movements.aggregate(
+            forecast_consumption_pipeline(
+                months, after[0] if after else None, limit
             )
         )
-        consumption = defaultdict(int)
+        return list_adapter(ForecastResult).validate_python(
+            await cursor.to_list(None)
+        )
 
-        for m in movements:
-            consumption[m["product_id"]] += m["quantity"]
+    @instrumented("agent.detect_critical_stocks")
+    async def detect_critical_stocks(
+        self,
+        severity: Optional[str] = None,
+        after: Optional[tuple] = None,
+        limit: Optional[int] = None,
+    ) -> List[Alert]:
+        """Stocks at or below their product's minimum or critical stock.
 
-        forecasts = []
-        for product_id, total in consumption.items():
-            average = total / months
-            stock = self.db.stocks.find_one({"product_id": product_id}) or {
-                "quantity": 0
-            }
-            suggested = max(0, int(average * 2 - stock["quantity"]))
-            forecasts.append(
-                ForecastResult(
-                    product_id=product_id,
-                    average_consumption=average,
-                    suggested_quantity=suggested,
-                )
+        The level is computed by the query from the quantity and the
+        thresholds copied onto the stock documents (see
+        pharma.services.alerts), not read from the stored alert_level,
+        which a write outside clamped_increment can leave stale. Stocks
+        are scanned in product_id order and the scan stops at the limit.
+        """
+        now = datetime.utcnow()
+        level = alert_level_expression(None)
+        cursor = (
+            self.db.stocks.find(
+                {
+                    "$expr": (
+                        {"$eq": [level, severity]}
+                        if severity
+                        else {"$ne": [level, None]}
+                    ),
+                    **keyset_filter(["product_id"], after),
+                },
+                {
+                    "_id": 0,
+                    "product_id": 1,
+                    "quantity": 1,
+                    "minimum_stock": 1,
+                    "critical_stock": 1,
+                },
             )
-        return forecasts
-
-    def detect_critical_stocks(self, critical_level: int = 10) -> List[Alert]:
+            .sort("product_id")
+            .limit(limit or 0)
+        )
+        minimum, critical = DEFAULT_THRESHOLDS
         alerts = []
-        for s in self.db.stocks.find():
-            if s["quantity"] <= critical_level:
+        async for s in cursor:
+            fields = alert_fields(
+                s["product_id"],
+                s["quantity"],
+                s.get("minimum_stock", minimum),
+                s.get("critical_stock", critical),
+            )
+            if fields is not None:
                 alerts.append(
-                    Alert(
-                        product_id=s["product_id"],
-                        alert_type="SEUIL_CRITIQUE",
-                        message=f"Stock critique pour {s['product_id']} ({s['quantity']} unités)",
-                        date=datetime.utcnow(),
-                    )
+                    {"product_id": s["product_id"], "date": now, **fields}
                 )
-        return alerts
+        return list_adapter(Alert).validate_python(alerts)
 
-    def detect_expiring_products(self, days_limit: int = 30) -> List[Alert]:
-        alerts = []
-        for p in self.db.products.find():
-            if (
-                p["expiration_date"].date() - datetime.utcnow().date()
-            ).days <= days_limit:
-                alerts.append(
-                    Alert(
-                        product_id=p["id"],
-                        alert_type="PEREMPTION",
-                        message=f"Produit {p['id']} proche de péremption ({p['expiration_date']})",
-                        date=datetime.utcnow(),
-                    )
-                )
-        return alerts
+    @instrumented("agent.detect_expiring_products")
+    async def detect_expiring_products(
+        self,
+        horizons: Optional[Tuple[int, ...]] = None,
+        after: Optional[tuple] = None,
+        limit: Optional[int] = None,
+    ) -> List[Alert]:
+        """Products expiring within the horizons, soonest first.
 
-    def simulate_inventory_audit(self) -> List[Alert]:
-        alerts = []
-        for product in self.db.products.find():
-            stock = self.db.stocks.find_one({"product_id": product["id"]}) or {
-                "quantity": 0
-            }
-            theoretical_qty = sum(
-                (
-                    m["quantity"]
-                    if m["movement_type"] in ["ENTREE", "RETOUR"]
-                    else -m["quantity"]
-                )
-                for m in self.db.movements.find({"product_id": product["id"]})
+        Each alert's date is the expiration date and its horizon_days the
+        smallest horizon it falls in (default SETTINGS.expiry_horizons);
+        the first two horizons are CRITICAL and WARNING, the others INFO.
+        Pages are sorted by (date, product_id).
+        """
+        horizons = tuple(sorted(set(horizons or SETTINGS.expiry_horizons)))
+        severities = dict(zip(horizons, EXPIRY_SEVERITIES))
+        cursor = self.db.products.aggregate(
+            expiring_products_pipeline(
+                horizons, datetime.utcnow().date(), after, limit
             )
-            if abs(stock["quantity"] - theoretical_qty) > 5:
-                alerts.append(
-                    Alert(
-                        product_id=product["id"],
-                        alert_type="INVENTAIRE_ECART",
-                        message=f"Écart détecté : stock={stock['quantity']}, attendu={theoretical_qty}",
-                        date=datetime.utcnow(),
-                    )
-                )
+        )
+        return list_adapter(Alert).validate_python(
+            [
+                {
+                    "product_id": p["id"],
+                    "alert_type": "PEREMPTION",
+                    "message": f"Produit {p['id']} proche de péremption ({p['expiration_date']})",
+                    "date": p["expiration_date"],
+                    "severity": severities.get(p["horizon_days"], "INFO"),
+                    "horizon_days": p["horizon_days"],
+                }
+                async for p in cursor
+            ]
+        )
+
+    @instrumented("agent.last_audit_checkpoint")
+    async def last_audit_checkpoint(self) -> Optional[datetime]:
+        """Date of the last audit checkpoint, usable as an audit `since`."""
+        checkpoint = await self.db.audit_checkpoints.find_one({}, {"date": 1})
+        return checkpoint["date"] if checkpoint else None
+
+    @instrumented("agent.simulate_inventory_audit")
+    async def simulate_inventory_audit(
+        self,
+        since: Optional[datetime] = None,
+        tolerance: int = 5,
+        after: Optional[tuple] = None,
+        limit: Optional[int] = None,
+    ) -> List[Alert]:
+        """Compare stocks with the balance replayed from movements.
+
+        With since, only movements ingested after that audit checkpoint
+        are replayed; checkpoints are saved by checkpoint_inventory_audit
+        (pharma.services.movements). The audit only reads.
+        """
+        seq, pending = None, []
+        if since is not None:
+            checkpoint = await self.db.audit_checkpoints.find_one(
+                {}, {"date": 1, "seq": 1, "pending": 1}
+            )
+            if checkpoint is None or checkpoint["date"] != since:
+                raise ValueError(f"No clean audit checkpoint at {since}")
+            seq, pending = checkpoint["seq"], checkpoint.get("pending", [])
+
+        now = datetime.utcnow()
+        cursor = self.db.movements.aggregate(
+            inventory_audit_pipeline(
+                tolerance,
+                seq,
+                after[0] if after else None,
+                limit,
+                pending=pending,
+            )
+        )
+        alerts = list_adapter(Alert).validate_python(
+            [
+                {
+                    "product_id": row["product_id"],
+                    "alert_type": "INVENTAIRE_ECART",
+                    "message": f"Écart détecté : stock={row['stock']}, attendu={row['expected']}",
+                    "date": now,
+                }
+                async for row in cursor
+            ]
+        )
         return alerts
 
-    def generate_kpi_report(self) -> KPIReport:
-        ruptures = list(self.db.movements.find({"movement_type": "RUPTURE"}))
-        sorties = list(self.db.movements.find({"movement_type": "SORTIE"}))
+    @instrumented("agent.generate_kpi_report")
+    async def generate_kpi_report(self) -> KPIReport:
+        total_ruptures = await self.db.movements.count_documents(
+            {"movement_type": "RUPTURE"}
+        )
         counter = defaultdict(int)
-        for s in sorties:
+        async for s in self.db.movements.find({"movement_type": "SORTIE"}):
             counter[s["product_id"]] += s["quantity"]
         top_products = sorted(counter, key=counter.get, reverse=True)[:5]
         return KPIReport(
-            total_ruptures=len(ruptures),
+            total_ruptures=total_ruptures,
             total_exits=sum(counter.values()),
             top_products=top_products,
         )
 
-    def suggest_purchase_orders(self) -> List[PurchaseProposal]:
-        suggestions = []
-        forecasts = self.forecast_consumption()
-        for forecast in forecasts:
-            if forecast.suggested_quantity > 0:
-                suggestions.append(
-                    PurchaseProposal(
-                        product_id=forecast.product_id,
-                        suggested_quantity=forecast.suggested_quantity,
-                        based_on="Prévision",
-                        justification="Basé sur la prévision de consommation moyenne",
-                        proposal_date=datetime.utcnow(),
-                    )
-                )
-        return suggestions
+    @instrumented("agent.suggest_purchase_orders")
+    async def suggest_purchase_orders(
+        self, after: Optional[tuple] = None, limit: Optional[int] = None
+    ) -> List[PurchaseProposal]:
+        pipeline = forecast_consumption_pipeline(
+            after=after[0] if after else None
+        )
+        pipeline.append({"$match": {"suggested_quantity": {"$gt": 0}}})
+        if limit is not None:
+            pipeline.append({"$limit": limit})
+        now = datetime.utcnow()
+        return list_adapter(PurchaseProposal).validate_python(
+            [
+                {
+                    "product_id": forecast["product_id"],
+                    "suggested_quantity": forecast["suggested_quantity"],
+                    "based_on": "Prévision",
+                    "justification": "Basé sur la prévision de consommation moyenne",
+                    "proposal_date": now,
+                }
+                async for forecast in self.db.movements.aggregate(pipeline)
+            ]
+        )
 
-    def verify_deliveries(self, tolerance: float = 0.05) -> List[Alert]:
-        alerts = []
-        for m in self.db.movements.find({"movement_type": "ENTREE"}):
-            expected = m["quantity"]
-            received = m["quantity"]
-            if abs(received - expected) > tolerance * expected:
-                alerts.append(
-                    Alert(
-                        product_id=m["product_id"],
-                        alert_type="NON_CONFORMITE_LIVRAISON",
-                        message=f"Produit {m['product_id']} livraison non conforme : attendu={expected}, reçu={received}",
-                        date=datetime.utcnow(),
-                    )
-                )
-        return alerts
+    @instrumented("agent.verify_deliveries")
+    async def verify_deliveries(
+        self,
+        tolerance: float = 0.05,
+        after: Optional[tuple] = None,
+        limit: Optional[int] = None,
+    ) -> List[Alert]:
+        """Deliveries whose received quantity is off the ordered one.
+
+        Only ENTREE movements carrying an expected_quantity are checked,
+        through a partial index, and the comparison runs in the query.
+        """
+        cursor = (
+            self.db.movements.find(
+                {
+                    **checked_deliveries_filter(),
+                    "$expr": {
+                        "$gt": [
+                            {
+                                "$abs": {
+                                    "$subtract": [
+                                        "$quantity",
+                                        "$expected_quantity",
+                                    ]
+                                }
+                            },
+                            {"$multiply": ["$expected_quantity", tolerance]},
+                        ]
+                    },
+                    **keyset_filter(["product_id", "date"], after),
+                },
+                {
+                    "_id": 0,
+                    "product_id": 1,
+                    "date": 1,
+                    "quantity": 1,
+                    "expected_quantity": 1,
+                },
+            )
+            .sort([("product_id", 1), ("date", 1)])
+            .limit(limit or 0)
+        )
+        alerts = [
+            {
+                "product_id": m["product_id"],
+                "alert_type": "NON_CONFORMITE_LIVRAISON",
+                "message": f"Produit {m['product_id']} livraison non conforme : attendu={m['expected_quantity']}, reçu={m['quantity']}",
+                "date": m["date"],
+            }
+            async for m in cursor
+        ]
+        return list_adapter(Alert).validate_python(alerts)
+
+
+class SmartInventoryAgent:
+    """Blocking facade over AsyncSmartInventoryAgent for scripts.
+
+    Owns a private event loop and Motor client, and runs every agent
+    coroutine to completion on it. Not meant for use inside a running
+    event loop: the API uses AsyncSmartInventoryAgent directly.
+    """
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self.client = AsyncIOMotorClient(
+            SETTINGS.mongodb_url, io_loop=self._loop
+        )
+        self.db = self.client[SETTINGS.mongodb_name]
+        self.agent = AsyncSmartInventoryAgent(self.db)
+
+    def __getattr__(self, name: str):
+        if "agent" not in self.__dict__:
+            raise AttributeError(name)
+        attr = getattr(self.agent, name)
+        if not inspect.iscoroutinefunction(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def run(*args, **kwargs):
+            return self._loop.run_until_complete(attr(*args, **kwargs))
+
+        return run
+
+    def close(self):
+        self.client.close()
+        self._loop.close()
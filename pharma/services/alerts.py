@@ -0,0 +1,371 @@
+import asyncio
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import daiquiri
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import OperationFailure, PyMongoError
+
+from pharma.models import StockAlert
+
+LOGGER = daiquiri.getLogger(__name__)
+
+WATCHED = ["stocks", "stock_thresholds", "movements"]
+
+# Minimum and critical stock of products without a stock_thresholds
+# document.
+DEFAULT_THRESHOLDS = (10, 10)
+
+
+class _Reload(Exception):
+    """The change cannot be applied incrementally."""
+
+
+def stock_level(
+    quantity: int, minimum_stock: int, critical_stock: int
+) -> Optional[str]:
+    """Severity of the alert stock_alert() raises, if any."""
+    if quantity <= max(0, critical_stock):
+        return "CRITICAL"
+    if quantity <= minimum_stock:
+        return "WARNING"
+    return None
+
+
+def alert_fields(
+    product_id: str, quantity: int, minimum_stock: int, critical_stock: int
+) -> Optional[Dict[str, str]]:
+    """alert_type, severity and message of the alert a stock raises."""
+    if quantity <= 0:
+        alert_type, severity = "RUPTURE", "CRITICAL"
+        message = f"Rupture de stock pour {product_id}"
+    elif quantity <= critical_stock:
+        alert_type, severity = "SEUIL_CRITIQUE", "CRITICAL"
+        message = f"Stock critique pour {product_id} ({quantity} unités, seuil {critical_stock})"
+    elif quantity <= minimum_stock:
+        alert_type, severity = "SEUIL_CRITIQUE", "WARNING"
+        message = f"Stock bas pour {product_id} ({quantity} unités, minimum {minimum_stock})"
+    else:
+        return None
+    return {"alert_type": alert_type, "severity": severity, "message": message}
+
+
+def stock_alert(
+    product_id: str,
+    quantity: int,
+    minimum_stock: int,
+    critical_stock: int,
+    now: datetime,
+) -> Optional[StockAlert]:
+    """The alert a stock level raises against its thresholds, if any."""
+    fields = alert_fields(product_id, quantity, minimum_stock, critical_stock)
+    if fields is None:
+        return None
+    return StockAlert(product_id=product_id, date_triggered=now, **fields)
+
+
+# --- Denormalized stock levels ---
+#
+# Each stock document carries its product's minimum_stock and
+# critical_stock, and the level stock_level() gives them as alert_level,
+# absent while the stock is fine. The level is recomputed by the same
+# update that changes the quantity (see clamped_increment). Queries
+# compute it again with alert_level_expression rather than trust the
+# stored one, which writes made elsewhere do not update; the copied
+# thresholds still spare them a join with stock_thresholds.
+
+
+def alert_level_expression(default: Any = "$$REMOVE") -> Dict[str, Any]:
+    """alert_level as stock_level() computes it, default when fine."""
+    minimum, critical = DEFAULT_THRESHOLDS
+    return {
+        "$switch": {
+            "branches": [
+                {
+                    "case": {
+                        "$lte": [
+                            "$quantity",
+                            {
+                                "$max": [
+                                    0,
+                                    {
+                                        "$ifNull": [
+                                            "$critical_stock",
+                                            critical,
+                                        ]
+                                    },
+                                ]
+                            },
+                        ]
+                    },
+                    "then": "CRITICAL",
+                },
+                {
+                    "case": {
+                        "$lte": [
+                            "$quantity",
+                            {"$ifNull": ["$minimum_stock", minimum]},
+                        ]
+                    },
+                    "then": "WARNING",
+                },
+            ],
+            "default": default,
+        }
+    }
+
+
+def alert_level_stage() -> Dict[str, Any]:
+    """Update stage setting alert_level from the quantity and thresholds."""
+    return {"$set": {"alert_level": alert_level_expression()}}
+
+
+def threshold_sync_pipeline(
+    product_ids: Optional[List[str]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Copy thresholds onto the stock documents and update their level.
+
+    Runs on stock_thresholds. Stocks without thresholds are left as is.
+
+    Args:
+        product_ids (Optional[List[str]]): Only sync these products.
+
+    Returns:
+        List[Dict[str, Any]]: The aggregation pipeline.
+    """
+    pipeline: List[Dict[str, Any]] = []
+    if product_ids is not None:
+        pipeline.append({"$match": {"product_id": {"$in": product_ids}}})
+    return pipeline + [
+        {
+            "$project": {
+                "_id": 0,
+                "product_id": 1,
+                "minimum_stock": 1,
+                "critical_stock": 1,
+            }
+        },
+        {
+            "$merge": {
+                "into": "stocks",
+                "on": "product_id",
+                "whenMatched": [
+                    {
+                        "$set": {
+                            "minimum_stock": "$$new.minimum_stock",
+                            "critical_stock": "$$new.critical_stock",
+                        }
+                    },
+                    alert_level_stage(),
+                ],
+                "whenNotMatched": "discard",
+            }
+        },
+    ]
+
+
+async def sync_stock_levels(
+    db: AsyncIOMotorDatabase, product_ids: Optional[List[str]] = None
+):
+    """
+    Bring the denormalized thresholds and levels of stocks up to date.
+
+    Needed after writing stock_thresholds, or stocks other than through
+    clamped_increment. Without product_ids, stocks that have no
+    thresholds get their level from DEFAULT_THRESHOLDS.
+    """
+    await db.stock_thresholds.aggregate(
+        threshold_sync_pipeline(product_ids)
+    ).to_list(None)
+    if product_ids is None:
+        await db.stocks.update_many(
+            {"critical_stock": {"$exists": False}}, [alert_level_stage()]
+        )
+
+
+class AlertEngine:
+    """Active stock alerts kept up to date from MongoDB change streams.
+
+    The stocks and thresholds are loaded once, then every change on
+    stocks, stock_thresholds and movements updates the affected product
+    only. Each alert that appears, changes or clears is pushed to the
+    subscribers' queues. A RUPTURE movement raises a stockout alert that
+    holds, whatever the thresholds say, until the product's quantity goes
+    up again. Change streams need a replica set.
+    """
+
+    def __init__(
+        self,
+        db: AsyncIOMotorDatabase,
+        default_thresholds: Tuple[int, int] = DEFAULT_THRESHOLDS,
+        queue_size: int = 1000,
+    ):
+        self.db = db
+        self.default_thresholds = default_thresholds
+        self.queue_size = queue_size
+        self.quantities: Dict[str, int] = {}
+        self.thresholds: Dict[str, Tuple[int, int]] = {}
+        self.alerts: Dict[str, StockAlert] = {}
+        # Products with a reported stockout, and their lowest quantity
+        # since the report.
+        self.stockouts: Dict[str, int] = {}
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.ready = asyncio.Event()
+        self._resume_token = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def load(self):
+        """Rebuild the whole state; used at startup and on history loss."""
+        self.thresholds = {
+            t["product_id"]: (t["minimum_stock"], t["critical_stock"])
+            async for t in self.db.stock_thresholds.find(
+                {}, {"product_id": 1, "minimum_stock": 1, "critical_stock": 1}
+            )
+        }
+        self.quantities = {
+            s["product_id"]: s["quantity"]
+            async for s in self.db.stocks.find(
+                {}, {"product_id": 1, "quantity": 1}
+            )
+        }
+        for product_id in set(self.alerts) | set(self.quantities):
+            self.refresh(product_id)
+
+    def snapshot(self) -> list:
+        return sorted(self.alerts.values(), key=lambda a: a.product_id)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, event: dict):
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Drop a consumer this far behind; the None tells it to
+                # reconnect and start again from a snapshot.
+                self.unsubscribe(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    def refresh(self, product_id: str, alert: Optional[StockAlert] = None):
+        """Recompute one product's alert and publish it if it changed."""
+        if alert is None and product_id in self.stockouts:
+            return
+        if alert is None and product_id in self.quantities:
+            minimum, critical = self.thresholds.get(
+                product_id, self.default_thresholds
+            )
+            alert = stock_alert(
+                product_id,
+                self.quantities[product_id],
+                minimum,
+                critical,
+                datetime.utcnow(),
+            )
+        previous = self.alerts.get(product_id)
+        if alert is None:
+            if previous is not None:
+                del self.alerts[product_id]
+                self.publish({"op": "clear", "product_id": product_id})
+        elif previous is None or (
+            (previous.alert_type, previous.severity, previous.message)
+            != (alert.alert_type, alert.severity, alert.message)
+        ):
+            self.alerts[product_id] = alert
+            self.publish(
+                {"op": "set", "alert": json.loads(alert.model_dump_json())}
+            )
+
+    def apply(self, change: dict):
+        collection = change["ns"]["coll"]
+        operation = change["operationType"]
+        document = change.get("fullDocument") or {}
+        if collection == "stocks":
+            product_id = document.get("product_id")
+            if operation == "delete" or product_id is None:
+                # Deletes only carry the _id: rebuild from the survivors.
+                raise _Reload()
+            quantity = document["quantity"]
+            self.quantities[product_id] = quantity
+            lowest = self.stockouts.get(product_id)
+            if lowest is not None:
+                if quantity > lowest:
+                    del self.stockouts[product_id]
+                else:
+                    self.stockouts[product_id] = quantity
+            self.refresh(product_id)
+        elif collection == "stock_thresholds":
+            product_id = document.get("product_id")
+            if operation == "delete" or product_id is None:
+                raise _Reload()
+            self.thresholds[product_id] = (
+                document["minimum_stock"],
+                document["critical_stock"],
+            )
+            self.refresh(product_id)
+        elif (
+            collection == "movements"
+            and operation == "insert"
+            and document.get("movement_type") == "RUPTURE"
+        ):
+            product_id = document["product_id"]
+            self.stockouts[product_id] = self.quantities.get(product_id, 0)
+            self.refresh(
+                product_id,
+                StockAlert(
+                    product_id=product_id,
+                    alert_type="RUPTURE",
+                    message=f"Rupture signalée pour {product_id}",
+                    date_triggered=document.get("date", datetime.utcnow()),
+                    severity="CRITICAL",
+                ),
+            )
+
+    async def _watch(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": WATCHED}}}]
+        while True:
+            try:
+                async with self.db.watch(
+                    pipeline,
+                    full_document="updateLookup",
+                    resume_after=self._resume_token,
+                ) as stream:
+                    # Changes made while loading are buffered by the
+                    # stream and replayed on top of the loaded state.
+                    if self._resume_token is None:
+                        await self.load()
+                    self.ready.set()
+                    async for change in stream:
+                        try:
+                            self.apply(change)
+                        except _Reload:
+                            await self.load()
+                        self._resume_token = stream.resume_token
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as e:
+                LOGGER.error("Alert change stream interrupted: %s", e)
+                if isinstance(e, OperationFailure):
+                    # Typically the resume token fell off the oplog.
+                    self._resume_token = None
+                await asyncio.sleep(1)
@@ -0,0 +1,159 @@
+import asyncio
+import functools
+import inspect
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from async_lru import alru_cache
+from motor.motor_asyncio import (
+    AsyncIOMotorClientSession,
+    AsyncIOMotorDatabase,
+)
+from pymongo import ReturnDocument, UpdateOne
+
+from pharma.metrics import AGENT_CACHE_LOOKUPS, AGENT_CACHE_MISSES
+from pharma.services.agent import AsyncSmartInventoryAgent
+from pharma.settings import SETTINGS
+
+VERSIONS = "collection_versions"
+
+# Collections each cached analysis reads. Methods missing from this map
+# (the audit) are never cached.
+DEPENDENCIES: Dict[str, Tuple[str, ...]] = {
+    "forecast_consumption": ("movements", "stocks"),
+    "detect_critical_stocks": ("stocks",),
+    "detect_expiring_products": ("products",),
+    "generate_kpi_report": ("movements",),
+    "suggest_purchase_orders": ("movements", "stocks"),
+    "verify_deliveries": ("movements",),
+}
+
+# Analyses whose result also depends on the current date; their cache key
+# carries the day.
+DATED = {
+    "forecast_consumption",
+    "detect_expiring_products",
+    "suggest_purchase_orders",
+}
+
+# Every write to a collection above must bump its counter, or cached
+# results stay stale until AGENT_CACHE_TTL:
+#
+# - ingest_movements bumps movements and stocks once its transaction
+#   has committed;
+# - the API bumps stocks at startup, after sync_stock_levels;
+# - the data generators call InventorySimulator.invalidate_cache.
+#
+# Other writers (imports, manual fixes) must call bump_versions.
+
+
+def version_updates(*collections: str) -> List[UpdateOne]:
+    """Bulk operations bumping the version counter of each collection."""
+    return [
+        UpdateOne({"_id": name}, {"$inc": {"version": 1}}, upsert=True)
+        for name in collections
+    ]
+
+
+async def bump_versions(db: AsyncIOMotorDatabase, *collections: str):
+    """Invalidate the cached results that read any of the collections."""
+    await db[VERSIONS].bulk_write(version_updates(*collections), ordered=False)
+
+
+async def next_version(
+    db: AsyncIOMotorDatabase,
+    collection: str,
+    session: Optional[AsyncIOMotorClientSession] = None,
+) -> int:
+    """Bump the version counter of collection and return its new value."""
+    counter = await db[VERSIONS].find_one_and_update(
+        {"_id": collection},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+        session=session,
+    )
+    return counter["version"]
+
+
+class CachedInventoryAgent:
+    """AsyncSmartInventoryAgent with an LRU/TTL cache on its analyses.
+
+    Results are keyed by method, arguments and the version counters of
+    the collections the method reads. The counters live in MongoDB so a
+    write through any worker invalidates every worker's cache; they are
+    read at most once every versions_ttl seconds, so such a write shows
+    up after that long. Writes made in this process call invalidate()
+    to be seen at once. Cached results are shared between callers and
+    must not be mutated.
+    """
+
+    def __init__(
+        self,
+        agent: AsyncSmartInventoryAgent,
+        maxsize: int,
+        ttl: float,
+        versions_ttl: float = SETTINGS.agent_cache_versions_ttl,
+    ):
+        self.agent = agent
+        self.db = agent.db
+        self.versions_ttl = versions_ttl
+        self._cached = alru_cache(maxsize=maxsize, ttl=ttl)(self._compute)
+        self._versions: Dict[str, int] = {}
+        self._versions_read = float("-inf")
+        self._versions_lock = asyncio.Lock()
+
+    async def versions(self, collections: Tuple[str, ...]) -> Tuple[int, ...]:
+        if time.monotonic() - self._versions_read >= self.versions_ttl:
+            async with self._versions_lock:
+                # Another caller may have read them while we waited.
+                if time.monotonic() - self._versions_read >= self.versions_ttl:
+                    read = time.monotonic()
+                    watched = sorted(
+                        {c for names in DEPENDENCIES.values() for c in names}
+                    )
+                    self._versions = {
+                        doc["_id"]: doc["version"]
+                        async for doc in self.db[VERSIONS].find(
+                            {"_id": {"$in": watched}}
+                        )
+                    }
+                    self._versions_read = read
+        return tuple(self._versions.get(name, 0) for name in collections)
+
+    def invalidate(self):
+        """Read the version counters again on the next call."""
+        self._versions_read = float("-inf")
+
+    async def _compute(
+        self,
+        name: str,
+        versions: Tuple[int, ...],
+        day: Any,
+        args: tuple,
+        kwargs: tuple,
+    ) -> Any:
+        AGENT_CACHE_MISSES.labels(name).inc()
+        return await getattr(self.agent, name)(*args, **dict(kwargs))
+
+    def __getattr__(self, name: str):
+        if "agent" not in self.__dict__:
+            raise AttributeError(name)
+        attr = getattr(self.agent, name)
+        if name not in DEPENDENCIES or not inspect.iscoroutinefunction(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def cached(*args, **kwargs):
+            AGENT_CACHE_LOOKUPS.labels(name).inc()
+            versions = await self.versions(DEPENDENCIES[name])
+            day = datetime.utcnow().date() if name in DATED else None
+            return await self._cached(
+                name, versions, day, args, tuple(sorted(kwargs.items()))
+            )
+
+        return cached
+
+    def cache_clear(self):
+        self._cached.cache_clear()
@@ -0,0 +1,291 @@
+"""Vectorized consumption forecasting.
+
+Daily SORTIE quantities are loaded into a product x day demand matrix and
+every model runs on all products at once, looping over days only. Each
+product gets the model with the smallest error on the last horizon days
+of its history (the backtest), refitted on the whole history.
+
+Models:
+
+- SMA: mean of the last SMA_WINDOW days.
+- EMA: exponentially smoothed daily demand.
+- HOLT_WINTERS: additive level, trend and weekly seasonality.
+- CROSTON: smoothed demand size over smoothed interval between demands,
+  for the intermittent demand of slow-moving items.
+"""
+
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+import daiquiri
+import numpy as np
+import typer
+from bson import ObjectId
+from pymongo import MongoClient, ReplaceOne
+from pymongo.database import Database
+
+from pharma.models import ConsumptionForecast
+from pharma.settings import SETTINGS
+from pharma.utils import to_bson_safe_dict
+
+LOGGER = daiquiri.getLogger(__name__)
+
+DAY_MS = 24 * 60 * 60 * 1000
+SMA_WINDOW = 28
+EMA_ALPHA = 0.1
+HW_ALPHA, HW_BETA, HW_GAMMA, HW_PERIOD = 0.2, 0.05, 0.1, 7
+CROSTON_ALPHA = 0.1
+
+# Each model maps a (products, days) demand matrix and a horizon in days
+# to the total demand forecast over the horizon, per product.
+Model = Callable[[np.ndarray, int], np.ndarray]
+
+
+def sma(demand: np.ndarray, horizon: int) -> np.ndarray:
+    return demand[:, -SMA_WINDOW:].mean(axis=1) * horizon
+
+
+def ema(demand: np.ndarray, horizon: int) -> np.ndarray:
+    level = demand[:, 0].copy()
+    for t in range(1, demand.shape[1]):
+        level += EMA_ALPHA * (demand[:, t] - level)
+    return level * horizon
+
+
+def holt_winters(demand: np.ndarray, horizon: int) -> np.ndarray:
+    days = demand.shape[1]
+    if days < 2 * HW_PERIOD:
+        return ema(demand, horizon)
+    level = demand[:, :HW_PERIOD].mean(axis=1)
+    trend = (demand[:, HW_PERIOD : 2 * HW_PERIOD].mean(axis=1) - level) / (
+        HW_PERIOD
+    )
+    season = demand[:, :HW_PERIOD] - level[:, None]
+    for t in range(HW_PERIOD, days):
+        s = season[:, t % HW_PERIOD]
+        previous = level
+        level = HW_ALPHA * (demand[:, t] - s) + (1 - HW_ALPHA) * (
+            level + trend
+        )
+        trend = HW_BETA * (level - previous) + (1 - HW_BETA) * trend
+        season[:, t % HW_PERIOD] = (
+            HW_GAMMA * (demand[:, t] - level) + (1 - HW_GAMMA) * s
+        )
+    steps = np.arange(1, horizon + 1)
+    forecast = (
+        level[:, None]
+        + trend[:, None] * steps
+        + season[:, (days - 1 + steps) % HW_PERIOD]
+    )
+    return np.clip(forecast, 0, None).sum(axis=1)
+
+
+def croston(demand: np.ndarray, horizon: int) -> np.ndarray:
+    days = demand.shape[1]
+    size = np.zeros(demand.shape[0])
+    interval = np.zeros(demand.shape[0])
+    since = np.zeros(demand.shape[0])
+    hits = np.zeros(demand.shape[0], dtype=int)
+    for t in range(days):
+        d = demand[:, t]
+        hit = d > 0
+        size = np.where(
+            hits == 0,
+            d,
+            np.where(hit, size + CROSTON_ALPHA * (d - size), size),
+        )
+        # The interval starts from the first gap between two demands.
+        interval = np.where(
+            hit & (hits == 1),
+            since,
+            np.where(
+                hit & (hits > 1),
+                interval + CROSTON_ALPHA * (since - interval),
+                interval,
+            ),
+        )
+        hits += hit
+        since = np.where(hit, 1, since + 1)
+    # A single demand gives no gap: spread it over the history.
+    interval = np.where(hits == 1, days, interval)
+    return np.where(hits > 0, size / np.maximum(interval, 1), 0.0) * horizon
+
+
+MODELS: Dict[str, Model] = {
+    "SMA": sma,
+    "EMA": ema,
+    "HOLT_WINTERS": holt_winters,
+    "CROSTON": croston,
+}
+
+
+def select_models(
+    demand: np.ndarray, horizon: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pick a model per product by backtest and forecast with it.
+
+    Args:
+        demand (np.ndarray): Daily demand, one row per product.
+        horizon (int): Forecast horizon, in days.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Index in MODELS of the model kept
+            for each product, and its forecast over the horizon.
+    """
+    products, days = demand.shape
+    names = list(MODELS)
+    if days > horizon:
+        train = demand[:, :-horizon]
+        actual = demand[:, -horizon:].sum(axis=1)
+        errors = np.stack(
+            [np.abs(MODELS[name](train, horizon) - actual) for name in names]
+        )
+        # Ties go to the first, simplest, model.
+        best = errors.argmin(axis=0)
+    else:
+        best = np.zeros(products, dtype=int)
+    forecasts = np.stack([MODELS[name](demand, horizon) for name in names])
+    return best, forecasts[best, np.arange(products)]
+
+
+def load_demand(
+    db: Database, start: datetime, days: int
+) -> Tuple[List[str], np.ndarray]:
+    """Daily SORTIE quantities per product, from start, as a matrix."""
+    cursor = db.movements.aggregate(
+        [
+            {
+                "$match": {
+                    "movement_type": "SORTIE",
+                    "date": {
+                        "$gte": start,
+                        "$lt": start + timedelta(days=days),
+                    },
+                }
+            },
+            {
+                "$group": {
+                    "_id": {
+                        "product_id": "$product_id",
+                        "day": {
+                            "$floor": {
+                                "$divide": [
+                                    {"$subtract": ["$date", start]},
+                                    DAY_MS,
+                                ]
+                            }
+                        },
+                    },
+                    "quantity": {"$sum": "$quantity"},
+                }
+            },
+        ]
+    )
+    product_ids, day, quantity = [], [], []
+    for row in cursor:
+        product_ids.append(row["_id"]["product_id"])
+        day.append(row["_id"]["day"])
+        quantity.append(row["quantity"])
+    ids, rows = np.unique(
+        np.array(product_ids, dtype=object), return_inverse=True
+    )
+    demand = np.zeros((len(ids), days))
+    np.add.at(demand, (rows, np.array(day, dtype=int)), quantity)
+    return list(ids), demand
+
+
+def forecast_products(
+    db: Database, history_days: int, horizon: int, today: date
+) -> List[ConsumptionForecast]:
+    """Forecast the next horizon days for every product with exits."""
+    start = datetime.combine(
+        today - timedelta(days=history_days), datetime.min.time()
+    )
+    product_ids, demand = load_demand(db, start, history_days)
+    if not product_ids:
+        return []
+    best, totals = select_models(demand, horizon)
+    names = list(MODELS)
+    forecast_end = today + timedelta(days=horizon - 1)
+    return [
+        ConsumptionForecast(
+            product_id=product_id,
+            predicted_quantity=int(round(total)),
+            forecast_start=today,
+            forecast_end=forecast_end,
+            model_used=names[model],
+        )
+        for product_id, model, total in zip(
+            product_ids, best.tolist(), totals.tolist()
+        )
+    ]
+
+
+def save_forecasts(
+    db: Database,
+    forecasts: List[ConsumptionForecast],
+    batch_size: int = 10_000,
+):
+    """Replace the stored forecasts with these ones.
+
+    Each document is stamped with the run that wrote it; once every
+    forecast is written, those of earlier runs, i.e. of products no longer
+    forecast, are deleted.
+    """
+    run = ObjectId()
+    for i in range(0, len(forecasts), batch_size):
+        db.consumption_forecasts.bulk_write(
+            [
+                ReplaceOne(
+                    {"product_id": forecast.product_id},
+                    {**to_bson_safe_dict(forecast), "run": run},
+                    upsert=True,
+                )
+                for forecast in forecasts[i : i + batch_size]
+            ],
+            ordered=False,
+        )
+    stale = db.consumption_forecasts.delete_many({"run": {"$ne": run}})
+    if stale.deleted_count:
+        LOGGER.info("%d stale forecasts deleted", stale.deleted_count)
+
+
+def run_forecasts(
+    db: Database, history_days: int, horizon: int
+) -> List[ConsumptionForecast]:
+    """Forecast every product and store the results."""
+    start = time.perf_counter()
+    forecasts = forecast_products(
+        db, history_days, horizon, datetime.utcnow().date()
+    )
+    save_forecasts(db, forecasts)
+    counts: Dict[str, int] = {}
+    for forecast in forecasts:
+        counts[forecast.model_used] = counts.get(forecast.model_used, 0) + 1
+    LOGGER.info(
+        "%d products forecast in %.2fs: %s",
+        len(forecasts),
+        time.perf_counter() - start,
+        counts,
+    )
+    return forecasts
+
+
+def forecast(
+    history_days: int = SETTINGS.forecast_history_days,
+    horizon: int = SETTINGS.forecast_horizon_days,
+):
+    """Forecast the consumption of every product."""
+    daiquiri.setup(level=SETTINGS.log_level)  # type: ignore
+    db = MongoClient(SETTINGS.mongodb_url)[SETTINGS.mongodb_name]
+    run_forecasts(db, history_days, horizon)
+
+
+def main():
+    typer.run(forecast)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,56 +1,119 @@
+import multiprocessing
+import os
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date, datetime, timedelta
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+
+import daiquiri
+import typer
+from pymongo import MongoClient
 from pymongo.collection import Collection
 
+from pharma.indexes import INDEXES
 from pharma.services.agent import InventoryAgent
+from pharma.services.alerts import (
+    alert_level_stage,
+    stock_level,
+    threshold_sync_pipeline,
+)
+from pharma.services.cache import VERSIONS, version_updates
+from pharma.services.movements import (
+    INCOMING,
+    OUTGOING,
+    clamped_increment,
+    stock_deltas,
+)
+from pharma.services.snapshots import is_snapshot_collection
 from pharma.models import Product, StockItem, StockMovement, StockThreshold
+from pharma.settings import SETTINGS
 from pharma.utils import to_bson_safe_dict
 
+LOGGER = daiquiri.getLogger(__name__)
+
+# Computed from the generated data, dropped with it; the versioned snapshot
+# collections are too.
+DERIVED_COLLECTIONS = {
+    "audit_checkpoints",
+    "consumption_forecasts",
+    "movement_batches",
+    "snapshots",
+}
+
+CATEGORIES = [
+    "Antibiotique", "Antalgique", "Antipaludéen",
+    "Antifongique", "Antiviral", "Antihypertenseur"
+]
+
 
 class InventorySimulator(InventoryAgent):
     """Simulator for generating test data covering all StockAggregations scenarios."""
 
+    def __init__(
+        self, seed: Optional[int] = None, database: Optional[str] = None
+    ):
+        super().__init__()
+        if database is not None:
+            self.db = self.client[database]
+        self.seed = seed
+        self.rng = random.Random(seed)
+
     def reset_database(self):
         """Clear all collections to start fresh."""
         self.db.products.delete_many({})
         self.db.movements.delete_many({})
         self.db.stocks.delete_many({})
         self.db.stock_thresholds.delete_many({})
+        self.drop_derived_data()
 
-    def update_stock(self, product_id: str, movement: StockMovement):
-        """Update stock quantity based on movement type."""
-        stock = self.db.stocks.find_one({"product_id": product_id})
-        quantity = stock["quantity"] if stock else 0
+    def drop_derived_data(self):
+        """Drop what was computed from the previous data.
+
+        Audit checkpoints, forecasts and snapshots would otherwise be
+        served, or replayed against, as if they described the new data.
+        """
+        for name in self.db.list_collection_names():
+            if name in DERIVED_COLLECTIONS or is_snapshot_collection(name):
+                self.db.drop_collection(name)
 
-        if movement.movement_type in ["ENTREE", "RETOUR"]:
-            quantity += movement.quantity
-        elif movement.movement_type in ["SORTIE", "RUPTURE"]:
-            quantity -= movement.quantity
-        quantity = max(quantity, 0)
+    def invalidate_cache(self):
+        """Bump the collection versions so the API drops cached analyses."""
+        self.db[VERSIONS].bulk_write(
+            version_updates(
+                "products", "movements", "stocks", "stock_thresholds"
+            )
+        )
 
+    def update_stock(self, product_id: str, movement: StockMovement):
+        """Update stock quantity based on movement type."""
         self.db.stocks.update_one(
             {"product_id": product_id},
-            {"$set": {"quantity": quantity, "last_update": datetime.utcnow()}},
+            clamped_increment(
+                stock_deltas([movement])[product_id], datetime.utcnow()
+            ),
             upsert=True,
         )
 
+    def sync_stock_levels(self):
+        """Copy the thresholds onto the stocks and set their alert level."""
+        self.db.stock_thresholds.aggregate(threshold_sync_pipeline())
+        self.db.stocks.update_many(
+            {"critical_stock": {"$exists": False}}, [alert_level_stage()]
+        )
+
     def create_base_products(self, count: int = 10) -> List[str]:
         """Create base products with random attributes."""
         product_ids = []
-        categories = [
-            "Antibiotique", "Antalgique", "Antipaludéen",
-            "Antifongique", "Antiviral", "Antihypertenseur"
-        ]
 
         for i in range(1, count + 1):
             p = Product(
                 id=f"P00{i}",
                 name=f"Produit-{i}",
-                category=random.choice(categories),
+                category=self.rng.choice(CATEGORIES),
                 batch_number=f"BATCH00{i}",
-                expiration_date=date.today() + timedelta(days=random.randint(60, 180)),
-                unit_price=round(random.uniform(500, 5000), 2),
+                expiration_date=date.today() + timedelta(days=self.rng.randint(60, 180)),
+                unit_price=round(self.rng.uniform(500, 5000), 2),
             )
             self.db.products.insert_one(to_bson_safe_dict(p))
             product_ids.append(p.id)
@@ -58,7 +121,7 @@ class InventorySimulator(InventoryAgent):
             # Initialize stock
             stock = StockItem(
                 product_id=p.id,
-                quantity=random.randint(10, 50),
+                quantity=self.rng.randint(10, 50),
                 last_update=datetime.utcnow()
             )
             self.db.stocks.insert_one(to_bson_safe_dict(stock))
@@ -66,8 +129,8 @@ class InventorySimulator(InventoryAgent):
             # Set stock thresholds
             threshold = StockThreshold(
                 product_id=p.id,
-                minimum_stock=random.randint(5, 15),
-                critical_stock=random.randint(2, 5)
+                minimum_stock=self.rng.randint(5, 15),
+                critical_stock=self.rng.randint(2, 5)
             )
             self.db.stock_thresholds.insert_one(to_bson_safe_dict(threshold))
 
@@ -82,7 +145,7 @@ class InventorySimulator(InventoryAgent):
                 name=f"Expiring-{i}",
                 category="Test",
                 batch_number=f"BATCH-EXP{i}",
-                expiration_date=date.today() + timedelta(days=random.randint(1, 30)),
+                expiration_date=date.today() + timedelta(days=self.rng.randint(1, 30)),
                 unit_price=1000
             )
             self.db.products.insert_one(to_bson_safe_dict(p))
@@ -90,7 +153,7 @@ class InventorySimulator(InventoryAgent):
 
             stock = StockItem(
                 product_id=p.id,
-                quantity=random.randint(1, 5),
+                quantity=self.rng.randint(1, 5),
                 last_update=datetime.utcnow()
             )
             self.db.stocks.insert_one(to_bson_safe_dict(stock))
@@ -121,7 +184,7 @@ class InventorySimulator(InventoryAgent):
 
             stock = StockItem(
                 product_id=p.id,
-                quantity=random.randint(1, 3),  # Low quantity
+                quantity=self.rng.randint(1, 3),  # Low quantity
                 last_update=datetime.utcnow()
             )
             self.db.stocks.insert_one(to_bson_safe_dict(stock))
@@ -152,7 +215,7 @@ class InventorySimulator(InventoryAgent):
 
             stock = StockItem(
                 product_id=p.id,
-                quantity=random.randint(20, 30),
+                quantity=self.rng.randint(20, 30),
                 last_update=datetime.utcnow()
             )
             self.db.stocks.insert_one(to_bson_safe_dict(stock))
@@ -177,11 +240,11 @@ class InventorySimulator(InventoryAgent):
                 # Generate regular movements
                 movements = [
                     StockMovement(
-                        movement_type=random.choice(["ENTREE", "SORTIE"]),
+                        movement_type=self.rng.choice(["ENTREE", "SORTIE"]),
                         product_id=product_id,
-                        quantity=random.randint(1, 10),
+                        quantity=self.rng.randint(1, 10),
                         date=datetime.combine(
-                            ref_date + timedelta(days=random.randint(0, 29)),
+                            ref_date + timedelta(days=self.rng.randint(0, 29)),
                             datetime.min.time(),
                         ),
                         reason="simulation",
@@ -195,9 +258,9 @@ class InventorySimulator(InventoryAgent):
                         StockMovement(
                             movement_type="RUPTURE",
                             product_id=product_id,
-                            quantity=random.randint(1, 5),
+                            quantity=self.rng.randint(1, 5),
                             date=datetime.combine(
-                                ref_date + timedelta(days=random.randint(0, 29)),
+                                ref_date + timedelta(days=self.rng.randint(0, 29)),
                                 datetime.min.time(),
                             ),
                             reason="simulation_stockout",
@@ -228,9 +291,198 @@ class InventorySimulator(InventoryAgent):
         
         # Generate movement history
         self.generate_movements(all_products, months)
+        self.sync_stock_levels()
+        self.invalidate_cache()
+
+    def run_bulk(
+        self,
+        products: int = 50_000,
+        months: int = 6,
+        movements_per_month: int = 5,
+        workers: Optional[int] = None,
+        batch_size: int = 10_000,
+        block_size: int = 1_000,
+    ) -> Dict[str, int]:
+        """Fill the database at load-test scale.
+
+        Products are generated in fixed-size blocks spread over a process
+        pool. Each block is seeded from the simulator seed and its index,
+        so the data does not depend on the number of workers. Stock
+        balances are computed in memory while the movements are generated.
+        Everything is written with unordered insert_many batches into
+        dropped collections, and the indexes are rebuilt once at the end.
+        """
+        start = time.perf_counter()
+        for name in ("products", "movements", "stocks", "stock_thresholds"):
+            self.db.drop_collection(name)
+        self.drop_derived_data()
+
+        base_seed = self.seed if self.seed is not None else random.getrandbits(32)
+        jobs = [
+            (
+                first,
+                min(first + block_size, products),
+                months,
+                movements_per_month,
+                batch_size,
+                base_seed + index,
+                self.db.name,
+            )
+            for index, first in enumerate(range(0, products, block_size))
+        ]
+        totals: Dict[str, int] = {}
+        with ProcessPoolExecutor(
+            max_workers=workers or os.cpu_count(),
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as pool:
+            for counts in pool.map(generate_block, jobs):
+                for name, count in counts.items():
+                    totals[name] = totals.get(name, 0) + count
+
+        for collection, models in INDEXES.items():
+            self.db[collection].create_indexes(models)
+        self.invalidate_cache()
+
+        elapsed = time.perf_counter() - start
+        LOGGER.info(
+            "Generated %s in %.1fs (%.0f documents/min)",
+            totals,
+            elapsed,
+            sum(totals.values()) / elapsed * 60,
+        )
+        return totals
 
     def init_inventory():
         """Initialize the inventory simulator."""
         simulator = InventorySimulator()
         simulator.run()
-        return simulator
\ No newline at end of file
+        return simulator
+
+
+# --- Bulk generation ---
+
+_WORKER_CLIENT: Optional[MongoClient] = None
+
+
+def generate_block(
+    job: Tuple[int, int, int, int, int, int, str]
+) -> Dict[str, int]:
+    """Generate and insert the products first..last of a bulk run.
+
+    Runs in a worker process; returns the number of documents written per
+    collection.
+    """
+    global _WORKER_CLIENT
+    first, last, months, movements_per_month, batch_size, seed, database = job
+    if _WORKER_CLIENT is None:
+        _WORKER_CLIENT = MongoClient(SETTINGS.mongodb_url)
+    db = _WORKER_CLIENT[database]
+    rng = random.Random(seed)
+
+    now = datetime.utcnow()
+    today = datetime.combine(date.today(), datetime.min.time())
+    start_date = today - timedelta(days=months * 30)
+    products, stocks, thresholds, movements = [], [], [], []
+    inserted_movements = 0
+
+    for i in range(first, last):
+        product_id = f"P{i:07d}"
+        products.append(
+            {
+                "id": product_id,
+                "name": f"Produit-{i}",
+                "category": rng.choice(CATEGORIES),
+                "dosage": None,
+                "batch_number": f"BATCH{i:07d}",
+                "expiration_date": today + timedelta(days=rng.randint(1, 180)),
+                "unit_price": round(rng.uniform(500, 5000), 2),
+                "supplier": None,
+                "regulatory_class": "Ordinaire",
+            }
+        )
+        threshold = {
+            "minimum_stock": rng.randint(5, 15),
+            "critical_stock": rng.randint(2, 5),
+        }
+        thresholds.append({"product_id": product_id, **threshold})
+
+        # Same rules as update_stock, replayed in memory.
+        quantity = rng.randint(10, 50)
+        for month in range(months):
+            ref_date = start_date + timedelta(days=month * 30)
+            types = [
+                rng.choice(("ENTREE", "SORTIE"))
+                for _ in range(movements_per_month)
+            ]
+            if i % 10 == 0:  # high consumption products run out
+                types.append("RUPTURE")
+            for movement_type in types:
+                moved = rng.randint(1, 10)
+                movements.append(
+                    {
+                        "movement_type": movement_type,
+                        "product_id": product_id,
+                        "quantity": moved,
+                        "date": ref_date + timedelta(days=rng.randint(0, 29)),
+                        "reason": "simulation",
+                        "destination": None,
+                    }
+                )
+                if movement_type in INCOMING:
+                    quantity += moved
+                elif movement_type in OUTGOING:
+                    quantity = max(quantity - moved, 0)
+
+        stock = {
+            "product_id": product_id,
+            "quantity": quantity,
+            "last_update": now,
+            "location": "Magasin principal",
+            **threshold,
+        }
+        level = stock_level(quantity, **threshold)
+        if level is not None:
+            stock["alert_level"] = level
+        stocks.append(stock)
+        if len(movements) >= batch_size:
+            db.movements.insert_many(movements, ordered=False)
+            inserted_movements += len(movements)
+            movements = []
+
+    if movements:
+        db.movements.insert_many(movements, ordered=False)
+        inserted_movements += len(movements)
+    for name, documents in (
+        ("products", products),
+        ("stocks", stocks),
+        ("stock_thresholds", thresholds),
+    ):
+        if documents:
+            db[name].insert_many(documents, ordered=False)
+    return {
+        "products": len(products),
+        "stocks": len(stocks),
+        "stock_thresholds": len(thresholds),
+        "movements": inserted_movements,
+    }
+
+
+def seed_inventory(
+    bulk: bool = False,
+    products: int = 50_000,
+    months: int = 6,
+    movements_per_month: int = 5,
+    workers: Optional[int] = None,
+    seed: Optional[int] = None,
+):
+    """Fill the database with simulated inventory data."""
+    daiquiri.setup(level=SETTINGS.log_level)  # type: ignore
+    simulator = InventorySimulator(seed)
+    if bulk:
+        simulator.run_bulk(products, months, movements_per_month, workers)
+    else:
+        simulator.run(months)
+
+
+def main():
+    typer.run(seed_inventory)
@@ -0,0 +1,256 @@
+import time
+from typing import AsyncIterator, NamedTuple, Optional
+
+import daiquiri
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from opentelemetry import trace
+from opentelemetry.trace import Span, Status, StatusCode
+
+from pharma.context import count_tokens
+from pharma.metrics import (
+    LLM_ERRORS,
+    LLM_REQUEST_SECONDS,
+    LLM_REQUESTS_IN_FLIGHT,
+    LLM_TIME_TO_FIRST_TOKEN,
+    LLM_TOKENS,
+)
+from pharma.services.llm_backends import (
+    Completion,
+    LLMBackend,
+    Messages,
+    create_backend,
+)
+from pharma.services.llm_cache import (
+    CachedCompletion,
+    ResponseCache,
+    completion_key,
+)
+from pharma.settings import SETTINGS
+
+LOGGER = daiquiri.getLogger(__name__)
+
+TRACER = trace.get_tracer("pharma")
+
+SYSTEM_PROMPT = "Tu es un assistant pharmacien intelligent."
+ERROR_MESSAGE = "Sorry, I encountered an error. Please try again later."
+COMPLETION_PARAMS = {
+    "max_tokens": 512,
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "stop": ["</s>"],  # If you want to use a stop sequence (adjust as needed)
+}
+
+_backend: Optional[LLMBackend] = None
+_cache: Optional[ResponseCache] = None
+
+
+def get_llm() -> LLMBackend:
+    """Process-wide backend selected by SETTINGS.llm_backend."""
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+    return _backend
+
+
+async def close_llm():
+    global _backend
+    if _backend is not None:
+        await _backend.close()
+        _backend = None
+
+
+def setup_llm_cache(db: Optional[AsyncIOMotorDatabase] = None):
+    """Create the response cache; db enables the shared Mongo tier."""
+    global _cache
+    _cache = None
+    if SETTINGS.llm_cache_maxsize > 0:
+        _cache = ResponseCache(
+            SETTINGS.llm_cache_maxsize,
+            SETTINGS.llm_cache_ttl,
+            collection=(
+                db.llm_responses
+                if db is not None and SETTINGS.llm_cache_shared
+                else None
+            ),
+            threshold=(
+                SETTINGS.llm_semantic_threshold
+                if SETTINGS.llm_semantic_cache
+                else None
+            ),
+        )
+
+
+class _Lookup(NamedTuple):
+    key: str
+    scope: Optional[str]
+    cached: Optional[CachedCompletion]
+
+
+async def _lookup(
+    prompt: str, system_prompt: str, question: Optional[str]
+) -> Optional[_Lookup]:
+    """Cache lookup; question is the user's part of the prompt, if any."""
+    if _cache is None:
+        return None
+    model = get_llm().model
+    key = completion_key(model, COMPLETION_PARAMS, system_prompt, prompt)
+    scope = None
+    if question:
+        scope = completion_key(
+            model,
+            COMPLETION_PARAMS,
+            system_prompt,
+            prompt.replace(question, "", 1),
+        )
+    return _Lookup(key, scope, await _cache.lookup(key, scope, question))
+
+
+async def _store(
+    lookup: Optional[_Lookup],
+    question: Optional[str],
+    text: str,
+    start: float,
+    tokens: int,
+):
+    if lookup is not None and text and text != ERROR_MESSAGE:
+        await _cache.store(  # type: ignore
+            lookup.key,
+            CachedCompletion(text, time.perf_counter() - start, tokens),
+            lookup.scope,
+            question,
+        )
+
+
+def _start_span(mode: str, lookup: Optional[_Lookup]) -> Span:
+    return TRACER.start_span(
+        f"llm.{mode}",
+        attributes={
+            "gen_ai.system": SETTINGS.llm_backend,
+            "gen_ai.request.model": get_llm().model,
+            "llm.cache_hit": lookup is not None and lookup.cached is not None,
+        },
+    )
+
+
+def _fail(span: Span, error: Exception):
+    LLM_ERRORS.labels(SETTINGS.llm_backend, type(error).__name__).inc()
+    span.record_exception(error)
+    span.set_status(Status(StatusCode.ERROR, type(error).__name__))
+
+
+def _observe(
+    mode: str,
+    start: float,
+    messages: Messages,
+    completion: Completion,
+    span: Span,
+):
+    """Record a completed LLM call; prompt tokens are estimated if unknown."""
+    backend = SETTINGS.llm_backend
+    prompt_tokens = completion.prompt_tokens or sum(
+        count_tokens(message["content"]) for message in messages
+    )
+    LLM_REQUEST_SECONDS.labels(backend, mode).observe(
+        time.perf_counter() - start
+    )
+    LLM_TOKENS.labels(backend, "prompt").observe(prompt_tokens)
+    LLM_TOKENS.labels(backend, "completion").observe(
+        completion.completion_tokens
+    )
+    span.set_attribute("gen_ai.usage.input_tokens", prompt_tokens)
+    span.set_attribute(
+        "gen_ai.usage.output_tokens", completion.completion_tokens
+    )
+
+
+async def generate_response(
+    prompt: str,
+    system_prompt: str = SYSTEM_PROMPT,
+    question: Optional[str] = None,
+) -> str:
+    lookup = await _lookup(prompt, system_prompt, question)
+    span = _start_span("complete", lookup)
+    with trace.use_span(span, end_on_exit=True):
+        if lookup is not None and lookup.cached is not None:
+            return lookup.cached.text
+
+        # Format the prompt for a conversational AI system
+        formatted_prompt = [
+            {"role": "system", "content": system_prompt.strip()},
+            {"role": "user", "content": prompt.strip()},
+        ]
+
+        start = time.perf_counter()
+        in_flight = LLM_REQUESTS_IN_FLIGHT.labels(SETTINGS.llm_backend)
+        in_flight.inc()
+        try:
+            completion = await get_llm().complete(
+                formatted_prompt, COMPLETION_PARAMS
+            )
+        except Exception as e:
+            # Handle backend errors (e.g., rate limit, network, full queue)
+            _fail(span, e)
+            LOGGER.error("An error occurred: %s", e)
+            return ERROR_MESSAGE
+        finally:
+            in_flight.dec()
+
+        _observe("complete", start, formatted_prompt, completion, span)
+        await _store(
+            lookup, question, completion.text, start, completion.tokens
+        )
+        return completion.text
+
+
+async def stream_response(
+    prompt: str,
+    system_prompt: str = SYSTEM_PROMPT,
+    question: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """Yield the completion text as it is generated.
+
+    The full text is assembled as well, so it can be logged and cached once
+    complete. A cached completion is yielded as a single chunk.
+    """
+    lookup = await _lookup(prompt, system_prompt, question)
+    # Not made current: the generator is resumed from other contexts.
+    span = _start_span("stream", lookup)
+    try:
+        if lookup is not None and lookup.cached is not None:
+            yield lookup.cached.text
+            return
+
+        formatted_prompt = [
+            {"role": "system", "content": system_prompt.strip()},
+            {"role": "user", "content": prompt.strip()},
+        ]
+        parts = []
+        start = time.perf_counter()
+        in_flight = LLM_REQUESTS_IN_FLIGHT.labels(SETTINGS.llm_backend)
+        in_flight.inc()
+        try:
+            async for token in get_llm().stream(
+                formatted_prompt, COMPLETION_PARAMS
+            ):
+                if not parts:
+                    LLM_TIME_TO_FIRST_TOKEN.observe(
+                        time.perf_counter() - start
+                    )
+                    span.add_event("first_token")
+                parts.append(token)
+                yield token
+        except Exception as e:
+            _fail(span, e)
+            LOGGER.error("An error occurred: %s", e)
+            yield ERROR_MESSAGE
+            return
+        finally:
+            in_flight.dec()
+        text = "".join(parts).strip()
+        LOGGER.debug("LLM response: %s", text)
+        # Usage is not reported on streams; each chunk is about one token.
+        completion = Completion(text, 0, len(parts))
+        _observe("stream", start, formatted_prompt, completion, span)
+        await _store(lookup, question, text, start, completion.tokens)
+    finally:
+        span.end()
@@ -0,0 +1,281 @@
+"""Completion backends behind pharma.services.llm.
+
+SETTINGS.llm_backend selects one per process:
+
+- "openai": any OpenAI-compatible API through a pooled AsyncOpenAI client.
+- "llama_cpp": a local GGUF model run by llama-cpp-python on CPU. The
+  model file is memory-mapped once per process and served by
+  llama_workers threads, each owning a llama.cpp context. Requests wait in
+  a bounded queue; a worker takes up to llama_dedup_size of them at once
+  and generates identical requests a single time (request deduplication,
+  not multi-sequence batching: distinct requests run one after the
+  other). The system prompt, shared by every request, stays in each
+  context's prefix cache.
+"""
+
+import abc
+import asyncio
+import json
+import os
+import queue
+import threading
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional
+
+import daiquiri
+import httpx
+from openai import AsyncOpenAI
+
+from pharma.metrics import LLAMA_QUEUE_DEPTH
+from pharma.settings import SETTINGS
+
+LOGGER = daiquiri.getLogger(__name__)
+
+Messages = List[Dict[str, str]]
+
+
+class Completion(NamedTuple):
+    text: str
+    # 0 when the backend does not report it.
+    prompt_tokens: int
+    completion_tokens: int
+
+    @property
+    def tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+class BackendBusyError(Exception):
+    """The local model's request queue is full."""
+
+
+class BackendClosedError(Exception):
+    """The backend was closed before the request was served."""
+
+
+class LLMBackend(abc.ABC):
+    """Chat completion interface used by generate_response."""
+
+    # Model name, part of the response cache key.
+    model: str = ""
+
+    @abc.abstractmethod
+    async def complete(
+        self, messages: Messages, params: Dict[str, Any]
+    ) -> Completion:
+        """The whole completion of messages."""
+
+    @abc.abstractmethod
+    def stream(
+        self, messages: Messages, params: Dict[str, Any]
+    ) -> AsyncIterator[str]:
+        """The completion of messages, token by token."""
+
+    async def close(self):
+        pass
+
+
+class OpenAIBackend(LLMBackend):
+    def __init__(self):
+        self.model = SETTINGS.llm_model
+        # The httpx pool is reused by all requests.
+        self.client = AsyncOpenAI(
+            api_key=SETTINGS.openai_api_key,
+            base_url=SETTINGS.openai_base_url,
+            timeout=SETTINGS.llm_timeout,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=SETTINGS.llm_max_connections,
+                    max_keepalive_connections=SETTINGS.llm_max_connections,
+                ),
+                timeout=SETTINGS.llm_timeout,
+            ),
+        )
+
+    async def complete(
+        self, messages: Messages, params: Dict[str, Any]
+    ) -> Completion:
+        response = await self.client.chat.completions.create(
+            model=self.model, messages=messages, **params
+        )
+        usage = response.usage
+        return Completion(
+            response.choices[0].message.content.strip(),
+            usage.prompt_tokens if usage else 0,
+            usage.completion_tokens if usage else 0,
+        )
+
+    async def stream(
+        self, messages: Messages, params: Dict[str, Any]
+    ) -> AsyncIterator[str]:
+        stream = await self.client.chat.completions.create(
+            model=self.model, messages=messages, stream=True, **params
+        )
+        try:
+            async for chunk in stream:
+                token = (
+                    chunk.choices[0].delta.content if chunk.choices else None
+                )
+                if token:
+                    yield token
+        finally:
+            await stream.close()
+
+    async def close(self):
+        await self.client.close()
+
+
+# Sent after the last token of a job.
+_DONE = object()
+
+
+class _Job:
+    """One queued request; the worker thread feeds its asyncio queue."""
+
+    def __init__(self, messages: Messages, params: Dict[str, Any]):
+        self.key = json.dumps([messages, params], sort_keys=True)
+        self.messages = messages
+        self.params = params
+        self.loop = asyncio.get_running_loop()
+        self.events: asyncio.Queue = asyncio.Queue()
+        self.cancelled = False
+
+    def emit(self, event: Any):
+        if not self.cancelled:
+            self.loop.call_soon_threadsafe(self.events.put_nowait, event)
+
+
+class LlamaCppBackend(LLMBackend):
+    def __init__(self):
+        if not SETTINGS.llama_model_path:
+            raise ValueError("LLAMA_MODEL_PATH is required by llama_cpp")
+        self.model = os.path.basename(SETTINGS.llama_model_path)
+        self.workers = max(1, SETTINGS.llama_workers)
+        self.threads = SETTINGS.llama_threads or max(
+            1, (os.cpu_count() or 1) // self.workers
+        )
+        self._jobs: queue.Queue = queue.Queue(SETTINGS.llama_queue_size)
+        LLAMA_QUEUE_DEPTH.set_function(self._jobs.qsize)
+        self._stopped = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"llama-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _load(self):
+        # Imported here so that the OpenAI backend does not need the
+        # native library.
+        from llama_cpp import Llama, LlamaRAMCache
+
+        llm = Llama(
+            model_path=SETTINGS.llama_model_path,
+            n_ctx=SETTINGS.llama_n_ctx,
+            n_batch=SETTINGS.llama_n_batch,
+            n_threads=self.threads,
+            use_mmap=True,
+            verbose=False,
+        )
+        llm.set_cache(LlamaRAMCache())
+        return llm
+
+    def _work(self):
+        llm = None
+        while not self._stopped.is_set():
+            try:
+                taken = [self._jobs.get(timeout=1)]
+            except queue.Empty:
+                continue
+            while len(taken) < SETTINGS.llama_dedup_size:
+                try:
+                    taken.append(self._jobs.get_nowait())
+                except queue.Empty:
+                    break
+
+            # Identical requests share one generation.
+            groups: Dict[str, List[_Job]] = {}
+            for job in taken:
+                if not job.cancelled:
+                    groups.setdefault(job.key, []).append(job)
+            for jobs in groups.values():
+                if self._stopped.is_set():
+                    for job in jobs:
+                        job.emit(BackendClosedError("Local model closed"))
+                    continue
+                try:
+                    if llm is None:
+                        llm = self._load()
+                    self._generate(llm, jobs)
+                except Exception as e:
+                    for job in jobs:
+                        job.emit(e)
+
+    @staticmethod
+    def _generate(llm: Any, jobs: List[_Job]):
+        for chunk in llm.create_chat_completion(
+            messages=jobs[0].messages, stream=True, **jobs[0].params
+        ):
+            token = chunk["choices"][0]["delta"].get("content")
+            if not token:
+                continue
+            for job in jobs:
+                job.emit(token)
+            if all(job.cancelled for job in jobs):
+                break
+        for job in jobs:
+            job.emit(_DONE)
+
+    async def stream(
+        self, messages: Messages, params: Dict[str, Any]
+    ) -> AsyncIterator[str]:
+        if self._stopped.is_set():
+            raise BackendClosedError("Local model closed")
+        job = _Job(messages, params)
+        try:
+            self._jobs.put_nowait(job)
+        except queue.Full:
+            raise BackendBusyError("Local model queue is full")
+        try:
+            while True:
+                event = await job.events.get()
+                if isinstance(event, Exception):
+                    raise event
+                if event is _DONE:
+                    return
+                yield event
+        finally:
+            job.cancelled = True
+
+    async def complete(
+        self, messages: Messages, params: Dict[str, Any]
+    ) -> Completion:
+        parts = [token async for token in self.stream(messages, params)]
+        # llama.cpp streams one token per chunk.
+        return Completion("".join(parts).strip(), 0, len(parts))
+
+    def _fail_queued(self):
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                return
+            job.emit(BackendClosedError("Local model closed"))
+
+    async def close(self):
+        """Fail the queued requests, then wait for the workers to stop.
+
+        A generation in progress runs to its end; requests queued after
+        the first pass are failed once the workers are gone.
+        """
+        self._stopped.set()
+        self._fail_queued()
+        for thread in self._threads:
+            await asyncio.to_thread(thread.join)
+        self._fail_queued()
+
+
+BACKENDS = {"openai": OpenAIBackend, "llama_cpp": LlamaCppBackend}
+
+
+def create_backend(name: Optional[str] = None) -> LLMBackend:
+    return BACKENDS[name or SETTINGS.llm_backend]()
@@ -0,0 +1,218 @@
+"""Completion cache for the LLM routes.
+
+Completions are keyed on the model, the sampling parameters and the
+whitespace-normalized prompts. The exact tier is an in-process LRU with a
+TTL, optionally backed by the llm_responses collection so that every
+uvicorn worker shares it. The semantic tier (opt-in) reuses a /llm/chat
+answer when the question is a near duplicate of one already answered over
+the same context; questions are embedded locally as bags of words and
+character trigrams, so no embedding model or API call is involved.
+"""
+
+import hashlib
+import json
+import math
+import re
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, NamedTuple, Optional, Tuple
+
+import daiquiri
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import PyMongoError
+
+from pharma.metrics import (
+    LLM_CACHE_HITS,
+    LLM_CACHE_MISSES,
+    LLM_CACHE_SAVED_SECONDS,
+    LLM_CACHE_SAVED_TOKENS,
+)
+
+LOGGER = daiquiri.getLogger(__name__)
+
+Embedding = Dict[str, float]
+
+
+class CachedCompletion(NamedTuple):
+    text: str
+    # What generating it cost, credited to the metrics on every hit.
+    seconds: float
+    tokens: int
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+def completion_key(model: str, params: Dict[str, Any], *prompts: str) -> str:
+    """Stable hash of a completion request."""
+    payload = json.dumps(
+        [model, params, [normalize(prompt) for prompt in prompts]],
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def embed(text: str) -> Embedding:
+    """Unit-length sparse vector of word and character trigram counts."""
+    text = normalize(text).lower()
+    features = Counter(f"w:{word}" for word in re.findall(r"\w+", text))
+    padded = f" {text} "
+    features.update(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+    norm = math.sqrt(sum(count * count for count in features.values()))
+    return {feature: count / norm for feature, count in features.items()}
+
+
+def similarity(a: Embedding, b: Embedding) -> float:
+    """Cosine similarity of two embeddings."""
+    if len(b) < len(a):
+        a, b = b, a
+    return sum(weight * b.get(feature, 0.0) for feature, weight in a.items())
+
+
+class _LRU:
+    """Ordered mapping evicting the least recently used and expired keys."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key: Any) -> Any:
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Any, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def items(self) -> Iterator[Tuple[Any, Any]]:
+        now = time.monotonic()
+        for key, (expires, value) in list(self._entries.items()):
+            if expires >= now:
+                yield key, value
+
+    def clear(self):
+        self._entries.clear()
+
+
+class ResponseCache:
+    """Exact, shared and semantic tiers of the completion cache.
+
+    Args:
+        maxsize (int): Completions kept in memory, per tier.
+        ttl (float): Lifetime of a completion, in seconds.
+        collection (Optional[AsyncIOMotorCollection]): Shared tier, or None
+            to keep completions in this process only.
+        threshold (Optional[float]): Cosine similarity from which two chat
+            questions are the same question, or None to disable the
+            semantic tier.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        collection: Optional[AsyncIOMotorCollection] = None,
+        threshold: Optional[float] = None,
+    ):
+        self.ttl = ttl
+        self.collection = collection
+        self.threshold = threshold
+        self._exact = _LRU(maxsize, ttl)
+        self._semantic = _LRU(maxsize, ttl)
+
+    @staticmethod
+    def _hit(tier: str, entry: CachedCompletion) -> CachedCompletion:
+        LLM_CACHE_HITS.labels(tier).inc()
+        LLM_CACHE_SAVED_SECONDS.inc(entry.seconds)
+        LLM_CACHE_SAVED_TOKENS.inc(entry.tokens)
+        return entry
+
+    async def lookup(
+        self,
+        key: str,
+        scope: Optional[str] = None,
+        question: Optional[str] = None,
+    ) -> Optional[CachedCompletion]:
+        """Cached completion for key, or for a near-identical question.
+
+        scope identifies everything in the prompt but the question; the
+        semantic tier only compares questions within the same scope.
+        """
+        entry = self._exact.get(key)
+        if entry is not None:
+            return self._hit("memory", entry)
+
+        if self.collection is not None:
+            try:
+                doc = await self.collection.find_one(
+                    {
+                        "_id": key,
+                        "created_at": {
+                            "$gt": datetime.utcnow()
+                            - timedelta(seconds=self.ttl)
+                        },
+                    }
+                )
+            except PyMongoError as e:
+                LOGGER.warning("LLM cache lookup failed: %s", e)
+                doc = None
+            if doc is not None:
+                entry = CachedCompletion(
+                    doc["text"], doc["seconds"], doc["tokens"]
+                )
+                self._exact.set(key, entry)
+                return self._hit("mongo", entry)
+
+        if self.threshold is not None and scope and question:
+            vector = embed(question)
+            best, best_score = None, self.threshold
+            for (entry_scope, _), (other, entry) in self._semantic.items():
+                if entry_scope != scope:
+                    continue
+                score = similarity(vector, other)
+                if score >= best_score:
+                    best, best_score = entry, score
+            if best is not None:
+                return self._hit("semantic", best)
+
+        LLM_CACHE_MISSES.inc()
+        return None
+
+    async def store(
+        self,
+        key: str,
+        entry: CachedCompletion,
+        scope: Optional[str] = None,
+        question: Optional[str] = None,
+    ):
+        self._exact.set(key, entry)
+        if self.threshold is not None and scope and question:
+            self._semantic.set(
+                (scope, normalize(question)), (embed(question), entry)
+            )
+        if self.collection is not None:
+            try:
+                await self.collection.replace_one(
+                    {"_id": key},
+                    {**entry._asdict(), "created_at": datetime.utcnow()},
+                    upsert=True,
+                )
+            except PyMongoError as e:
+                LOGGER.warning("LLM cache write failed: %s", e)
+
+    def clear(self):
+        self._exact.clear()
+        self._semantic.clear()
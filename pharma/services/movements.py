@@ -0,0 +1,321 @@
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+import daiquiri
+from bson import ObjectId
+from motor.motor_asyncio import (
+    AsyncIOMotorClientSession,
+    AsyncIOMotorDatabase,
+)
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from pharma.metrics import (
+    MOVEMENT_BATCH_SECONDS,
+    MOVEMENT_BATCH_SIZE,
+    MOVEMENTS_INGESTED,
+)
+from pharma.models import StockMovement
+from pharma.pipelines import inventory_audit_pipeline
+from pharma.schemas.movements import MovementBatchReport
+from pharma.services.alerts import alert_level_stage, sync_stock_levels
+from pharma.services.cache import VERSIONS, bump_versions, next_version
+from pharma.settings import SETTINGS
+from pharma.utils import to_bson_safe_dict
+
+LOGGER = daiquiri.getLogger(__name__)
+
+INCOMING = ("ENTREE", "RETOUR")
+OUTGOING = ("SORTIE", "RUPTURE")
+BATCH_LEASE = timedelta(seconds=SETTINGS.movement_batch_lease)
+
+# Counter in VERSIONS numbering the ingested batches.
+INGEST_SEQ = "ingest_seq"
+# Longest a batch can take to commit once numbered: with_transaction
+# retries for up to 120 seconds.
+BATCH_COMMIT_WINDOW = timedelta(minutes=5)
+
+
+class BatchInProgressError(Exception):
+    """A batch with the same idempotency key is still being written."""
+
+
+def stock_deltas(movements: List[StockMovement]) -> Dict[str, int]:
+    """Net stock change per product; TRANSFERT leaves the quantity as is."""
+    deltas: Dict[str, int] = defaultdict(int)
+    for m in movements:
+        if m.movement_type in INCOMING:
+            deltas[m.product_id] += m.quantity
+        elif m.movement_type in OUTGOING:
+            deltas[m.product_id] -= m.quantity
+        else:
+            deltas.setdefault(m.product_id, 0)
+    return deltas
+
+
+def clamped_increment(delta: int, now: datetime) -> List[Dict[str, Any]]:
+    """Update pipeline adding delta to the stock, never going below zero.
+
+    A single pipeline update is atomic on the document, so concurrent
+    batches on the same product cannot lose each other's changes. The
+    stock's alert_level follows the new quantity in the same update.
+    """
+    return [
+        {
+            "$set": {
+                "quantity": {
+                    "$max": [
+                        0,
+                        {"$add": [{"$ifNull": ["$quantity", 0]}, delta]},
+                    ]
+                },
+                "last_update": now,
+            }
+        },
+        alert_level_stage(),
+    ]
+
+
+async def reserve_batch(
+    db: AsyncIOMotorDatabase, key: str, owner: ObjectId, now: datetime
+) -> Optional[MovementBatchReport]:
+    """Take the lease on an idempotency key, or return its stored report.
+
+    A key is free when new, or when the worker holding it let its lease
+    expire without writing a report, e.g. because it crashed.
+
+    Raises:
+        BatchInProgressError: Another worker holds a live lease.
+    """
+    lease = {"owner": owner, "lease_until": now + BATCH_LEASE}
+    try:
+        await db.movement_batches.insert_one(
+            {"_id": key, "created_at": now, "report": None, **lease}
+        )
+        return None
+    except DuplicateKeyError:
+        pass
+    taken = await db.movement_batches.update_one(
+        {"_id": key, "report": None, "lease_until": {"$lt": now}},
+        {"$set": lease},
+    )
+    if taken.modified_count:
+        LOGGER.warning("Took over the expired batch %s", key)
+        return None
+    batch = await db.movement_batches.find_one({"_id": key})
+    if batch and batch["report"]:
+        return MovementBatchReport(**{**batch["report"], "replayed": True})
+    raise BatchInProgressError(key)
+
+
+async def ingest_movements(
+    db: AsyncIOMotorDatabase,
+    movements: List[StockMovement],
+    idempotency_key: Optional[str] = None,
+) -> MovementBatchReport:
+    """Write a batch of movements and apply them to the stocks.
+
+    Movements go in with one unordered insert_many, stocks with one
+    unordered bulk_write holding an upsert per product, both in one
+    transaction (so a replica set): a batch is applied entirely or not
+    at all. Its movements carry the batch's ingest_seq, on which audit
+    checkpoints are keyed; it is taken before the transaction so that
+    concurrent batches do not conflict on the counter, and batches may
+    commit out of order. With an idempotency key, the report is written
+    in the same transaction, by the worker holding the key's lease only;
+    a batch sent again after it succeeded returns the stored report, and
+    one whose worker died can be retried once the lease expires.
+    """
+    now = datetime.utcnow()
+    owner = ObjectId()
+    if idempotency_key is not None:
+        replayed = await reserve_batch(db, idempotency_key, owner, now)
+        if replayed is not None:
+            return replayed
+
+    start = time.perf_counter()
+    deltas = stock_deltas(movements)
+    product_ids = list(deltas)
+    documents = [to_bson_safe_dict(m) for m in movements]
+    if movements:
+        seq = await next_version(db, INGEST_SEQ)
+        for document in documents:
+            document["ingest_seq"] = seq
+
+    async def write(session: AsyncIOMotorClientSession):
+        inserted = 0
+        upserted: Dict[int, Any] = {}
+        if movements:
+            result = await db.movements.insert_many(
+                documents, ordered=False, session=session
+            )
+            inserted = len(result.inserted_ids)
+            written = await db.stocks.bulk_write(
+                [
+                    UpdateOne(
+                        {"product_id": product_id},
+                        clamped_increment(deltas[product_id], now),
+                        upsert=True,
+                    )
+                    for product_id in product_ids
+                ],
+                ordered=False,
+                session=session,
+            )
+            upserted = written.upserted_ids
+        elapsed = time.perf_counter() - start
+        report = MovementBatchReport(
+            received=len(movements),
+            inserted=inserted,
+            products_updated=len(deltas),
+            elapsed_ms=elapsed * 1000,
+            movements_per_second=inserted / elapsed if elapsed else 0.0,
+        )
+        if idempotency_key is not None:
+            done = await db.movement_batches.update_one(
+                {"_id": idempotency_key, "owner": owner},
+                {"$set": {"report": report.dict()}},
+                session=session,
+            )
+            if not done.matched_count:
+                # Our lease expired and another worker took the batch.
+                raise BatchInProgressError(idempotency_key)
+        return report, upserted
+
+    try:
+        async with await db.client.start_session() as session:
+            report, upserted = await session.with_transaction(write)
+    except Exception:
+        if idempotency_key is not None:
+            # Nothing was written: let the client retry right away.
+            await db.movement_batches.delete_one(
+                {"_id": idempotency_key, "owner": owner, "report": None}
+            )
+        raise
+
+    if upserted:
+        # New stocks: copy their thresholds, if any.
+        await sync_stock_levels(db, [product_ids[i] for i in upserted])
+    if movements:
+        await bump_versions(db, "movements", "stocks")
+
+    MOVEMENTS_INGESTED.inc(report.inserted)
+    MOVEMENT_BATCH_SIZE.observe(len(movements))
+    MOVEMENT_BATCH_SECONDS.observe(report.elapsed_ms / 1000)
+    LOGGER.info(
+        "Ingested %d movements for %d products in %.1fms",
+        report.inserted,
+        len(deltas),
+        report.elapsed_ms,
+    )
+    return report
+
+
+def missing_seqs(start: int, end: int, present: Iterable[int]) -> List[int]:
+    """Numbers in (start, end] that are not in present."""
+    missing = []
+    expected = start + 1
+    for seq in sorted(s for s in set(present) if start < s <= end):
+        missing.extend(range(expected, seq))
+        expected = seq + 1
+    missing.extend(range(expected, end + 1))
+    return missing
+
+
+async def checkpoint_inventory_audit(
+    db: AsyncIOMotorDatabase, tolerance: int = 5
+) -> Optional[datetime]:
+    """
+    Save the stock quantities as the audit checkpoint if the audit is clean.
+
+    The audit, the copy of the stocks and the ingest_seq counter are read
+    from one snapshot (so a replica set). Batches numbered up to the
+    counter but not committed yet are saved as pending: an audit from
+    this checkpoint replays them with every later batch. Pending batches
+    that have not committed within BATCH_COMMIT_WINDOW never will and are
+    dropped. The copy replaces the previous checkpoint at once, through a
+    rename. Movements written outside ingest_movements have no ingest_seq
+    and are only audited in full.
+
+    Args:
+        db (AsyncIOMotorDatabase): The database.
+        tolerance (int): Largest accepted absolute discrepancy.
+
+    Returns:
+        Optional[datetime]: Date of the new checkpoint, or None if the
+            audit found a discrepancy.
+    """
+    staging = db[f"audit_checkpoints_{ObjectId()}"]
+    try:
+        async with await db.client.start_session(snapshot=True) as session:
+            counter = await db[VERSIONS].find_one(
+                {"_id": INGEST_SEQ}, session=session
+            )
+            previous = await db.audit_checkpoints.find_one(
+                {}, {"date": 1, "seq": 1, "pending": 1}, session=session
+            ) or {"seq": 0, "pending": []}
+            discrepancies = await db.movements.aggregate(
+                inventory_audit_pipeline(
+                    tolerance,
+                    previous["seq"] if "date" in previous else None,
+                    limit=1,
+                    pending=previous.get("pending", []),
+                ),
+                session=session,
+            ).to_list(None)
+            if discrepancies:
+                return None
+
+            now = datetime.utcnow()
+            # As MongoDB stores it, so it can be passed back as `since`.
+            now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+            seq = counter["version"] if counter else 0
+            carried = previous.get("pending", [])
+            if carried and previous["date"] < now - BATCH_COMMIT_WINDOW:
+                carried = []
+            present = await db.movements.distinct(
+                "ingest_seq",
+                {
+                    "$or": [
+                        {"ingest_seq": {"$gt": previous["seq"], "$lte": seq}},
+                        {"ingest_seq": {"$in": carried}},
+                    ]
+                },
+                session=session,
+            )
+            pending = [s for s in carried if s not in present]
+            pending += missing_seqs(previous["seq"], seq, present)
+
+            await db.create_collection(staging.name)
+            batch = []
+            async for stock in db.stocks.find(
+                {},
+                {"_id": 0, "product_id": 1, "quantity": 1},
+                session=session,
+                batch_size=SETTINGS.export_batch_size,
+            ):
+                batch.append(
+                    {**stock, "date": now, "seq": seq, "pending": pending}
+                )
+                if len(batch) == SETTINGS.export_batch_size:
+                    await staging.insert_many(batch)
+                    batch = []
+            if batch:
+                await staging.insert_many(batch)
+        await db.client.admin.command(
+            "renameCollection",
+            f"{db.name}.{staging.name}",
+            to=f"{db.name}.audit_checkpoints",
+            dropTarget=True,
+        )
+    finally:
+        # Gone after a successful rename; left over on any failure.
+        await staging.drop()
+    LOGGER.info(
+        "Audit checkpoint at ingest_seq %d, %d batches pending",
+        seq,
+        len(pending),
+    )
+    return now
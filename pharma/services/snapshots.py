@@ -0,0 +1,321 @@
+"""Precomputed forecast and purchase proposal snapshots.
+
+A batch job runs the forecast pipeline with $out into new versioned
+collections (forecasts_v<N>, proposals_v<N>) and then points the
+"current" document of the snapshots collection at version N. Readers
+always follow that single document, so the swap is atomic. The
+previous version is kept for readers still paging through it; older
+ones are dropped.
+
+SnapshotScheduler runs the job in-process every snapshot_interval
+seconds. A lease in the snapshots collection makes sure only one
+uvicorn worker builds at a time; it lasts snapshot_lease seconds and the
+builder renews it, so a worker that dies mid-build does not hold up the
+others for a whole interval; a builder that loses it stops. The
+`snapshot` script runs it once, under the same lease. "current" only
+ever moves to a newer version.
+"""
+
+import asyncio
+import re
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Type, TypeVar
+
+import daiquiri
+import typer
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pydantic import BaseModel
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from pharma.models import ForecastResult, PurchaseProposal, list_adapter
+from pharma.monitoring import instrumented
+from pharma.pagination import keyset_filter
+from pharma.pipelines import forecast_consumption_pipeline
+from pharma.settings import SETTINGS
+
+LOGGER = daiquiri.getLogger(__name__)
+
+M = TypeVar("M", bound=BaseModel)
+
+SNAPSHOTS = "snapshots"
+_VERSIONED = re.compile(r"^(forecasts|proposals)_v(\d+)$")
+
+
+def is_snapshot_collection(name: str) -> bool:
+    """Whether name is a versioned forecasts_v<N> or proposals_v<N>."""
+    return _VERSIONED.match(name) is not None
+
+
+class SnapshotLeaseLost(Exception):
+    """Another worker took the build lease during a build."""
+
+
+class Snapshot(NamedTuple):
+    version: int
+    created_at: datetime
+
+    @property
+    def age(self) -> float:
+        """Seconds since the snapshot was built."""
+        return (datetime.utcnow() - self.created_at).total_seconds()
+
+    def collection(self, name: str) -> str:
+        return f"{name}_v{self.version}"
+
+
+def proposals_pipeline(date: datetime) -> List[Dict[str, Any]]:
+    """Forecast rows turned into PurchaseProposal documents."""
+    return forecast_consumption_pipeline() + [
+        {"$match": {"suggested_quantity": {"$gt": 0}}},
+        {
+            "$project": {
+                "product_id": 1,
+                "suggested_quantity": 1,
+                "based_on": {"$literal": "Prévision"},
+                "justification": {
+                    "$literal": "Basé sur la prévision de consommation moyenne"
+                },
+                "proposal_date": {"$literal": date},
+            }
+        },
+    ]
+
+
+async def current_snapshot(db: AsyncIOMotorDatabase) -> Optional[Snapshot]:
+    current = await db[SNAPSHOTS].find_one({"_id": "current"})
+    if current is None:
+        return None
+    return Snapshot(current["version"], current["created_at"])
+
+
+@instrumented("snapshots.build")
+async def build_snapshot(db: AsyncIOMotorDatabase) -> Snapshot:
+    """Compute a new snapshot version and make it current."""
+    counter = await db[SNAPSHOTS].find_one_and_update(
+        {"_id": "counter"},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    snapshot = Snapshot(counter["version"], datetime.utcnow())
+    pipelines = {
+        "forecasts": forecast_consumption_pipeline(),
+        "proposals": proposals_pipeline(snapshot.created_at),
+    }
+    for name, pipeline in pipelines.items():
+        target = snapshot.collection(name)
+        await db.movements.aggregate(pipeline + [{"$out": target}]).to_list(
+            None
+        )
+        await db[target].create_index("product_id", unique=True)
+
+    try:
+        # Never moves back: a build that took its version before the
+        # current one finished after it and is dropped.
+        await db[SNAPSHOTS].update_one(
+            {"_id": "current", "version": {"$lt": snapshot.version}},
+            {"$set": snapshot._asdict()},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        LOGGER.warning(
+            "Snapshot v%d superseded before it was made current",
+            snapshot.version,
+        )
+        for name in pipelines:
+            await db.drop_collection(snapshot.collection(name))
+        current = await db[SNAPSHOTS].find_one({"_id": "current"})
+        return Snapshot(current["version"], current["created_at"])
+
+    for name in await db.list_collection_names():
+        match = _VERSIONED.match(name)
+        if match and int(match.group(2)) < snapshot.version - 1:
+            await db.drop_collection(name)
+    LOGGER.info("Snapshot v%d built", snapshot.version)
+    return snapshot
+
+
+async def read_snapshot(
+    db: AsyncIOMotorDatabase,
+    snapshot: Snapshot,
+    name: str,
+    after: Optional[tuple] = None,
+    limit: Optional[int] = None,
+    fields: Optional[Set[str]] = None,
+) -> List[Dict[str, Any]]:
+    """One page of a snapshot collection, by product_id.
+
+    With fields, only those and the product_id sort key are read.
+    """
+    projection: Dict[str, Any] = {"_id": 0}
+    if fields:
+        projection.update({field: 1 for field in fields | {"product_id"}})
+    cursor = (
+        db[snapshot.collection(name)]
+        .find(keyset_filter(["product_id"], after), projection)
+        .sort("product_id")
+        .limit(limit or 0)
+    )
+    return await cursor.to_list(None)
+
+
+def snapshot_models(
+    model: Type[M], rows: List[Dict[str, Any]], fields: Optional[Set[str]]
+) -> List[M]:
+    """Rows as models, validated unless only some fields were read.
+
+    Projected rows lack required fields. They come from documents the
+    snapshot pipelines wrote and are built as they are.
+    """
+    if fields:
+        return [model.model_construct(**row) for row in rows]
+    return list_adapter(model).validate_python(rows)
+
+
+@instrumented("snapshots.forecasts")
+async def snapshot_forecasts(
+    db: AsyncIOMotorDatabase, snapshot: Snapshot, **page: Any
+) -> List[ForecastResult]:
+    rows = await read_snapshot(db, snapshot, "forecasts", **page)
+    return snapshot_models(ForecastResult, rows, page.get("fields"))
+
+
+@instrumented("snapshots.proposals")
+async def snapshot_proposals(
+    db: AsyncIOMotorDatabase, snapshot: Snapshot, **page: Any
+) -> List[PurchaseProposal]:
+    rows = await read_snapshot(db, snapshot, "proposals", **page)
+    return snapshot_models(PurchaseProposal, rows, page.get("fields"))
+
+
+class SnapshotScheduler:
+    """Rebuild the snapshot every interval seconds from the event loop."""
+
+    def __init__(
+        self,
+        db: AsyncIOMotorDatabase,
+        interval: float,
+        lease: float = SETTINGS.snapshot_lease,
+    ):
+        self.db = db
+        self.interval = interval
+        self.lease = lease
+        self.owner = uuid.uuid4().hex
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _lease(self) -> bool:
+        """Take or renew the build lease; False if another worker holds it."""
+        now = datetime.utcnow()
+        try:
+            await self.db[SNAPSHOTS].update_one(
+                {
+                    "_id": "lease",
+                    "$or": [{"until": {"$lte": now}}, {"owner": self.owner}],
+                },
+                {
+                    "$set": {
+                        "owner": self.owner,
+                        "until": now + timedelta(seconds=self.lease),
+                    }
+                },
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def _keep_lease(self):
+        """Renew the lease at a third of its length; return once lost."""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                if not await self._lease():
+                    return
+            except PyMongoError as e:
+                LOGGER.error("Snapshot lease renewal failed: %s", e)
+
+    async def _build(self) -> Snapshot:
+        """Build while renewing the lease; cancelled if the lease is lost."""
+        build = asyncio.create_task(build_snapshot(self.db))
+        keeper = asyncio.create_task(self._keep_lease())
+        try:
+            await asyncio.wait(
+                {build, keeper}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not build.done():
+                build.cancel()
+                await asyncio.gather(build, return_exceptions=True)
+                raise SnapshotLeaseLost(
+                    "Snapshot lease taken over by another worker"
+                )
+            return build.result()
+        finally:
+            build.cancel()
+            keeper.cancel()
+            await self.db[SNAPSHOTS].update_one(
+                {"_id": "lease", "owner": self.owner},
+                {"$set": {"until": datetime.utcnow()}},
+            )
+
+    async def build(self) -> Optional[Snapshot]:
+        """Build now under the lease; None if another worker holds it."""
+        if not await self._lease():
+            return None
+        return await self._build()
+
+    async def _run(self):
+        while True:
+            try:
+                snapshot = await current_snapshot(self.db)
+                due = snapshot is None or snapshot.age >= self.interval
+                if due and await self.build() is None:
+                    # Another worker is building: check back once its
+                    # lease could have expired.
+                    delay = self.lease
+                else:
+                    snapshot = await current_snapshot(self.db)
+                    delay = self.interval - (snapshot.age if snapshot else 0)
+            except Exception:
+                LOGGER.exception("Snapshot build failed")
+                delay = self.interval
+            await asyncio.sleep(max(delay, 1))
+
+
+def snapshot():
+    """Build a forecast and proposal snapshot now."""
+    daiquiri.setup(level=SETTINGS.log_level)  # type: ignore
+
+    async def run():
+        client = AsyncIOMotorClient(SETTINGS.mongodb_url)
+        scheduler = SnapshotScheduler(
+            client[SETTINGS.mongodb_name], SETTINGS.snapshot_interval
+        )
+        try:
+            if await scheduler.build() is None:
+                LOGGER.error("Another worker is building a snapshot")
+                raise typer.Exit(1)
+        finally:
+            client.close()
+
+    asyncio.run(run())
+
+
+def main():
+    typer.run(snapshot)
+
+
+if __name__ == "__main__":
+    main()
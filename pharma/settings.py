@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+from typing import Literal, Optional
+
 import daiquiri
 from pydantic import Field, ValidationInfo, field_validator
 from pydantic_settings import BaseSettings
@@ -26,15 +28,82 @@ class Settings(BaseSettings):
     metrics_url: str = "/metrics"
     api_port: int = 9090
     log_level: str = "INFO"
+    # Request log lines: "text", or "json" for one JSON record per line.
+    access_log_format: Literal["text", "json"] = "text"
+    # Share of requests logged, overridden per route path template, e.g.
+    # ACCESS_LOG_ROUTE_SAMPLE_RATES='{"/agent/forecast": 0.1}'.
+    access_log_sample_rate: float = 1.0
+    access_log_route_sample_rates: dict[str, float] = {}
+    # Slower requests, and server errors, are always logged in full.
+    access_log_slow_ms: float = 1000.0
     allow_origins: list[str] = []
     api_default_limit: int = 10
+    api_max_limit: int = 1000
+    # Documents per cursor batch and per chunk of /exports responses.
+    export_batch_size: int = 1000
     api_default_offset: int = 0
+    # Seconds a /movements/bulk Idempotency-Key stays reserved by the
+    # worker writing it; a retry after that takes the batch over.
+    movement_batch_lease: float = 60.0
+    # Expiry alert horizons in days; the first two are CRITICAL and
+    # WARNING, the others INFO.
+    expiry_horizons: list[int] = [7, 30, 90]
     debug: bool = False
     allow_credentials: bool = True
     allow_methods: list[str] = ["*"]
     allow_headers: list[str] = ["*"]
     mongodb_url: str = Field(..., env="MONGODB_URL")
     mongodb_name: str = "pharma"
+    forecast_history_days: int = 180
+    forecast_horizon_days: int = 30
+    # Seconds between forecast and proposal snapshot builds; 0 disables.
+    snapshot_interval: float = 6 * 60 * 60.0
+    # Seconds the worker building a snapshot holds the build lease without
+    # renewing it.
+    snapshot_lease: float = 60.0
+    agent_cache_maxsize: int = 256
+    agent_cache_ttl: float = 300.0
+    # Seconds a worker reuses the collection version counters before
+    # reading them again, i.e. how late it sees another worker's writes.
+    agent_cache_versions_ttl: float = 1.0
+    # Needs MongoDB change streams, i.e. a replica set.
+    live_alerts: bool = False
+    openai_api_key: Optional[str] = None
+    openai_base_url: Optional[str] = None
+    llm_model: str = "gpt-4"
+    llm_timeout: float = 60.0
+    llm_request_timeout: float = 90.0
+    # "openai" (any compatible API) or "llama_cpp" (local GGUF model).
+    llm_backend: Literal["openai", "llama_cpp"] = "openai"
+    llm_max_connections: int = 100
+    # Estimated tokens of forecasts and alerts listed in a prompt.
+    llm_context_tokens: int = 1500
+    llama_model_path: Optional[str] = None
+    llama_n_ctx: int = 4096
+    llama_n_batch: int = 512
+    # Each worker owns a llama.cpp context; threads default to the cores
+    # divided among workers.
+    llama_workers: int = 1
+    llama_threads: Optional[int] = None
+    llama_queue_size: int = 32
+    # Queued requests a worker takes at once; identical ones among them
+    # are generated a single time. Each distinct request is still
+    # generated on its own, one after the other.
+    llama_dedup_size: int = 4
+    # 0 disables the LLM response cache.
+    llm_cache_maxsize: int = 512
+    llm_cache_ttl: float = 300.0
+    # Share cached completions between workers through MongoDB.
+    llm_cache_shared: bool = False
+    llm_semantic_cache: bool = False
+    llm_semantic_threshold: float = 0.9
+    # "otlp" needs opentelemetry-exporter-otlp-proto-http; "file" writes
+    # one JSON span per line to otel_file.
+    otel_exporter: Literal["none", "otlp", "file"] = "none"
+    otel_endpoint: Optional[str] = None
+    otel_file: str = "traces.jsonl"
+    # Share of traces recorded, decided when a trace starts.
+    otel_sample_ratio: float = 0.05
 
     @field_validator("allow_origins")
     @classmethod
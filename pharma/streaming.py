@@ -0,0 +1,42 @@
+"""NDJSON encoding of report documents for StreamingResponse.
+
+/exports streams the cursor of a pharma.reports pipeline through ndjson,
+so a large report is never held in memory, nor copied by the JSON
+encoder.
+"""
+
+import json
+from datetime import date
+from typing import Any, AsyncIterator, Dict
+
+NDJSON = "application/x-ndjson"
+
+
+def _default(value: Any) -> str:
+    if isinstance(value, date):
+        return value.isoformat()
+    # ObjectId, Decimal128...
+    return str(value)
+
+
+def ndjson_line(document: Dict[str, Any]) -> str:
+    return json.dumps(document, default=_default, ensure_ascii=False) + "\n"
+
+
+async def ndjson(
+    documents: AsyncIterator[Dict[str, Any]], batch_size: int = 1000
+) -> AsyncIterator[str]:
+    """Encode documents as NDJSON, one chunk per batch_size lines.
+
+    The first document is sent on its own so the response starts at once.
+    """
+    lines = []
+    first = True
+    async for document in documents:
+        lines.append(ndjson_line(document))
+        if first or len(lines) >= batch_size:
+            yield "".join(lines)
+            lines = []
+            first = False
+    if lines:
+        yield "".join(lines)
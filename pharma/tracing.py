@@ -0,0 +1,185 @@
+"""OpenTelemetry tracing.
+
+setup_tracing() installs a tracer provider exporting to SETTINGS.otel_exporter:
+an OTLP/HTTP collector at otel_endpoint, or otel_file as JSON lines.
+Traces are sampled when they start, at otel_sample_ratio, and the
+decision is inherited by every child span and by the W3C traceparent of
+the caller, so unsampled requests only pay for no-op spans. Without an
+exporter nothing is installed and TRACER stays a no-op.
+
+Spans:
+
+- TracingMiddleware: one per HTTP request, named after its route;
+- mongo_operation (pharma.monitoring): one per named operation;
+- CommandSpans: one per MongoDB command, under the above;
+- pharma.services.llm: one per completion.
+"""
+
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import daiquiri
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SpanExporter,
+)
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from pymongo import monitoring
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from pharma.monitoring import TRACER, returned_documents
+from pharma.settings import SETTINGS
+
+LOGGER = daiquiri.getLogger(__name__)
+
+_provider: Optional[TracerProvider] = None
+
+
+def _exporter() -> SpanExporter:
+    if SETTINGS.otel_exporter == "otlp":
+        # Optional dependency, only needed with a collector.
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+            OTLPSpanExporter,
+        )
+
+        return OTLPSpanExporter(endpoint=SETTINGS.otel_endpoint)
+    return ConsoleSpanExporter(
+        out=open(SETTINGS.otel_file, "a", buffering=1),
+        formatter=lambda span: span.to_json(indent=None) + "\n",
+    )
+
+
+def setup_tracing() -> bool:
+    """Install the tracer provider; False when tracing is disabled."""
+    global _provider
+    if SETTINGS.otel_exporter == "none" or _provider is not None:
+        return _provider is not None
+    _provider = TracerProvider(
+        resource=Resource.create(
+            {
+                "service.name": SETTINGS.microservice,
+                "service.version": SETTINGS.version,
+                "deployment.environment": SETTINGS.environment,
+            }
+        ),
+        sampler=ParentBased(TraceIdRatioBased(SETTINGS.otel_sample_ratio)),
+    )
+    _provider.add_span_processor(BatchSpanProcessor(_exporter()))
+    trace.set_tracer_provider(_provider)
+    LOGGER.info(
+        "Tracing to %s, sampling %.1f%% of traces",
+        SETTINGS.otel_exporter,
+        SETTINGS.otel_sample_ratio * 100,
+    )
+    return True
+
+
+def shutdown_tracing():
+    """Export the spans still buffered."""
+    if _provider is not None:
+        _provider.shutdown()
+
+
+class TracingMiddleware:
+    """Server span per HTTP request, continuing the caller's trace."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = {
+            key.decode("latin-1"): value.decode("latin-1")
+            for key, value in scope["headers"]
+        }
+        with TRACER.start_as_current_span(
+            f"{scope['method']} {scope['path']}",
+            context=propagate.extract(headers),
+            kind=SpanKind.SERVER,
+            attributes={
+                "http.request.method": scope["method"],
+                "url.path": scope["path"],
+            },
+        ) as span:
+            if "x-amzn-trace-id" in headers:
+                span.set_attribute("aws.trace_id", headers["x-amzn-trace-id"])
+
+            async def send_with_status(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    span.set_attribute(
+                        "http.response.status_code", message["status"]
+                    )
+                    if message["status"] >= 500:
+                        span.set_status(Status(StatusCode.ERROR))
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                # Set by the router once the request is matched.
+                route = scope.get("route")
+                if route is not None:
+                    span.set_attribute("http.route", route.path)
+                    span.update_name(f"{scope['method']} {route.path}")
+
+
+class CommandSpans(monitoring.CommandListener):
+    """Client span per MongoDB command, under the current span.
+
+    Motor sends commands from executor threads that run in a copy of the
+    caller's context, so the current span is the caller's.
+    """
+
+    def __init__(self):
+        self._spans: Dict[Tuple[int, Any], trace.Span] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        if not trace.get_current_span().is_recording():
+            return
+        collection = event.command.get(event.command_name)
+        span = TRACER.start_span(
+            f"mongodb.{event.command_name}",
+            kind=SpanKind.CLIENT,
+            attributes={
+                "db.system": "mongodb",
+                "db.namespace": event.database_name,
+                "db.operation.name": event.command_name,
+                **(
+                    {"db.collection.name": collection}
+                    if isinstance(collection, str)
+                    else {}
+                ),
+            },
+        )
+        with self._lock:
+            self._spans[(event.request_id, event.connection_id)] = span
+
+    def _end(self, event) -> Optional[trace.Span]:
+        with self._lock:
+            return self._spans.pop(
+                (event.request_id, event.connection_id), None
+            )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        span = self._end(event)
+        if span is not None:
+            span.set_attribute(
+                "db.response.returned_rows", returned_documents(event.reply)
+            )
+            span.end()
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        span = self._end(event)
+        if span is not None:
+            span.set_status(Status(StatusCode.ERROR, str(event.failure)))
+            span.end()
@@ -1,5 +1,8 @@
+import json
 from datetime import date, datetime
+from typing import Any
 
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
 
 
@@ -10,3 +13,8 @@ def to_bson_safe_dict(model: BaseModel) -> dict:
         if isinstance(value, date) and not isinstance(value, datetime):
             data[key] = datetime.combine(value, datetime.min.time())
     return data
+
+
+def sse(event: str, data: Any) -> str:
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
@@ -0,0 +1,40 @@
+import os
+import uuid
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import PyMongoError
+
+# A single-node replica set, e.g.
+# mongod --replSet rs0 && mongosh --eval "rs.initiate()"
+TEST_MONGODB_URL = os.environ.get(
+    "TEST_MONGODB_URL", "mongodb://localhost:27017/?directConnection=true"
+)
+
+os.environ.setdefault("MONGODB_URL", TEST_MONGODB_URL)
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def replica_set():
+    """A scratch database on the TEST_MONGODB_URL replica set."""
+    client = AsyncIOMotorClient(
+        TEST_MONGODB_URL, serverSelectionTimeoutMS=1000
+    )
+    try:
+        hello = await client.admin.command("hello")
+    except PyMongoError as e:
+        client.close()
+        pytest.skip(f"No MongoDB at {TEST_MONGODB_URL}: {e}")
+    if "setName" not in hello:
+        client.close()
+        pytest.skip(f"{TEST_MONGODB_URL} is not a replica set")
+    db = client[f"pharma_test_{uuid.uuid4().hex[:8]}"]
+    yield db
+    await client.drop_database(db.name)
+    client.close()
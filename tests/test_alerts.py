@@ -0,0 +1,244 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from pharma.routers import alerts
+from pharma.services.agent import AsyncSmartInventoryAgent
+from pharma.services.alerts import AlertEngine, _Reload
+
+pytestmark = pytest.mark.anyio
+
+
+def change(collection, document, operation="update"):
+    return {
+        "ns": {"coll": collection},
+        "operationType": operation,
+        "fullDocument": document,
+    }
+
+
+def stock(product_id, quantity):
+    return change("stocks", {"product_id": product_id, "quantity": quantity})
+
+
+def rupture(product_id):
+    return change(
+        "movements",
+        {
+            "product_id": product_id,
+            "movement_type": "RUPTURE",
+            "quantity": 1,
+            "date": datetime(2026, 1, 1),
+        },
+        "insert",
+    )
+
+
+def engine_with(*changes, queue_size=1000):
+    engine = AlertEngine(
+        None, default_thresholds=(10, 5), queue_size=queue_size
+    )
+    for c in changes:
+        engine.apply(c)
+    return engine
+
+
+def kinds(engine):
+    return {
+        a.product_id: (a.alert_type, a.severity) for a in engine.snapshot()
+    }
+
+
+async def test_apply_follows_quantities_and_thresholds():
+    engine = engine_with(stock("A", 50), stock("B", 8), stock("C", 3))
+    assert kinds(engine) == {
+        "B": ("SEUIL_CRITIQUE", "WARNING"),
+        "C": ("SEUIL_CRITIQUE", "CRITICAL"),
+    }
+
+    engine.apply(
+        change(
+            "stock_thresholds",
+            {"product_id": "A", "minimum_stock": 60, "critical_stock": 20},
+        )
+    )
+    engine.apply(stock("C", 0))
+    engine.apply(stock("B", 30))
+    assert kinds(engine) == {
+        "A": ("SEUIL_CRITIQUE", "WARNING"),
+        "C": ("RUPTURE", "CRITICAL"),
+    }
+
+
+async def test_apply_publishes_only_changes():
+    engine = engine_with()
+    queue = engine.subscribe()
+    for c in (stock("A", 8), stock("A", 7), stock("A", 50)):
+        engine.apply(c)
+    events = [queue.get_nowait() for _ in range(queue.qsize())]
+    assert [e["op"] for e in events] == ["set", "set", "clear"]
+    assert "7 unités" in events[1]["alert"]["message"]
+
+
+async def test_rupture_holds_until_quantity_goes_up():
+    engine = engine_with(stock("A", 50))
+    engine.apply(rupture("A"))
+    # The stock update of the same batch must not clear it.
+    engine.apply(stock("A", 49))
+    engine.apply(
+        change(
+            "stock_thresholds",
+            {"product_id": "A", "minimum_stock": 5, "critical_stock": 1},
+        )
+    )
+    assert engine.alerts["A"].message == "Rupture signalée pour A"
+
+    engine.apply(stock("A", 60))
+    assert "A" not in engine.alerts
+    assert "A" not in engine.stockouts
+
+
+async def test_deletes_reload():
+    engine = engine_with(stock("A", 1))
+    with pytest.raises(_Reload):
+        engine.apply(change("stocks", None, "delete"))
+
+
+async def test_overflow_drops_the_subscriber():
+    engine = engine_with(queue_size=2)
+    slow = engine.subscribe()
+    for quantity in (9, 8, 7):
+        engine.apply(stock("A", quantity))
+    assert slow not in engine.subscribers
+    assert slow.get_nowait() is None
+    assert slow.empty()
+
+
+class FakeWebSocket:
+    """Sends the snapshot to nobody, then reports the client gone."""
+
+    def __init__(self, engine):
+        self.app = SimpleNamespace(alert_engine=engine)
+        self.sent = []
+        self.snapshot_sent = asyncio.Event()
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, data):
+        self.sent.append(data)
+        self.snapshot_sent.set()
+
+    async def receive(self):
+        await self.snapshot_sent.wait()
+        return {"type": "websocket.disconnect", "code": 1000}
+
+    async def close(self, code=1000, reason=None):
+        pass
+
+
+async def test_websocket_returns_when_the_client_leaves():
+    engine = engine_with(stock("A", 1))
+    engine.ready.set()
+    websocket = FakeWebSocket(engine)
+    # No alert changes: only reading the socket sees the client leave.
+    await asyncio.wait_for(alerts.alerts_websocket(websocket), 1)
+    assert websocket.sent[0]["op"] == "snapshot"
+    assert not engine.subscribers
+
+
+async def wait_for(predicate, timeout=10.0):
+    async with asyncio.timeout(timeout):
+        while not predicate():
+            await asyncio.sleep(0.05)
+
+
+async def test_load_then_watch(replica_set):
+    db = replica_set
+    await db.stocks.insert_many(
+        [
+            {"product_id": "A", "quantity": 3},
+            {"product_id": "B", "quantity": 40},
+        ]
+    )
+    await db.stock_thresholds.insert_one(
+        {"product_id": "B", "minimum_stock": 50, "critical_stock": 20}
+    )
+    engine = AlertEngine(db)
+    engine.start()
+    try:
+        await asyncio.wait_for(engine.ready.wait(), 10)
+        assert kinds(engine) == {
+            "A": ("SEUIL_CRITIQUE", "CRITICAL"),
+            "B": ("SEUIL_CRITIQUE", "WARNING"),
+        }
+        await db.stocks.update_one(
+            {"product_id": "A"}, {"$set": {"quantity": 30}}
+        )
+        await db.movements.insert_one(
+            {
+                "product_id": "B",
+                "movement_type": "RUPTURE",
+                "quantity": 1,
+                "date": datetime.utcnow(),
+            }
+        )
+        await wait_for(
+            lambda: "A" not in engine.alerts
+            and engine.alerts["B"].alert_type == "RUPTURE"
+        )
+    finally:
+        await engine.stop()
+
+
+async def test_resume_after_interruption(replica_set):
+    db = replica_set
+    await db.stocks.insert_one({"product_id": "A", "quantity": 50})
+    engine = AlertEngine(db)
+    engine.start()
+    await asyncio.wait_for(engine.ready.wait(), 10)
+    await db.stocks.update_one({"product_id": "A"}, {"$set": {"quantity": 2}})
+    await wait_for(lambda: "A" in engine.alerts)
+    await engine.stop()
+
+    # Missed while stopped: replayed from the resume token, not reloaded.
+    await db.stocks.update_one({"product_id": "A"}, {"$set": {"quantity": 9}})
+    loads = []
+
+    async def load():
+        loads.append(1)
+
+    engine.load = load
+    engine.start()
+    try:
+        await wait_for(lambda: "9 unités" in engine.alerts["A"].message)
+        assert loads == []
+    finally:
+        await engine.stop()
+
+
+async def test_critical_stocks_ignore_a_stale_level(replica_set):
+    db = replica_set
+    # Written without clamped_increment: no alert_level stored.
+    await db.stocks.insert_many(
+        [
+            {"product_id": "A", "quantity": 3},
+            {
+                "product_id": "B",
+                "quantity": 40,
+                "minimum_stock": 50,
+                "critical_stock": 20,
+            },
+            {"product_id": "C", "quantity": 400, "alert_level": "CRITICAL"},
+        ]
+    )
+    agent = AsyncSmartInventoryAgent(db)
+    alerts = await agent.detect_critical_stocks()
+    assert [(a.product_id, a.severity) for a in alerts] == [
+        ("A", "CRITICAL"),
+        ("B", "WARNING"),
+    ]
+    warnings = await agent.detect_critical_stocks(severity="WARNING")
+    assert [a.product_id for a in warnings] == ["B"]
@@ -0,0 +1,88 @@
+from datetime import datetime
+
+import pytest
+
+from pharma.services import cache
+from pharma.services.cache import VERSIONS, CachedInventoryAgent
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeVersions:
+    def __init__(self):
+        self.counters = {}
+        self.reads = 0
+
+    async def _documents(self):
+        for name, version in self.counters.items():
+            yield {"_id": name, "version": version}
+
+    def find(self, query):
+        self.reads += 1
+        return self._documents()
+
+
+class FakeAgent:
+    def __init__(self):
+        self.db = {VERSIONS: FakeVersions()}
+        self.calls = 0
+
+    async def detect_critical_stocks(self, limit=None):
+        self.calls += 1
+        return self.calls
+
+    async def detect_expiring_products(self, limit=None):
+        self.calls += 1
+        return self.calls
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+
+async def test_versions_read_once_per_interval(monkeypatch):
+    clock = Clock(100.0)
+    monkeypatch.setattr(cache, "time", clock)
+    agent = FakeAgent()
+    versions = agent.db[VERSIONS]
+    cached = CachedInventoryAgent(agent, 16, 300, versions_ttl=1.0)
+
+    assert await cached.detect_critical_stocks() == 1
+    assert await cached.detect_critical_stocks() == 1
+    assert versions.reads == 1
+
+    # Another worker's write is seen once the counters are read again.
+    versions.counters["stocks"] = 1
+    assert await cached.detect_critical_stocks() == 1
+    clock.now += 1.0
+    assert await cached.detect_critical_stocks() == 2
+    assert versions.reads == 2
+
+    # A write in this process is seen at once.
+    versions.counters["stocks"] = 2
+    cached.invalidate()
+    assert await cached.detect_critical_stocks() == 3
+    assert versions.reads == 3
+
+
+async def test_dated_analyses_expire_with_the_day(monkeypatch):
+    class Day(datetime):
+        today = datetime(2026, 1, 1, 23, 59)
+
+        @classmethod
+        def utcnow(cls):
+            return cls.today
+
+    monkeypatch.setattr(cache, "datetime", Day)
+    agent = FakeAgent()
+    cached = CachedInventoryAgent(agent, 16, 300, versions_ttl=60)
+
+    assert await cached.detect_expiring_products() == 1
+    assert await cached.detect_critical_stocks() == 2
+    Day.today = datetime(2026, 1, 2, 0, 1)
+    assert await cached.detect_expiring_products() == 3
+    assert await cached.detect_critical_stocks() == 2
@@ -0,0 +1,24 @@
+from datetime import datetime
+
+from pharma.context import alert_rank
+
+
+def test_critical_alerts_rank_before_warnings():
+    old = datetime(2026, 1, 1)
+    new = datetime(2026, 2, 1)
+    ranks = {
+        "warning rupture": alert_rank("RUPTURE", old, "WARNING"),
+        "critical expiry": alert_rank("PEREMPTION", new, "CRITICAL"),
+        "critical threshold": alert_rank("SEUIL_CRITIQUE", new, "CRITICAL"),
+        "old critical threshold": alert_rank(
+            "SEUIL_CRITIQUE", old, "CRITICAL"
+        ),
+        "no severity": alert_rank("RUPTURE", old),
+    }
+    assert sorted(ranks, key=ranks.get, reverse=True) == [
+        "old critical threshold",
+        "critical threshold",
+        "critical expiry",
+        "warning rupture",
+        "no severity",
+    ]
@@ -0,0 +1,55 @@
+from datetime import date
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from pharma.models import ConsumptionForecast
+from pharma.services.forecasting import croston, save_forecasts
+
+
+@pytest.mark.parametrize("first_day", [0, 1, 3])
+def test_croston_regular_demand(first_day):
+    demand = np.zeros((1, 180))
+    demand[0, first_day::4] = 4
+    assert croston(demand, 30) == pytest.approx([30.0])
+
+
+def test_croston_single_demand():
+    demand = np.zeros((2, 60))
+    demand[0, 10] = 6
+    assert croston(demand, 30).tolist() == [3.0, 0.0]
+
+
+class FakeForecasts:
+    def __init__(self, rows):
+        self.rows = {row["product_id"]: row for row in rows}
+
+    def bulk_write(self, requests, ordered):
+        for request in requests:
+            document = request._doc
+            self.rows[document["product_id"]] = document
+
+    def delete_many(self, query):
+        run = query["run"]["$ne"]
+        stale = [k for k, row in self.rows.items() if row.get("run") != run]
+        for product_id in stale:
+            del self.rows[product_id]
+        return SimpleNamespace(deleted_count=len(stale))
+
+
+def test_save_forecasts_deletes_stale_products():
+    db = SimpleNamespace(
+        consumption_forecasts=FakeForecasts(
+            [{"product_id": "OLD"}, {"product_id": "P1"}]
+        )
+    )
+    forecast = ConsumptionForecast(
+        product_id="P1",
+        predicted_quantity=3,
+        forecast_start=date(2026, 1, 1),
+        forecast_end=date(2026, 1, 31),
+    )
+    save_forecasts(db, [forecast], batch_size=1)
+    assert list(db.consumption_forecasts.rows) == ["P1"]
+    assert db.consumption_forecasts.rows["P1"]["predicted_quantity"] == 3
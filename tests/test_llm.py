@@ -0,0 +1,225 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+
+import httpx
+import pytest
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+from pharma.dependencies import get_snapshot
+from pharma.models import KPIReport
+from pharma.routers import llm as llm_router
+from pharma.services import llm
+from pharma.settings import SETTINGS
+
+pytestmark = pytest.mark.anyio
+
+
+async def chunks(model: str, delay: float):
+    """Two streamed tokens, the second one delay seconds after the first."""
+    for i, text in enumerate(["Ré", "ponse"]):
+        if i:
+            await asyncio.sleep(delay)
+        chunk = {
+            "id": "stub",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": model,
+            "choices": [
+                {"index": 0, "delta": {"content": text}, "finish_reason": None}
+            ],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def stub_app(state: dict) -> FastAPI:
+    """OpenAI-compatible chat completions answering after state["delay"]."""
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        if body.get("stream"):
+            return StreamingResponse(
+                chunks(body["model"], state["delay"]),
+                media_type="text/event-stream",
+            )
+        await asyncio.sleep(state["delay"])
+        return {
+            "id": "stub",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body["model"],
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "Réponse"},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": 10,
+                "completion_tokens": 1,
+                "total_tokens": 11,
+            },
+        }
+
+    return app
+
+
+@pytest.fixture(scope="module")
+def stub_llm():
+    """Base URL of a stub LLM server, and its mutable state."""
+    state = {"delay": 0.0}
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(
+        uvicorn.Config(
+            stub_app(state), host="127.0.0.1", port=port, log_level="error"
+        )
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{port}/v1", state
+    server.should_exit = True
+    thread.join()
+
+
+class FakeAgent:
+    """Agent whose analyses take delay seconds, counting overlaps."""
+
+    def __init__(self, delay: float = 0.1):
+        self.delay = delay
+        self.running = 0
+        self.most_running = 0
+        self.expiry_horizons = None
+
+    async def _analysis(self, result):
+        self.running += 1
+        self.most_running = max(self.most_running, self.running)
+        await asyncio.sleep(self.delay)
+        self.running -= 1
+        return result
+
+    async def detect_critical_stocks(self):
+        return await self._analysis([])
+
+    async def detect_expiring_products(self, horizons=None):
+        self.expiry_horizons = horizons
+        return await self._analysis([])
+
+    async def generate_kpi_report(self):
+        return await self._analysis(
+            KPIReport(total_ruptures=0, total_exits=0, top_products=[])
+        )
+
+
+@pytest.fixture
+async def app(stub_llm, monkeypatch):
+    base_url, state = stub_llm
+    state["delay"] = 0.0
+    monkeypatch.setattr(SETTINGS, "llm_backend", "openai")
+    monkeypatch.setattr(SETTINGS, "openai_base_url", base_url)
+    monkeypatch.setattr(SETTINGS, "openai_api_key", "test")
+    monkeypatch.setattr(llm, "_backend", None)
+    monkeypatch.setattr(llm, "_cache", None)
+    application = FastAPI()
+    application.include_router(llm_router.router)
+    application.agent = FakeAgent()
+    application.dependency_overrides[get_snapshot] = lambda: None
+    yield application
+    await llm.close_llm()
+
+
+async def get(app, path):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://test"
+    ) as client:
+        return await client.get(path)
+
+
+async def test_context_is_gathered_concurrently(app):
+    response = await get(app, "/llm/alerts")
+    assert response.status_code == 200
+    assert response.json()["response"] == "Réponse"
+    assert app.agent.most_running == 2
+
+
+async def test_prompts_leave_out_info_expiry_horizons(app):
+    await get(app, "/llm/alerts")
+    assert app.agent.expiry_horizons == (7, 30)
+
+
+async def test_timeout_is_504(app, stub_llm, monkeypatch):
+    stub_llm[1]["delay"] = 2.0
+    monkeypatch.setattr(SETTINGS, "llm_request_timeout", 0.3)
+    start = time.perf_counter()
+    response = await get(app, "/llm/kpi")
+    assert response.status_code == 504
+    assert time.perf_counter() - start < 2
+
+
+async def test_disconnect_is_499(app, stub_llm):
+    stub_llm[1]["delay"] = 2.0
+    messages = []
+    received = 0
+
+    async def receive():
+        nonlocal received
+        received += 1
+        if received == 1:
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.sleep(0.2)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/llm/kpi",
+        "raw_path": b"/llm/kpi",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "client": ("test", 1),
+        "server": ("test", 80),
+    }
+    await asyncio.wait_for(app(scope, receive, send), 2)
+    assert messages[0]["status"] == 499
+
+
+def events(body: str):
+    return [
+        line.split(": ", 1)[1]
+        for line in body.splitlines()
+        if line.startswith("event: ")
+    ]
+
+
+async def test_stream(app):
+    response = await get(app, "/llm/kpi?stream=true")
+    assert events(response.text) == ["prompt", "token", "token", "done"]
+
+
+async def test_stream_is_cut_at_the_deadline(app, stub_llm, monkeypatch):
+    stub_llm[1]["delay"] = 2.0
+    monkeypatch.setattr(SETTINGS, "llm_request_timeout", 0.5)
+    start = time.perf_counter()
+    response = await get(app, "/llm/kpi?stream=true")
+    assert response.status_code == 200
+    assert events(response.text) == ["prompt", "token", "error"]
+    assert time.perf_counter() - start < 1.5
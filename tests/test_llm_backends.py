@@ -0,0 +1,57 @@
+import asyncio
+import threading
+
+import pytest
+
+from pharma.services.llm_backends import (
+    BackendClosedError,
+    LLMBackend,
+    LlamaCppBackend,
+)
+from pharma.settings import SETTINGS
+
+pytestmark = pytest.mark.anyio
+
+
+class BlockingLlama:
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def create_chat_completion(self, messages, stream, **params):
+        self.started.set()
+        self.release.wait(5)
+        yield {"choices": [{"delta": {"content": messages[0]["content"]}}]}
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        LLMBackend()
+
+
+async def test_close_fails_queued_jobs(monkeypatch):
+    monkeypatch.setattr(SETTINGS, "llama_model_path", "/models/test.gguf")
+    monkeypatch.setattr(SETTINGS, "llama_workers", 1)
+    monkeypatch.setattr(SETTINGS, "llama_dedup_size", 1)
+    llama = BlockingLlama()
+    monkeypatch.setattr(LlamaCppBackend, "_load", lambda self: llama)
+    backend = LlamaCppBackend()
+
+    running = asyncio.create_task(
+        backend.complete([{"role": "user", "content": "first"}], {})
+    )
+    await asyncio.to_thread(llama.started.wait, 5)
+    queued = asyncio.create_task(
+        backend.complete([{"role": "user", "content": "second"}], {})
+    )
+    await asyncio.sleep(0.1)
+
+    closing = asyncio.create_task(backend.close())
+    with pytest.raises(BackendClosedError):
+        await asyncio.wait_for(queued, 1)
+    assert not closing.done()
+    llama.release.set()
+    await asyncio.wait_for(closing, 5)
+    assert (await running).text == "first"
+    with pytest.raises(BackendClosedError):
+        await backend.complete([{"role": "user", "content": "third"}], {})
@@ -0,0 +1,72 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from pharma.models import StockMovement
+from pharma.services.agent import AsyncSmartInventoryAgent
+from pharma.services.movements import (
+    checkpoint_inventory_audit,
+    ingest_movements,
+    missing_seqs,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+def movement(movement_type, product_id, quantity, expected=None):
+    return StockMovement(
+        movement_type=movement_type,
+        product_id=product_id,
+        quantity=quantity,
+        date=datetime(2026, 1, 1),
+        reason=None,
+        expected_quantity=expected,
+    )
+
+
+def test_missing_seqs():
+    assert missing_seqs(0, 6, [2, 5, 5, 9]) == [1, 3, 4, 6]
+    assert missing_seqs(3, 3, []) == []
+
+
+async def test_concurrent_batches(replica_set):
+    db = replica_set
+    await db.create_collection("movements")
+    await db.create_collection("stocks")
+    batches = [
+        [movement("ENTREE", f"P{i}", 10), movement("SORTIE", "SHARED", 1)]
+        for i in range(20)
+    ]
+    await ingest_movements(db, [movement("ENTREE", "SHARED", 100)])
+
+    reports = await asyncio.gather(
+        *(ingest_movements(db, batch) for batch in batches)
+    )
+
+    assert sum(report.inserted for report in reports) == 40
+    seqs = await db.movements.distinct("ingest_seq")
+    assert sorted(seqs) == list(range(1, 22))
+    shared = await db.stocks.find_one({"product_id": "SHARED"})
+    assert shared["quantity"] == 80
+
+    since = await checkpoint_inventory_audit(db)
+    assert since is not None
+    await ingest_movements(db, [movement("SORTIE", "P0", 4)])
+    agent = AsyncSmartInventoryAgent(db)
+    assert await agent.simulate_inventory_audit(since) == []
+
+
+async def test_deliveries_off_the_ordered_quantity(replica_set):
+    db = replica_set
+    await ingest_movements(
+        db,
+        [
+            movement("ENTREE", "A", 8, expected=10),
+            movement("ENTREE", "B", 10, expected=10),
+            movement("ENTREE", "C", 3),
+        ],
+    )
+    alerts = await AsyncSmartInventoryAgent(db).verify_deliveries()
+    assert [a.product_id for a in alerts] == ["A"]
+    assert "attendu=10, reçu=8" in alerts[0].message
@@ -0,0 +1,45 @@
+import pytest
+
+from pharma import aggregate
+from pharma.aggregations import StockAggregations
+from pharma.reports import Report, report_pipeline
+
+
+class FakeCollection:
+    """Collection recording the pipeline it aggregates."""
+
+    def __init__(self, name):
+        self.name = name
+        self.pipeline = None
+
+    def aggregate(self, pipeline):
+        self.pipeline = pipeline
+        return []
+
+
+def joined(pipeline):
+    return {
+        stage["$lookup"]["from"] for stage in pipeline if "$lookup" in stage
+    }
+
+
+def test_helpers_join_the_given_collections():
+    stocks = FakeCollection("stocks_copy")
+    products = FakeCollection("products_copy")
+    thresholds = FakeCollection("thresholds_copy")
+
+    aggregate.get_products_below_critical_threshold(
+        products, thresholds, stocks
+    )
+    assert joined(stocks.pipeline) == {"products_copy", "thresholds_copy"}
+
+    StockAggregations.get_expiring_products(products, stocks)
+    assert joined(products.pipeline) == {"stocks_copy"}
+
+
+def test_collections_are_not_report_parameters():
+    with pytest.raises(ValueError):
+        report_pipeline(Report.deliveries, products="other")
+    collection, pipeline = report_pipeline(Report.pre_order_forecast, months=1)
+    assert collection == "movements"
+    assert joined(pipeline) == {"products"}
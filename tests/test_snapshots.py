@@ -0,0 +1,128 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from pharma.services import snapshots
+from pharma.services.snapshots import SnapshotScheduler
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_scheduler_survives_unexpected_errors(monkeypatch):
+    calls = []
+
+    async def current_snapshot(db):
+        calls.append(len(calls))
+        if len(calls) == 3:
+            raise asyncio.CancelledError()
+        raise ValueError("bad document")
+
+    async def sleep(delay):
+        pass
+
+    monkeypatch.setattr(snapshots, "current_snapshot", current_snapshot)
+    monkeypatch.setattr(snapshots.asyncio, "sleep", sleep)
+    with pytest.raises(asyncio.CancelledError):
+        await SnapshotScheduler(None, 60)._run()
+    assert len(calls) == 3
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def sort(self, key):
+        return self
+
+    def limit(self, limit):
+        return self
+
+    async def to_list(self, length):
+        return self.rows
+
+
+class FakeCollection:
+    def __init__(self, rows):
+        self.rows = rows
+        self.projection = None
+
+    def find(self, query, projection):
+        self.projection = projection
+        fields = set(projection) - {"_id"}
+        return FakeCursor(
+            [
+                {k: v for k, v in row.items() if k in fields}
+                for row in self.rows
+            ]
+        )
+
+
+async def test_requested_fields_are_projected():
+    forecasts = FakeCollection(
+        [
+            {
+                "product_id": "P1",
+                "average_consumption": 1.5,
+                "suggested_quantity": 3,
+            }
+        ]
+    )
+    db = {"forecasts_v1": forecasts}
+    snapshot = snapshots.Snapshot(1, datetime.utcnow())
+    items = await snapshots.snapshot_forecasts(
+        db, snapshot, limit=2, fields={"suggested_quantity"}
+    )
+    assert forecasts.projection == {
+        "_id": 0,
+        "product_id": 1,
+        "suggested_quantity": 1,
+    }
+    assert items[0].model_dump(include={"suggested_quantity"}) == {
+        "suggested_quantity": 3
+    }
+
+
+class FakeSnapshots:
+    async def update_one(self, query, update, upsert=False):
+        pass
+
+
+async def test_build_stops_when_the_lease_is_lost(monkeypatch):
+    cancelled = asyncio.Event()
+    leases = iter([True, False])
+
+    async def build_snapshot(db):
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def lease():
+        return next(leases)
+
+    monkeypatch.setattr(snapshots, "build_snapshot", build_snapshot)
+    scheduler = SnapshotScheduler({snapshots.SNAPSHOTS: FakeSnapshots()}, 60)
+    scheduler.lease = 0.03
+    monkeypatch.setattr(scheduler, "_lease", lease)
+    with pytest.raises(snapshots.SnapshotLeaseLost):
+        await scheduler.build()
+    assert cancelled.is_set()
+
+
+async def test_current_never_moves_back(replica_set):
+    db = replica_set
+    await db.snapshots.insert_many(
+        [
+            {"_id": "counter", "version": 2},
+            {
+                "_id": "current",
+                "version": 5,
+                "created_at": datetime(2026, 1, 1),
+            },
+        ]
+    )
+    snapshot = await snapshots.build_snapshot(db)
+    assert snapshot.version == 5
+    assert "forecasts_v3" not in await db.list_collection_names()